@@ -3,10 +3,15 @@ import os
 import platform
 import tempfile
 
+import ctranslate2
 import pytest
 
 from faster_whisper import WhisperModel
 
+from open_dubbing import main
+from open_dubbing.command_line import CommandLine
+from open_dubbing.dubbing import load_pyannote_pipeline
+
 
 def tts_combinations_per_platform():
     if platform.system().lower() == "windows":
@@ -15,34 +20,77 @@ def tts_combinations_per_platform():
         return pytest.mark.parametrize("tts_engine", ["coqui", "edge", "mms"])
 
 
+@pytest.fixture(scope="session")
+def models():
+    """Models shared by all the tests, each one is loaded the first time it is used."""
+    return {}
+
+
 class TestCmd:
 
+    def _dub(self, models, argv):
+        """Dubs in-process, reusing the models loaded by previous tests."""
+        args = CommandLine.read_parameters(argv)
+        hugging_face_token = main.get_token(args.hugging_face_token)
+        if "stt" not in models:
+            tts, stt, translation = main.load_models(args)
+            models[args.tts] = tts
+            models["stt"] = stt
+            models["translation"] = translation
+            models["pyannote_pipeline"] = load_pyannote_pipeline(
+                hugging_face_token=hugging_face_token,
+                device=args.device,
+                precision=args.precision,
+            )
+        elif args.tts not in models:
+            models[args.tts] = main._create_tts(args)
+
+        main.dub(
+            args,
+            tts=models[args.tts],
+            stt=models["stt"],
+            translation=models["translation"],
+            hugging_face_token=hugging_face_token,
+            pyannote_pipeline=models["pyannote_pipeline"],
+        )
+
     # TODO: To check transcription out of the final video
     def _get_transcription(self, filename):
-        model = WhisperModel("medium")
-        segments, info = model.transcribe(filename, language="ca", temperature=[0])
+        if ctranslate2.get_cuda_device_count() > 0:
+            device, compute_type = "cuda", "int8_float16"
+        else:
+            device, compute_type = "cpu", "int8"
+
+        model = WhisperModel("medium", device=device, compute_type=compute_type)
+        segments, info = model.transcribe(
+            filename,
+            language="ca",
+            temperature=[0],
+            vad_filter=True,
+            vad_parameters=dict(min_silence_duration_ms=500),
+        )
         text = ""
         for segment in segments:
             text += segment.text
         return text.strip(), info.language
 
     @tts_combinations_per_platform()
-    def test_translations_with_tts(self, tts_engine):
+    def test_translations_with_tts(self, models, tts_engine):
         full_path = os.path.realpath(__file__)
         path, _ = os.path.split(full_path)
 
         _file = os.path.join(path, "englishvideo.mp4")
         with tempfile.TemporaryDirectory() as directory:
-            command = (
-                "open-dubbing "
-                f"--input_file={_file} "
-                f"--output_directory={directory} "
-                "--source_language=eng "
-                "--target_language=cat "
-                f"--tts={tts_engine}"
+            self._dub(
+                models,
+                [
+                    f"--input_file={_file}",
+                    f"--output_directory={directory}",
+                    "--source_language=eng",
+                    "--target_language=cat",
+                    f"--tts={tts_engine}",
+                ],
             )
-            cmd = f"cd {directory} && {command}"
-            os.system(cmd)
             operating = platform.system().lower()
 
             # ['- Bon dia. - Bé.', 'El meu nom és Jordi Mas.', 'Sóc de Barcelona.', "I m'encanta aquesta ciutat."]
@@ -13,20 +13,33 @@
 # limitations under the License.
 
 
+import logging
 import os
+import subprocess
 
+from concurrent.futures import ThreadPoolExecutor
 from typing import Final, Mapping, Sequence
 
+import numpy as np
 import torch
+import torchaudio
 
 from pyannote.audio import Pipeline
 from pydub import AudioSegment
+from pydub.utils import db_to_float, get_array_type
 
 _DEFAULT_DUBBED_VOCALS_AUDIO_FILE: Final[str] = "dubbed_vocals.mp3"
 _DEFAULT_DUBBED_AUDIO_FILE: Final[str] = "dubbed_audio"
 _DEFAULT_OUTPUT_FORMAT: Final[str] = ".mp3"
 _SUPPORTED_DEVICES: Final[tuple[str, str]] = ("cpu", "cuda")
 _TIMESTAMP_THRESHOLD: Final[float] = 0.001
+_MAX_FFMPEG_OUTPUTS_PER_CALL: Final[int] = 64
+_NORMALIZE_HEADROOM_DB: Final[float] = 0.1
+# ffmpeg codec used for each format of the intermediate chunk files
+_INTERMEDIATE_FORMAT_CODECS: Final[Mapping[str, str]] = {
+    "wav": "pcm_s16le",
+    "mp3": "libmp3lame",
+}
 
 
 def create_pyannote_timestamps(
@@ -34,9 +47,12 @@ def create_pyannote_timestamps(
     audio_file: str,
     pipeline: Pipeline,
     device: str = "cpu",
+    precision: str = "fp32",
 ) -> Sequence[Mapping[str, float]]:
     """Creates timestamps from a vocals file using Pyannote speaker diarization.
 
+    With 'fp16' precision on CUDA the models of the pipeline run under autocast.
+
     Returns:
         A list of dictionaries containing start and end timestamps for each
         speaker segment.
@@ -46,105 +62,321 @@ def create_pyannote_timestamps(
             "The device must be either (' or ').join(_SUPPORTED_DEVICES). Got:"
             f" {device}"
         )
+    if device == "cuda" and not torch.cuda.is_available():
+        logging.warning(
+            "audio_processing.create_pyannote_timestamps. CUDA is not available, running diarization on CPU"
+        )
+        device = "cpu"
+
+    # Passing the waveform already in memory prevents Pyannote from reading
+    # the file again for every segment that it crops
+    waveform, sample_rate = torchaudio.load(audio_file)
     if device == "cuda":
         pipeline.to(torch.device("cuda"))
-    diarization = pipeline(audio_file)
+        waveform = waveform.to(torch.device("cuda"))
+    with torch.autocast(
+        "cuda", dtype=torch.float16, enabled=device == "cuda" and precision == "fp16"
+    ):
+        diarization = pipeline({"waveform": waveform, "sample_rate": sample_rate})
+    # Integer milliseconds are kept along the seconds to avoid recomputing (and
+    # rounding differently) the chunk boundaries at every step
     utterance_metadata = [
-        {"start": segment.start, "end": segment.end, "speaker_id": speaker}
+        {
+            "start": segment.start,
+            "end": segment.end,
+            "start_ms": int(segment.start * 1000),
+            "end_ms": int(segment.end * 1000),
+            "speaker_id": speaker,
+        }
         for segment, _, speaker in diarization.itertracks(yield_label=True)
     ]
     return utterance_metadata
 
 
+def _slice_audio(
+    *, audio: AudioSegment, start_time_ms: int, end_time_ms: int
+) -> AudioSegment:
+    """Slices an audio segment directly from its raw PCM data.
+
+    Avoids the extra copies done by pydub when slicing with audio[start:end].
+    """
+    frame_rate = audio.frame_rate
+    frame_width = audio.frame_width
+    start_byte = (start_time_ms * frame_rate // 1000) * frame_width
+    end_byte = (end_time_ms * frame_rate // 1000) * frame_width
+    return AudioSegment(
+        data=audio.raw_data[start_byte:end_byte],
+        sample_width=audio.sample_width,
+        frame_rate=frame_rate,
+        channels=audio.channels,
+    )
+
+
 def _cut_and_save_audio(
     *,
     audio: AudioSegment,
     utterance: Mapping[str, str | float],
     prefix: str,
     output_directory: str,
+    output_format: str,
 ) -> str:
-    """Cuts a specified segment from an audio file, saves it as an MP3, and returns the path of the saved file.
+    """Cuts a specified segment from an audio file, saves it, and returns the path of the saved file.
 
     Args:
         audio: The audio file from which to extract the segment.
         utterance: A dictionary containing the start and end times of the segment
-          to be cut. - 'start': The start time of the segment in seconds. - 'end':
-          The end time of the segment in seconds.
+          to be cut. - 'start_ms': The start time of the segment in milliseconds.
+          - 'end_ms': The end time of the segment in milliseconds.
         prefix: A string to be used as a prefix in the filename of the saved audio
           segment.
         output_directory: The directory path where the cut audio segment will be
           saved.
+        output_format: The format of the saved file ('wav' or 'mp3').
 
     Returns:
-        The path of the saved MP3 file.
+        The path of the saved file.
     """
-    start_time_ms = int(utterance["start"] * 1000)
-    end_time_ms = int(utterance["end"] * 1000)
-    chunk = audio[start_time_ms:end_time_ms]
-    chunk_filename = f"{prefix}_{utterance['start']}_{utterance['end']}.mp3"
-    chunk_path = f"{output_directory}/{chunk_filename}"
-    chunk.export(chunk_path, format="mp3")
+    chunk = _slice_audio(
+        audio=audio,
+        start_time_ms=utterance["start_ms"],
+        end_time_ms=utterance["end_ms"],
+    )
+    chunk_path = _get_chunk_path(
+        utterance=utterance,
+        prefix=prefix,
+        output_directory=output_directory,
+        output_format=output_format,
+    )
+    chunk.export(chunk_path, format=output_format)
     return chunk_path
 
 
+def _get_chunk_path(
+    *,
+    utterance: Mapping[str, str | float],
+    prefix: str,
+    output_directory: str,
+    output_format: str,
+) -> str:
+    chunk_filename = f"{prefix}_{utterance['start']}_{utterance['end']}.{output_format}"
+    return f"{output_directory}/{chunk_filename}"
+
+
+def _cut_and_save_audio_with_ffmpeg(
+    *,
+    audio_file: str,
+    utterance_metadata: Sequence[Mapping[str, float]],
+    prefix: str,
+    output_directory: str,
+    output_format: str,
+) -> Sequence[str]:
+    """Cuts all the chunks with ffmpeg, decoding the input file once per call.
+
+    Each chunk is a separate output of the same ffmpeg invocation. The outputs
+    are grouped to keep the command line length under the platform limits.
+
+    Returns:
+        The paths of the saved files in the same order as the utterances.
+    """
+    codec = _INTERMEDIATE_FORMAT_CODECS[output_format]
+    chunk_paths = []
+    for i in range(0, len(utterance_metadata), _MAX_FFMPEG_OUTPUTS_PER_CALL):
+        command = ["ffmpeg", "-y", "-loglevel", "error", "-i", audio_file]
+        for utterance in utterance_metadata[i : i + _MAX_FFMPEG_OUTPUTS_PER_CALL]:
+            chunk_path = _get_chunk_path(
+                utterance=utterance,
+                prefix=prefix,
+                output_directory=output_directory,
+                output_format=output_format,
+            )
+            duration_ms = utterance["end_ms"] - utterance["start_ms"]
+            command.extend(
+                [
+                    "-map",
+                    "0:a",
+                    "-ss",
+                    f"{utterance['start_ms']}ms",
+                    "-t",
+                    f"{duration_ms}ms",
+                    "-c:a",
+                    codec,
+                    chunk_path,
+                ]
+            )
+            chunk_paths.append(chunk_path)
+        subprocess.run(command, capture_output=True, check=True)
+    return chunk_paths
+
+
+def _cut_and_save_audio_with_pydub(
+    *,
+    audio_file: str,
+    utterance_metadata: Sequence[Mapping[str, float]],
+    prefix: str,
+    output_directory: str,
+    output_format: str,
+) -> Sequence[str]:
+    """Cuts all the chunks with pydub, exporting them in parallel.
+
+    Exporting to MP3 runs an ffmpeg subprocess for each chunk, so the chunks
+    are exported using a pool of threads.
+
+    Returns:
+        The paths of the saved files in the same order as the utterances.
+    """
+    audio = AudioSegment.from_file(audio_file)
+
+    def _cut_and_save_utterance(utterance: Mapping[str, float]) -> str:
+        return _cut_and_save_audio(
+            audio=audio,
+            utterance=utterance,
+            prefix=prefix,
+            output_directory=output_directory,
+            output_format=output_format,
+        )
+
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        return list(executor.map(_cut_and_save_utterance, utterance_metadata))
+
+
 def run_cut_and_save_audio(
     *,
     utterance_metadata: Sequence[Mapping[str, float]],
     audio_file: str,
     output_directory: str,
+    output_format: str = "wav",
 ) -> Sequence[Mapping[str, float]]:
     """Cuts an audio file into chunks based on provided time ranges and saves each chunk to a file.
 
+    The chunks are intermediate files, WAV avoids encoding them to MP3 and
+    decoding them again in the next steps.
+
     Returns:
         A list of dictionaries, each containing the path to the saved chunk, and
         the original start and end times.
     """
 
-    audio = AudioSegment.from_file(audio_file)
     key = "path"
     prefix = "chunk"
-    updated_utterance_metadata = []
-    for utterance in utterance_metadata:
-        chunk_path = _cut_and_save_audio(
-            audio=audio,
-            utterance=utterance,
+    try:
+        chunk_paths = _cut_and_save_audio_with_ffmpeg(
+            audio_file=audio_file,
+            utterance_metadata=utterance_metadata,
+            prefix=prefix,
+            output_directory=output_directory,
+            output_format=output_format,
+        )
+    except (FileNotFoundError, subprocess.CalledProcessError) as e:
+        logging.warning(
+            f"audio_processing.run_cut_and_save_audio. Cannot cut audio with ffmpeg, using pydub: {e}"
+        )
+        chunk_paths = _cut_and_save_audio_with_pydub(
+            audio_file=audio_file,
+            utterance_metadata=utterance_metadata,
             prefix=prefix,
             output_directory=output_directory,
+            output_format=output_format,
         )
+
+    updated_utterance_metadata = []
+    for utterance, chunk_path in zip(utterance_metadata, chunk_paths):
         utterance_copy = utterance.copy()
         utterance_copy[key] = chunk_path
         updated_utterance_metadata.append(utterance_copy)
     return updated_utterance_metadata
 
 
+def _get_samples(audio: AudioSegment) -> np.ndarray:
+    """Returns the interleaved samples of an audio segment as float32."""
+    sample_type = get_array_type(audio.sample_width * 8)
+    return np.frombuffer(audio.raw_data, dtype=sample_type).astype(np.float32)
+
+
+def _clip(samples: np.ndarray, *, max_amplitude: int) -> np.ndarray:
+    return np.clip(samples, -max_amplitude, max_amplitude - 1, out=samples)
+
+
+def _normalize_and_apply_gain(
+    samples: np.ndarray, *, gain_db: float, max_amplitude: int
+) -> np.ndarray:
+    """Same as pydub's normalize followed by apply_gain, scaling the samples once.
+
+    The normalization sets the peak to 0.1 dB below the maximum amplitude.
+    """
+    # Using max and min avoids allocating a temporary array for np.abs
+    peak = max(samples.max(initial=0), -samples.min(initial=0))
+    factor = db_to_float(gain_db)
+    if peak > 0:
+        target_peak = max_amplitude * db_to_float(-_NORMALIZE_HEADROOM_DB)
+        factor *= target_peak / peak
+
+    samples *= factor
+    return _clip(samples, max_amplitude=max_amplitude)
+
+
+def _to_audio_segment(samples: np.ndarray, *, audio: AudioSegment) -> AudioSegment:
+    """Builds an audio segment from samples with the same format as audio."""
+    samples = _clip(samples, max_amplitude=audio.max_possible_amplitude)
+    sample_type = get_array_type(audio.sample_width * 8)
+    return AudioSegment(
+        data=samples.astype(sample_type).tobytes(),
+        sample_width=audio.sample_width,
+        frame_rate=audio.frame_rate,
+        channels=audio.channels,
+    )
+
+
 def insert_audio_at_timestamps(
     *,
     utterance_metadata: Sequence[Mapping[str, str | float]],
-    background_audio_file: str,
-    output_directory: str,
-) -> str:
-    """Inserts audio chunks into a background audio track at specified timestamps."""
-
-    background_audio = AudioSegment.from_mp3(background_audio_file)
-    total_duration = background_audio.duration_seconds
-    output_audio = AudioSegment.silent(duration=total_duration * 1000)
-    for item in utterance_metadata:
-        audio_chunk = AudioSegment.from_mp3(item["dubbed_path"])
-        start_time = int(item["start"] * 1000)
-        output_audio = output_audio.overlay(
-            audio_chunk, position=start_time, loop=False
-        )
-    dubbed_vocals_audio_file = os.path.join(
-        output_directory, _DEFAULT_DUBBED_VOCALS_AUDIO_FILE
+    background_audio: AudioSegment,
+    output_directory: str | None = None,
+) -> AudioSegment:
+    """Inserts audio chunks into a background audio track at specified timestamps.
+
+    The chunks are added into a single preallocated buffer with the same format
+    and duration as the background audio.
+
+    Returns:
+      The dubbed vocals, also saved in the output directory if one is given.
+    """
+
+    frame_rate = background_audio.frame_rate
+    channels = background_audio.channels
+    output_samples = np.zeros(
+        int(background_audio.frame_count()) * channels, dtype=np.float32
     )
-    output_audio.export(dubbed_vocals_audio_file, format="mp3")
-    return dubbed_vocals_audio_file
+
+    def _decode_chunk(item: Mapping[str, str | float]) -> np.ndarray:
+        audio_chunk = (
+            AudioSegment.from_file(item["dubbed_path"])
+            .set_frame_rate(frame_rate)
+            .set_channels(channels)
+            .set_sample_width(background_audio.sample_width)
+        )
+        return _get_samples(audio_chunk)
+
+    # Each decode runs in its own ffmpeg subprocess
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        decoded_chunks = executor.map(_decode_chunk, utterance_metadata)
+        for item, chunk_samples in zip(utterance_metadata, decoded_chunks):
+            start = (item["start_ms"] * frame_rate // 1000) * channels
+            end = min(start + len(chunk_samples), len(output_samples))
+            if start < end:
+                output_samples[start:end] += chunk_samples[: end - start]
+    output_audio = _to_audio_segment(output_samples, audio=background_audio)
+    if output_directory:
+        dubbed_vocals_audio_file = os.path.join(
+            output_directory, _DEFAULT_DUBBED_VOCALS_AUDIO_FILE
+        )
+        output_audio.export(dubbed_vocals_audio_file, format="mp3")
+    return output_audio
 
 
 def merge_background_and_vocals(
     *,
-    background_audio_file: str,
-    dubbed_vocals_audio_file: str,
+    background_audio: AudioSegment,
+    dubbed_vocals_audio: AudioSegment,
     output_directory: str,
     target_language: str,
     vocals_volume_adjustment: float = 5.0,
@@ -157,16 +389,27 @@ def merge_background_and_vocals(
       background audio.
     """
 
-    background = AudioSegment.from_mp3(background_audio_file)
-    vocals = AudioSegment.from_mp3(dubbed_vocals_audio_file)
-    background = background.normalize()
-    vocals = vocals.normalize()
-    background = background + background_volume_adjustment
-    vocals = vocals + vocals_volume_adjustment
-    shortest_length = min(len(background), len(vocals))
-    background = background[:shortest_length]
-    vocals = vocals[:shortest_length]
-    mixed_audio = background.overlay(vocals)
+    vocals = (
+        dubbed_vocals_audio.set_frame_rate(background_audio.frame_rate)
+        .set_channels(background_audio.channels)
+        .set_sample_width(background_audio.sample_width)
+    )
+    max_amplitude = background_audio.max_possible_amplitude
+    background_samples = _get_samples(background_audio)
+    vocals_samples = _get_samples(vocals)
+    background_samples = _normalize_and_apply_gain(
+        background_samples,
+        gain_db=background_volume_adjustment,
+        max_amplitude=max_amplitude,
+    )
+    vocals_samples = _normalize_and_apply_gain(
+        vocals_samples, gain_db=vocals_volume_adjustment, max_amplitude=max_amplitude
+    )
+    shortest_length = min(len(background_samples), len(vocals_samples))
+    mixed_samples = (
+        background_samples[:shortest_length] + vocals_samples[:shortest_length]
+    )
+    mixed_audio = _to_audio_segment(mixed_samples, audio=background_audio)
     target_language_suffix = "_" + target_language.replace("-", "_").lower()
     dubbed_audio_file = os.path.join(
         output_directory,
@@ -13,26 +13,77 @@
 # limitations under the License.
 
 import argparse
+import functools
+import re
 
 WHISPER_MODEL_NAMES = [
     "medium",
     "large-v3",
+    "large-v3-turbo",
+    "distil-large-v3",
+    "turbo",
+    "distil",
+]
+
+WHISPER_COMPUTE_TYPES = [
+    "int8",
+    "int8_float16",
+    "float16",
+    "float32",
+]
+
+WHISPER_CPP_QUANTS = [
+    "q5_0",
+    "q8_0",
+    "f16",
+]
+
+PRECISIONS = [
+    "fp32",
+    "fp16",
+    "int8",
+]
+
+TRANSLATION_PRECISIONS = [
+    "fp32",
+    "fp16",
+    "bf16",
+    "int8",
+]
+
+INTERMEDIATE_FORMATS = [
+    "wav",
+    "mp3",
 ]
 
 
 class CommandLine:
 
     @staticmethod
-    def read_parameters():
-        """Parses command-line arguments and runs the dubbing process."""
+    def _device(value: str) -> str:
+        if value in ("cpu", "cuda") or re.fullmatch(r"cuda:\d+", value):
+            return value
+
+        raise argparse.ArgumentTypeError(
+            f"invalid device '{value}', use 'cpu', 'cuda' or 'cuda:<index>'"
+        )
+
+    @staticmethod
+    @functools.lru_cache(maxsize=1)
+    def build_parser() -> argparse.ArgumentParser:
+        """Builds the parser once, parsing does not modify it."""
         parser = argparse.ArgumentParser(
             description="AI dubbing system which uses machine learning models to automatically translate and synchronize audio dialogue into different languages"
         )
         parser.add_argument(
             "--input_file",
-            required=True,
             help="Path to the input video file.",
         )
+        parser.add_argument(
+            "--input_file_list",
+            default=None,
+            help="Path to a text file with a video file per line. The models are loaded once and each video is dubbed into its own subdirectory of the output directory.",
+        )
         parser.add_argument(
             "--output_directory",
             default="output/",
@@ -44,7 +95,6 @@ class CommandLine:
         )
         parser.add_argument(
             "--target_language",
-            required=True,
             help="Target language for dubbing (ISO 639-3).",
         )
         parser.add_argument(
@@ -68,22 +118,24 @@ class CommandLine:
             "--stt",
             type=str,
             default="auto",
-            choices=["auto", "faster-whisper", "transformers"],
+            choices=["auto", "faster-whisper", "transformers", "whisper-cpp"],
             help=(
                 "Speech to text. Choices are:"
                 "'auto': Autoselect best implementation."
                 "'faster-whisper': Faster-whisper's OpenAI whisper implementation."
                 "'transformers': Transformers OpenAI whisper implementation."
+                "'whisper-cpp': whisper.cpp OpenAI whisper implementation (CPU only, requires pywhispercpp)."
             ),
         )
         parser.add_argument(
             "--translator",
             type=str,
             default="nllb",
-            choices=["nllb", "apertium"],
+            choices=["nllb", "nllb-ct2", "apertium"],
             help=(
                 "Text to Speech engine to use. Choices are:"
                 "'nllb': Meta's no Language Left Behind (NLLB)."
+                "'nllb-ct2': Meta's no Language Left Behind (NLLB) running on CTranslate2, faster than 'nllb'."
                 "'apertium'': Apertium compatible API server"
             ),
         )
@@ -101,17 +153,65 @@ class CommandLine:
             choices=["cpu", "cuda"],
             help=("Device to use"),
         )
+        for component in ["stt", "translation", "tts"]:
+            parser.add_argument(
+                f"--{component}_device",
+                type=CommandLine._device,
+                default=None,
+                help=f"device used by the {component} model, like 'cuda:1' to use the second GPU (by default the one set by --device)",
+            )
         parser.add_argument(
             "--cpu_threads",
             type=int,
             default=0,
-            help="number of threads used for CPU inference (if is not specified uses defaults for each framework)",
+            help=(
+                "number of threads used for CPU inference. "
+                "If is not specified torch, OpenMP and MKL use the number of physical cores (estimated as half of the logical cores) and the other frameworks their defaults"
+            ),
+        )
+        parser.add_argument(
+            "--precision",
+            default=None,
+            choices=PRECISIONS,
+            help=(
+                "precision of the Demucs, PyAnnote and Whisper ('transformers' speech to text) models. "
+                "'fp16' is only used with 'cuda' device, except for Whisper that uses bfloat16 on CPUs that support it natively, and 'int8' with 'cpu'. "
+                "By default 'fp16' for 'cuda' and 'int8' for 'cpu'"
+            ),
+        )
+        parser.add_argument(
+            "--translation_precision",
+            default=None,
+            choices=TRANSLATION_PRECISIONS,
+            help="precision of the NLLB translation model. 'fp16' and 'bf16' are only used with 'cuda' device and 'int8' with 'cpu'. By default 'fp16' for 'cuda' and 'int8' for 'cpu'",
+        )
+        parser.add_argument(
+            "--tts_compile",
+            action="store_true",
+            help="compile the Coqui TTS models with torch.compile and use half precision (only when using 'cuda' device)",
+        )
+        parser.add_argument(
+            "--tts_workers",
+            type=int,
+            default=None,
+            help="number of utterances synthesized in parallel. By default 16 for 'edge', that waits for the network, and 1 for 'coqui' and 'mms', that already use all the cores",
+        )
+        parser.add_argument(
+            "--compile",
+            action="store_true",
+            help="compile the Whisper (only with 'transformers' speech to text) and NLLB models with torch.compile (only when using 'cuda' device)",
         )
         parser.add_argument(
             "--debug",
             action="store_true",
             help="keep intermediate files and generate specific files for debugging",
         )
+        parser.add_argument(
+            "--intermediate_format",
+            default="wav",
+            choices=INTERMEDIATE_FORMATS,
+            help="format of the intermediate audio chunks. 'mp3' produces the same files as previous versions for debugging",
+        )
 
         parser.add_argument(
             "--nllb_model",
@@ -125,7 +225,28 @@ class CommandLine:
             "--whisper_model",
             default="medium",
             choices=WHISPER_MODEL_NAMES,
-            help="name of the OpenAI Whisper speech to text model size to use",
+            help="name of the OpenAI Whisper speech to text model size to use. 'turbo' (large-v3-turbo) and 'distil' (distil-large-v3) are several times faster than large-v3. 'turbo' has a similar accuracy, 'distil' only transcribes English",
+        )
+
+        parser.add_argument(
+            "--whisper_batch_size",
+            type=int,
+            default=None,
+            help="number of audio segments transcribed at once by faster-whisper, 1 disables batching (if is not specified uses 8 for 'cuda' device and 1 for 'cpu')",
+        )
+
+        parser.add_argument(
+            "--whisper_compute_type",
+            default=None,
+            choices=WHISPER_COMPUTE_TYPES,
+            help="faster-whisper quantization type (if is not specified uses 'int8_float16' for 'cuda' devices with int8 tensor cores, 'float16' for other 'cuda' devices and 'int8' for 'cpu')",
+        )
+
+        parser.add_argument(
+            "--whisper_quant",
+            default="q8_0",
+            choices=WHISPER_CPP_QUANTS,
+            help="whisper.cpp quantization type of the GGML model",
         )
 
         parser.add_argument(
@@ -134,4 +255,47 @@ class CommandLine:
             help="For some TTS you can specify the region of the language. For example, 'ES' will indicate accent from Spain.",
         )
 
-        return parser.parse_args()
+        parser.add_argument(
+            "--serve",
+            action="store_true",
+            help="load the models once and keep waiting for dubbing requests. Later invocations of open-dubbing with '--use_daemon' and the same options are processed by this process",
+        )
+
+        parser.add_argument(
+            "--use_daemon",
+            action="store_true",
+            help="send the dubbing request to the process started with '--serve' by the same user, if it is running",
+        )
+
+        parser.add_argument(
+            "--server_socket",
+            default=None,
+            help="socket (named pipe on Windows) used to send requests to the process started with '--serve'",
+        )
+
+        return parser
+
+    @staticmethod
+    def read_parameters(argv=None):
+        """Parses command-line arguments and runs the dubbing process.
+
+        Args:
+            argv: The arguments to parse, by default the ones of the process.
+        """
+        parser = CommandLine.build_parser()
+        args = parser.parse_args(argv)
+        if not args.serve:
+            required = ["target_language"]
+            if not args.input_file_list:
+                required.insert(0, "input_file")
+            missing = [f"--{name}" for name in required if not getattr(args, name)]
+            if missing:
+                parser.error(
+                    f"the following arguments are required: {', '.join(missing)}"
+                )
+
+        for component in ["stt", "translation", "tts"]:
+            if not getattr(args, f"{component}_device"):
+                setattr(args, f"{component}_device", args.device)
+
+        return args
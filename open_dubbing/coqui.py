@@ -12,22 +12,86 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
+import json
 import logging
+import os
 import re
+import shutil
 import subprocess
+import threading
+
+import torch
 
 from TTS.api import TTS
+from TTS.tts.utils.managers import load_file
+from TTS.utils.manage import ModelManager
+
+_LANGUAGE_PATTERN = re.compile(r"/([a-z]{2})/")
+_PREFERRED_ARCHITECTURES = ("vits", "glow")
+
+
+@functools.lru_cache(maxsize=1)
+def _list_models():
+    return tuple(TTS.list_models())
+
+
+def _read_speakers_from_config(config_path):
+    """Reads the speaker names the same way that TTS's SpeakerManager does.
+
+    Returns:
+        The speaker names, None for single speaker models or an empty list if
+        they cannot be read from the model files.
+    """
+    with open(config_path) as f:
+        config = json.load(f)
+
+    model_args = config.get("model_args") or {}
+
+    def _get(key):
+        return config.get(key) or model_args.get(key)
+
+    if _get("use_d_vector_file"):
+        d_vector_file = _get("d_vector_file")
+        if isinstance(d_vector_file, list):
+            d_vector_file = d_vector_file[0]
+        if not d_vector_file or not os.path.exists(d_vector_file):
+            return []
+        embeddings = load_file(d_vector_file)
+        return sorted({embedding["name"] for embedding in embeddings.values()})
+
+    if _get("use_speaker_embedding"):
+        speakers_file = _get("speakers_file")
+        if not speakers_file or not os.path.exists(speakers_file):
+            return []
+        return list(load_file(speakers_file).keys())
+
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def _get_model_speakers(model):
+    """Returns the speakers of a model without loading its weights."""
+    _, config_path, _ = ModelManager(progress_bar=False).download_model(model)
+    if config_path is None:
+        return ()
+
+    speakers = _read_speakers_from_config(config_path)
+    return tuple(speakers) if speakers is not None else None
 
 
 class Coqui:
     """Builds a list models available per each language"""
 
-    def __init__(self, device="cpu"):
+    def __init__(self, device="cpu", compile=False):
         logging.getLogger("TTS.utils.manage").setLevel(logging.ERROR)
         logging.getLogger("TTS.utils.audio.processor").setLevel(logging.ERROR)
         language_models = self._build_list_language_model()
         self.language_model = self._select_model_per_language(language_models)
         self.device = device
+        self.compile = compile and device.startswith("cuda")
+        self._tts_cache = {}
+        self._tts_cache_lock = threading.Lock()
 
     @property
     def languages_model(self):
@@ -39,68 +103,107 @@ class Coqui:
     """ Select first vits, then glow and then the rest"""
 
     def _select_model_per_language(self, language_models):
-        language_model = {}
-        for language in language_models:
-            models = language_models[language]
-            found = False
-            if len(models) == 1:
-                language_model[language] = models[0]
-                found = True
-            else:
-                for model in models:
-                    if "vits" in model:
-                        language_model[language] = model
-                        found = True
-                        break
-
-                for model in models:
-                    if "glow" in model:
-                        language_model[language] = model
-                        found = True
-                        break
-
-            if found:
-                continue
-
-            language_model[language] = models[0]
-
-        return language_model
+        return {
+            language: min(models, key=self._get_model_priority)
+            for language, models in language_models.items()
+        }
+
+    def _get_model_priority(self, model):
+        for priority, architecture in enumerate(_PREFERRED_ARCHITECTURES):
+            if architecture in model:
+                return priority
+
+        return len(_PREFERRED_ARCHITECTURES)
+
+    def _get_tts(self, model):
+        """Returns the TTS for the model, loading it only the first time."""
+        key = (model, self.device)
+        with self._tts_cache_lock:
+            tts = self._tts_cache.get(key)
+            if tts is None:
+                tts = TTS(model).to(self.device)
+                if self.compile:
+                    self._compile(tts)
+                self._tts_cache[key] = tts
+        return tts
+
+    def _compile(self, tts):
+        synthesizer = tts.synthesizer
+        for model in [synthesizer.tts_model, synthesizer.vocoder_model]:
+            if model is not None:
+                model.inference = torch.compile(model.inference, dynamic=True)
+
+        # Pay the compilation cost once when the model is loaded
+        speaker = tts.speakers[0] if tts.is_multi_speaker else None
+        with torch.autocast("cuda", dtype=torch.float16):
+            synthesizer.tts(text="Warmup.", speaker_name=speaker, split_sentences=False)
+
+    def close(self):
+        with self._tts_cache_lock:
+            self._tts_cache.clear()
+        if self.device.startswith("cuda"):
+            torch.cuda.empty_cache()
 
     def debug_list_all_voices(self):
-        for model in TTS.list_models():
-            voices = TTS(model).speakers
+        for model in _list_models():
+            voices = _get_model_speakers(model)
+            if voices == ():
+                voices = TTS(model).speakers
             print(f"Model {model}: {voices}")
 
     def _build_list_language_model(self):
         language_models = {}
 
-        for model in TTS.list_models():
-            match = re.search(r"/([a-z]{2})/", model)
+        for model in _list_models():
+            match = _LANGUAGE_PATTERN.search(model)
             if match:
                 language = match.group(1)
-                models = language_models.get(language, [])
-                models.append(model)
-                language_models[language] = models
+                language_models.setdefault(language, []).append(model)
 
         return language_models
 
+    def _get_speakers(self, model):
+        speakers = _get_model_speakers(model)
+        if speakers is None:
+            return None
+        if len(speakers) > 0:
+            return list(speakers)
+
+        # Models with an unusual layout, TTS knows how to read them
+        return self._get_tts(model).speakers
+
     def get_voices_language(self, language):
         model = self.language_model[language]
-        voices = TTS(model).speakers
-        #      print(f"voices: {voices}")
-        return voices
+        return self._get_speakers(model)
 
     def synthesize_speech(
         self, input_text, language, file_path, voice=None, audio_config=None
     ):
-        model = self.language_model[language]
-        tts = TTS(model).to(self.device)
-        tts.tts_to_file(
-            text=input_text, speaker=voice, split_sentences=False, file_path=file_path
+        self.synthesize_speech_batch(
+            [input_text], language, [file_path], voices=[voice]
         )
 
+    def synthesize_speech_batch(self, texts, language, file_paths, voices=None):
+        """Synthesizes several texts of the same language with a single model load."""
+        if voices is None:
+            voices = [None] * len(texts)
+
+        model = self.language_model[language]
+        synthesizer = self._get_tts(model).synthesizer
+        for text, file_path, voice in zip(texts, file_paths, voices):
+            with torch.autocast("cuda", dtype=torch.float16, enabled=self.compile):
+                wav = synthesizer.tts(
+                    text=text, speaker_name=voice, split_sentences=False
+                )
+            synthesizer.save_wav(wav=wav, path=file_path)
+
     @staticmethod
+    @functools.lru_cache(maxsize=1)
     def is_espeak_ng_installed():
+        # Looking up the PATH does not start a process
+        if shutil.which("espeak-ng") or shutil.which("espeak"):
+            return True
+
         for cmd in [["espeak-ng", "--version"], ["espeak", "--version"]]:
             try:
                 if (
@@ -0,0 +1,254 @@
+# Copyright 2024 Jordi Mas i Hernàndez <jmas@softcatala.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import hashlib
+import logging
+import os
+import secrets
+import stat
+import sys
+import tempfile
+
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from typing import Callable, Final
+
+# Options that can be different in every request since they do not change the
+# models loaded by the daemon
+_REQUEST_OPTIONS: Final[tuple[str, ...]] = (
+    "input_file",
+    "output_directory",
+    "source_language",
+    "target_language",
+    "target_language_region",
+    "debug",
+    "intermediate_format",
+)
+
+# Options that are only meaningful for the process that received them
+_LOCAL_OPTIONS: Final[tuple[str, ...]] = (
+    "hugging_face_token",
+    "input_file_list",
+    "serve",
+    "server_socket",
+    "use_daemon",
+)
+
+_USE_UNIX_SOCKET: Final[bool] = sys.platform != "win32"
+
+
+_AUTHKEY_BYTES: Final[int] = 32
+
+
+def _get_runtime_directory() -> str:
+    """Returns a directory that only the current user can access.
+
+    XDG_RUNTIME_DIR is private to the user. Otherwise a directory with 0700
+    permissions is created in the temporary directory.
+    """
+    runtime_directory = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_directory and os.path.isdir(runtime_directory):
+        return runtime_directory
+
+    if not _USE_UNIX_SOCKET:
+        # The temporary directory is per user and keeps the key private, but
+        # the named pipe is global to the machine and only the key protects it
+        return tempfile.gettempdir()
+
+    directory = os.path.join(tempfile.gettempdir(), f"open-dubbing-{os.getuid()}")
+    try:
+        os.mkdir(directory, 0o700)
+    except FileExistsError:
+        pass
+
+    # Another user could have created the directory before
+    status = os.lstat(directory)
+    if (
+        not stat.S_ISDIR(status.st_mode)
+        or status.st_uid != os.getuid()
+        or stat.S_IMODE(status.st_mode) & 0o077
+    ):
+        raise PermissionError(
+            f"The directory '{directory}' must be owned by the current user and not accessible by others"
+        )
+    return directory
+
+
+def get_default_address() -> str:
+    if not _USE_UNIX_SOCKET:
+        return r"\\.\pipe\open-dubbing"
+
+    return os.path.join(_get_runtime_directory(), "open-dubbing.sock")
+
+
+def _get_authkey_path(address: str) -> str:
+    # The key of each address is kept in the private directory, the address
+    # itself can be anywhere
+    digest = hashlib.sha256(address.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(_get_runtime_directory(), f"open-dubbing-{digest}.key")
+
+
+def _write_authkey(address: str) -> bytes:
+    authkey = secrets.token_bytes(_AUTHKEY_BYTES)
+    path = _get_authkey_path(address)
+    if os.path.exists(path):
+        os.remove(path)
+
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as file:
+        file.write(authkey)
+    return authkey
+
+
+def _read_authkey(address: str) -> bytes | None:
+    try:
+        with open(_get_authkey_path(address), "rb") as file:
+            return file.read()
+    except OSError:
+        return None
+
+
+def _remove_stale_socket(address: str) -> None:
+    """Removes the socket left by a previous daemon of the same user."""
+    try:
+        status = os.lstat(address)
+    except FileNotFoundError:
+        return
+
+    if not stat.S_ISSOCK(status.st_mode) or status.st_uid != os.getuid():
+        raise PermissionError(
+            f"'{address}' already exists and it is not a socket of the current user"
+        )
+    os.remove(address)
+
+
+def _get_model_options(options: dict) -> dict:
+    return {
+        key: value
+        for key, value in options.items()
+        if key not in _REQUEST_OPTIONS and key not in _LOCAL_OPTIONS
+    }
+
+
+def _process_request(
+    *,
+    request: dict,
+    args: argparse.Namespace,
+    dub: Callable[[argparse.Namespace], None],
+) -> dict:
+    model_options = _get_model_options(vars(args))
+    if _get_model_options(request) != model_options:
+        return {
+            "status": "rejected",
+            "message": f"the daemon has been started with different options: {model_options}",
+        }
+
+    request_args = argparse.Namespace(**vars(args))
+    for option in _REQUEST_OPTIONS:
+        setattr(request_args, option, request.get(option))
+
+    logging.info(f"daemon.serve. Processing '{request_args.input_file}'")
+    try:
+        dub(request_args)
+    except Exception as e:
+        logging.error(f"daemon.serve. Error processing request: '{e}'")
+        return {"status": "error", "message": str(e)}
+
+    return {"status": "done"}
+
+
+def serve(
+    *,
+    address: str,
+    args: argparse.Namespace,
+    dub: Callable[[argparse.Namespace], None],
+) -> None:
+    """Waits for dubbing requests and processes them with the already loaded models.
+
+    Args:
+        address: The Unix socket (or named pipe on Windows) to listen to.
+        args: The command line options used to load the models.
+        dub: Dubs the file described by the options of a request.
+    """
+    # Requests are exchanged with pickle. Only the clients that can read the
+    # key, stored in a directory private to the user, can connect.
+    authkey = _write_authkey(address)
+    if _USE_UNIX_SOCKET:
+        _remove_stale_socket(address)
+        # The socket is created with 0600 permissions, there is no time
+        # window where other users can connect
+        umask = os.umask(0o177)
+        try:
+            listener = Listener(address, authkey=authkey)
+        finally:
+            os.umask(umask)
+    else:
+        listener = Listener(address, authkey=authkey)
+
+    with listener:
+        logging.info(f"Waiting for dubbing requests on '{address}'")
+        while True:
+            try:
+                connection = listener.accept()
+            except AuthenticationError:
+                logging.warning("daemon.serve. Rejected a client without the key")
+                continue
+
+            with connection:
+                request = connection.recv()
+                response = _process_request(request=request, args=args, dub=dub)
+                connection.send(response)
+
+
+def dispatch(*, address: str, args: argparse.Namespace) -> bool:
+    """Sends the dubbing request to a running daemon of the same user.
+
+    The daemon is only reached if it has the key written by serve.
+
+    Returns:
+        True if the daemon dubbed the file, False if there is no daemon
+        running or it cannot process the request.
+    """
+    authkey = _read_authkey(address)
+    if authkey is None:
+        return False
+
+    try:
+        connection = Client(address, authkey=authkey)
+    except (OSError, AuthenticationError):
+        return False
+
+    request = {
+        key: value for key, value in vars(args).items() if key not in _LOCAL_OPTIONS
+    }
+    # The daemon can run in a different working directory
+    request["input_file"] = os.path.abspath(args.input_file)
+    request["output_directory"] = os.path.abspath(args.output_directory)
+
+    logging.info(f"Sending '{args.input_file}' to the daemon listening on '{address}'")
+    with connection:
+        connection.send(request)
+        response = connection.recv()
+
+    if response["status"] == "rejected":
+        logging.warning(
+            f"The daemon cannot process this request, {response['message']}. Processing it in this process."
+        )
+        return False
+
+    if response["status"] == "error":
+        raise Exception(f"Error in the daemon dubbing the file: {response['message']}")
+
+    return True
@@ -12,181 +12,272 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
 import logging
 import os
-import re
-import subprocess
+import random
+
+from typing import Final
+
+import psutil
+import torch
+
+from demucs.apply import apply_model
+from demucs.audio import AudioFile, i16_pcm, prevent_clip
+from demucs.pretrained import get_model
+from pydub import AudioSegment
+
+from open_dubbing import quantization
+
+_DEFAULT_MODEL: Final[str] = "htdemucs"
+_VOCALS_STEM: Final[str] = "vocals"
+# Shortest segment, in seconds, tried when the GPU runs out of memory
+_MIN_SEGMENT: Final[float] = 1.0
+
+
+@functools.lru_cache(maxsize=None)
+def _load_model(model_name: str, device: str, precision: str) -> torch.nn.Module:
+    """Loads the model once per process, keeping it resident for later calls."""
+    model = get_model(model_name)
+    model.eval()
+    if device == "cpu":
+        if precision == "int8":
+            model = quantization.quantize_dynamic(model, {torch.nn.Linear})
+    else:
+        # apply_model moves every model of a bag to the device and back to
+        # where it was for each call, loading it on the device avoids copying
+        # the weights for every file
+        model.to(device)
+    logging.debug(f"demucs._load_model. Loaded '{model_name}' for '{device}'")
+    return model
+
+
+def _to_audio_segment(wav: torch.Tensor, *, samplerate: int) -> AudioSegment:
+    """Converts a (channels, samples) float tensor to a 16 bits audio segment.
+
+    Rescales the audio if it clips, like demucs does when saving the stems.
+    """
+    samples = i16_pcm(prevent_clip(wav, mode="rescale"))
+    return AudioSegment(
+        data=samples.t().contiguous().numpy().tobytes(),
+        sample_width=2,
+        frame_rate=samplerate,
+        channels=samples.shape[0],
+    )
 
 
 class Demucs:
 
-    def build_demucs_command(
+    def __init__(
         self,
         *,
-        audio_file: str,
-        output_directory: str,
         device: str = "cpu",
-        shifts: int = 1,
-        overlap: float = 0.25,
-        mp3_bitrate: int = 320,
-        mp3_preset: int = 2,
-        jobs: int = 0,
-        split: bool = True,
-        segment: int | None = None,
-        int24: bool = False,
-        float32: bool = False,
-        flac: bool = False,
-        mp3: bool = True,
-    ) -> str:
-        """Builds the Demucs audio separation command.
+        model_name: str = _DEFAULT_MODEL,
+        precision: str | None = None,
+    ):
+        if device == "cuda" and not torch.cuda.is_available():
+            logging.warning(
+                "demucs.Demucs. CUDA requested but not available, using CPU"
+            )
+            device = "cpu"
 
-        Args:
-            audio_file: The path to the audio file to process.
-            output_directory: The output directory for separated tracks.
-            device: The device to use ("cuda" or "cpu").
-            shifts: The number of random shifts for equivariant stabilization.
-            overlap: The overlap between splits.
-            mp3_bitrate: The bitrate of converted MP3 files.
-            mp3_preset: The encoder preset for MP3 conversion.
-            jobs: The number of jobs to run in parallel.
-            split: Whether to split audio into chunks.
-            segment: The split size for chunks (None for no splitting).
-            int24: Save WAV output as 24 bits.
-            float32: Save WAV output as float32.
-            flac: Convert output to FLAC.
-            mp3: Convert output to MP3.
+        self.device = device
+        self.model_name = model_name
+        self.precision = precision or quantization.get_default_precision(device)
 
-        Returns:
-            A string representing the constructed command.
+    def load_model(self) -> torch.nn.Module:
+        """Loads the model, only the first call for each configuration loads it."""
+        return _load_model(self.model_name, self.device, self.precision)
+
+    def _get_output_paths(
+        self, *, audio_file: str, output_directory: str
+    ) -> tuple[str, str]:
+        input_file_name = os.path.splitext(os.path.basename(audio_file))[0]
+        directory = os.path.join(output_directory, self.model_name, input_file_name)
+        audio_vocals_file = os.path.join(directory, f"{_VOCALS_STEM}.mp3")
+        audio_background_file = os.path.join(directory, f"no_{_VOCALS_STEM}.mp3")
+        return audio_vocals_file, audio_background_file
 
-        Raises:
-            ValueError: If both int24 and float32 are set to True.
+    def _get_shifts_per_batch(self, *, shifts: int, output_size: int) -> int:
+        """Returns how many shifted copies of the track fit in the available memory."""
+        if self.device == "cuda":
+            available, _ = torch.cuda.mem_get_info()
+        else:
+            available = psutil.virtual_memory().available
+
+        # Leave half of the memory for the model activations
+        bytes_per_shift = output_size * torch.finfo(torch.float32).bits // 8
+        return max(1, min(shifts, available // (2 * bytes_per_shift)))
+
+    def _get_max_segment(self, model: torch.nn.Module) -> float:
+        """Returns the longest segment, in seconds, that the model accepts."""
+        models = getattr(model, "models", [model])
+        return min(float(m.segment) for m in models)
+
+    def _apply_model(
+        self,
+        model: torch.nn.Module,
+        wav: torch.Tensor,
+        *,
+        shifts: int,
+        overlap: float,
+        segment: float | None = None,
+    ) -> torch.Tensor:
+        """Same as apply_model with shifts, but running the shifts as a batch.
+
+        demucs runs the model once per shift. Here the shifted copies of the
+        track are stacked in the batch dimension, so each segment is
+        separated for all the shifts in the same forward pass.
         """
-        if int24 and float32:
-            raise ValueError("Cannot set both int24 and float32 to True.")
-        command_parts = [
-            "python",
-            "-m",
-            "demucs.separate",
-            "-o",
-            f'"{output_directory}"',
-            "--device",
-            device,
-            "--shifts",
-            str(shifts),
-            "--overlap",
-            str(overlap),
-            "-j",
-            str(jobs),
-            "--two-stems vocals",
-        ]
-        if not split:
-            command_parts.append("--no-split")
-        elif segment is not None:
-            command_parts.extend(["--segment", str(segment)])
-        if flac:
-            command_parts.append("--flac")
-        if mp3:
-            command_parts.extend(
+        if shifts <= 1:
+            return apply_model(
+                model,
+                wav[None],
+                device=self.device,
+                shifts=shifts,
+                split=True,
+                overlap=overlap,
+                progress=False,
+                segment=segment,
+            )[0]
+
+        length = wav.shape[-1]
+        max_shift = int(0.5 * model.samplerate)
+        padded = torch.nn.functional.pad(wav, (max_shift, max_shift))
+        offsets = [random.randint(0, max_shift) for _ in range(shifts)]
+        output_size = len(model.sources) * wav.shape[0] * (length + max_shift)
+        shifts_per_batch = self._get_shifts_per_batch(
+            shifts=shifts, output_size=output_size
+        )
+
+        sources = torch.zeros(
+            len(model.sources), wav.shape[0], length, device=wav.device
+        )
+        for i in range(0, shifts, shifts_per_batch):
+            batch_offsets = offsets[i : i + shifts_per_batch]
+            batch = torch.stack(
                 [
-                    "--mp3",
-                    "--mp3-bitrate",
-                    str(mp3_bitrate),
-                    "--mp3-preset",
-                    str(mp3_preset),
+                    padded[..., offset : offset + length + max_shift]
+                    for offset in batch_offsets
                 ]
             )
-        if int24:
-            command_parts.append("--int24")
-        if float32:
-            command_parts.append("--float32")
-        command_parts.append(f'"{audio_file}"')
-        return " ".join(command_parts)
-
-    def execute_demucs_command(self, command: str) -> None:
-        """Executes a Demucs command using subprocess.
+            batch_sources = apply_model(
+                model,
+                batch,
+                device=self.device,
+                shifts=0,
+                split=True,
+                overlap=overlap,
+                progress=False,
+                segment=segment,
+            )
+            for shifted_sources, offset in zip(batch_sources, batch_offsets):
+                start = max_shift - offset
+                sources += shifted_sources[..., start : start + length]
+        return sources / shifts
 
-        Demucs is a model using AI/ML to detach dialogues
-        from the rest of the audio file.
+    def _separate_sources(
+        self, model: torch.nn.Module, wav: torch.Tensor, *, shifts: int, overlap: float
+    ) -> torch.Tensor:
+        """Applies the model, halving the segment when the GPU runs out of memory.
 
-        Args:
-            command: The string representing the command to execute.
+        Shorter segments need less memory for the activations, so long tracks
+        can be processed on GPUs with less memory instead of failing.
         """
-        try:
-            result = subprocess.run(
-                command, shell=True, capture_output=True, text=True, check=True
-            )
-            logging.info(result.stdout)
-        except subprocess.CalledProcessError as error:
-            logging.warning(
-                "Error in the first attempt to separate audio:"
-                f" {error}\n{error.stderr}. Retrying with 'python3' instead of"
-                " 'python'."
-            )
-            python3_command = command.replace("python", "python3", 1)
+        segment = None
+        while True:
             try:
-                result = subprocess.run(
-                    python3_command,
-                    shell=True,
-                    capture_output=True,
-                    text=True,
-                    check=True,
-                )
-                logging.info(result.stdout)
-            except subprocess.CalledProcessError as error:
-                raise Exception(
-                    f"Error in final attempt to separate audio: {error}\n{error.stderr}"
+                # Autocast keeps the STFT in FP32 and runs the convolutions
+                # and the attention in FP16. cuDNN benchmark is not enabled,
+                # it is a process-wide setting and PyAnnote runs at the same
+                # time with inputs of different lengths.
+                with torch.autocast(
+                    "cuda",
+                    dtype=torch.float16,
+                    enabled=self.device == "cuda" and self.precision == "fp16",
+                ):
+                    return self._apply_model(
+                        model, wav, shifts=shifts, overlap=overlap, segment=segment
+                    )
+            except torch.cuda.OutOfMemoryError:
+                segment = (segment or self._get_max_segment(model)) / 2
+                if segment < _MIN_SEGMENT:
+                    raise
+
+                torch.cuda.empty_cache()
+                logging.warning(
+                    f"demucs._separate_sources. GPU out of memory, retrying with segments of {segment:.2f}s"
                 )
 
-    def _extract_command_info(self, command: str) -> tuple[str, str, str]:
-        """Extracts folder name, output file extension, and input file name (without path) from a Demucs command.
+    def separate(
+        self,
+        *,
+        audio_file: str,
+        shifts: int = 1,
+        overlap: float = 0.25,
+    ) -> tuple[AudioSegment, AudioSegment]:
+        """Separates the vocals from the rest of the audio file.
+
+        Demucs is a model using AI/ML to detach dialogues
+        from the rest of the audio file.
 
         Args:
-            command: The Demucs command string.
+            audio_file: The path to the audio file to process.
+            shifts: The number of random shifts for equivariant stabilization.
+            overlap: The overlap between splits.
 
         Returns:
-            tuple: A tuple containing (folder_name, output_file_extension,
-            input_file_name).
+            A tuple with the audio with vocals only and the audio with the
+            background sound only.
         """
-        folder_pattern = r"-o\s+(['\"]?)(.+?)\1"
-        flac_pattern = r"--flac"
-        mp3_pattern = r"--mp3"
-        int24_or_float32_pattern = r"--(int24|float32)"
-        input_file_pattern = r"['\"]?(\w+\.\w+)['\"]?$|\s(\w+\.\w+)$"
-        folder_match = re.search(folder_pattern, command)
-        flac_match = re.search(flac_pattern, command)
-        mp3_match = re.search(mp3_pattern, command)
-        int24_or_float32_match = re.search(int24_or_float32_pattern, command)
-        input_file_match = re.search(input_file_pattern, command)
-        output_directory = folder_match.group(2) if folder_match else ""
-        input_file_name_with_ext = (
-            (input_file_match.group(1) or input_file_match.group(2))
-            if input_file_match
-            else ""
+        model = self.load_model()
+        wav = AudioFile(audio_file).read(
+            streams=0, samplerate=model.samplerate, channels=model.audio_channels
         )
-        input_file_name_no_ext = (
-            os.path.splitext(input_file_name_with_ext)[0] if input_file_match else ""
+
+        # Same normalization that demucs.separate applies
+        ref = wav.mean(0)
+        wav -= ref.mean()
+        wav /= ref.std()
+        if self.device == "cuda":
+            # Keeping the whole track in the GPU prevents apply_model from
+            # copying every segment from and to the CPU
+            wav = wav.pin_memory().to(self.device, non_blocking=True)
+        sources = self._separate_sources(model, wav, shifts=shifts, overlap=overlap)
+        sources = sources.float().cpu()
+        sources *= ref.std()
+        sources += ref.mean()
+
+        vocals_index = model.sources.index(_VOCALS_STEM)
+        vocals = sources[vocals_index]
+        background = sources.sum(dim=0) - vocals
+        return (
+            _to_audio_segment(vocals, samplerate=model.samplerate),
+            _to_audio_segment(background, samplerate=model.samplerate),
         )
-        if flac_match:
-            output_file_extension = ".flac"
-        elif mp3_match:
-            output_file_extension = ".mp3"
-        elif int24_or_float32_match:
-            output_file_extension = ".wav"
-        else:
-            output_file_extension = ".wav"
-        return output_directory, output_file_extension, input_file_name_no_ext
 
-    def assemble_split_audio_file_paths(self, command: str) -> tuple[str, str]:
-        """Returns paths to the audio files with vocals and no vocals.
+    def save(
+        self,
+        *,
+        audio_file: str,
+        output_directory: str,
+        vocals: AudioSegment,
+        background: AudioSegment,
+        mp3_bitrate: int = 320,
+    ) -> tuple[str, str]:
+        """Saves the separated tracks as MP3 files, in the same place as demucs does.
 
         Returns:
             A tuple with a path to the file with the audio with vocals only
             and the other with the background sound only.
         """
-        output_directory, output_file_extension, input_file_name = (
-            self._extract_command_info(command)
+        audio_vocals_file, audio_background_file = self._get_output_paths(
+            audio_file=audio_file, output_directory=output_directory
         )
-        audio_vocals_file = f"{output_directory}/htdemucs/{input_file_name}/vocals{output_file_extension}"
-        audio_background_file = f"{output_directory}/htdemucs/{input_file_name}/no_vocals{output_file_extension}"
+        os.makedirs(os.path.dirname(audio_vocals_file), exist_ok=True)
+        for audio, path in [
+            (vocals, audio_vocals_file),
+            (background, audio_background_file),
+        ]:
+            audio.export(path, format="mp3", bitrate=f"{mp3_bitrate}k")
         return audio_vocals_file, audio_background_file
@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import contextlib
 import dataclasses
 import functools
 import json
@@ -23,14 +24,21 @@ import sys
 import tempfile
 import time
 
+from concurrent.futures import ThreadPoolExecutor
 from typing import Final
 
 import psutil
 import torch
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 from pyannote.audio import Pipeline
+from pydub import AudioSegment
 
-from open_dubbing import audio_processing
+from open_dubbing import audio_processing, quantization
 from open_dubbing.demucs import Demucs
 from open_dubbing.speech_to_text import SpeechToText
 from open_dubbing.text_to_speech import TextToSpeech
@@ -41,6 +49,9 @@ _UTTERNACE_METADATA_FILE_NAME: Final[str] = "utterance_metadata"
 
 _DEFAULT_PYANNOTE_MODEL: Final[str] = "pyannote/speaker-diarization-3.1"
 _NUMBER_OF_STEPS: Final[int] = 7
+_MB: Final[int] = 1 << 20
+_NON_ALPHANUMERIC_PATTERN: Final[re.Pattern] = re.compile(r"[^a-z0-9]")
+_JSON_INDENT_PATTERN: Final[re.Pattern] = re.compile(rb"^( +)", re.MULTILINE)
 
 
 @dataclasses.dataclass
@@ -50,15 +61,18 @@ class PreprocessingArtifacts:
     Attributes:
         video_file: A path to a video ad with no audio.
         audio_file: A path to an audio track from the ad.
-        audio_vocals_file: A path to an audio track with vocals only.
+        audio_vocals_file: A path to an audio track with vocals only, only
+          saved in debug mode.
         audio_background_file: A path to and audio track from the ad with removed
-          vocals.
+          vocals, only saved in debug mode.
+        audio_background: The audio track from the ad with removed vocals.
     """
 
     video_file: str | None
     audio_file: str
     audio_vocals_file: str | None = None
     audio_background_file: str | None = None
+    audio_background: AudioSegment | None = None
 
 
 @dataclasses.dataclass
@@ -80,6 +94,20 @@ class PyAnnoteAccessError(Exception):
     pass
 
 
+def _dump_json(data) -> bytes:
+    """Serializes to UTF-8 JSON, using orjson when it is installed."""
+    if orjson:
+        # orjson only indents with 2 spaces, the file is written with 4 as
+        # with json. Strings do not have raw new lines, so all the spaces at
+        # the start of a line are indentation.
+        return _JSON_INDENT_PATTERN.sub(
+            lambda match: match.group(1) * 2,
+            orjson.dumps(data, option=orjson.OPT_INDENT_2),
+        )
+
+    return json.dumps(data, ensure_ascii=False, indent=4).encode("utf-8")
+
+
 def rename_input_file(original_input_file: str) -> str:
     """Converts a filename to lowercase letters and numbers only, preserving the file extension.
 
@@ -91,10 +119,45 @@ def rename_input_file(original_input_file: str) -> str:
     """
     directory, filename = os.path.split(original_input_file)
     base_name, extension = os.path.splitext(filename)
-    normalized_name = re.sub(r"[^a-z0-9]", "", base_name.lower())
+    if base_name.isascii() and base_name.isalnum() and base_name == base_name.lower():
+        return original_input_file
+
+    normalized_name = _NON_ALPHANUMERIC_PATTERN.sub("", base_name.lower())
     return os.path.join(directory, normalized_name + extension)
 
 
+@functools.lru_cache(maxsize=2)
+def load_pyannote_pipeline(
+    *,
+    hugging_face_token: str | None,
+    pyannote_model: str = _DEFAULT_PYANNOTE_MODEL,
+    device: str = "cpu",
+    precision: str | None = None,
+) -> Pipeline:
+    """Loads the PyAnnote diarization pipeline.
+
+    On CPU with 'int8' precision (the default) the Linear and LSTM layers of
+    the segmentation and embedding models are quantized to INT8.
+
+    The pipeline is cached, dubbing several files in the same process loads
+    it only once.
+    """
+    precision = precision or quantization.get_default_precision(device)
+    pipeline = Pipeline.from_pretrained(
+        pyannote_model, use_auth_token=hugging_face_token
+    )
+    if device == "cpu" and precision == "int8":
+        segmentation = getattr(pipeline, "_segmentation", None)
+        embedding = getattr(pipeline, "_embedding", None)
+        for model in [
+            getattr(segmentation, "model", None),
+            getattr(embedding, "model_", None),
+        ]:
+            if isinstance(model, torch.nn.Module):
+                quantization.quantize_dynamic(model, {torch.nn.Linear, torch.nn.LSTM})
+    return pipeline
+
+
 def overwrite_input_file(input_file: str, updated_input_file: str) -> None:
     """Renames a file in place to lowercase letters and numbers only, preserving the file extension."""
 
@@ -122,7 +185,10 @@ class Dubber:
         device: str,
         cpu_threads: int = 0,
         debug: bool = False,
+        intermediate_format: str = "wav",
         pyannote_model: str = _DEFAULT_PYANNOTE_MODEL,
+        pyannote_pipeline: Pipeline | None = None,
+        precision: str | None = None,
         number_of_steps: int = _NUMBER_OF_STEPS,
     ) -> None:
         self._input_file = input_file
@@ -131,6 +197,7 @@ class Dubber:
         self.target_language = target_language
         self.target_language_region = target_language_region
         self.pyannote_model = pyannote_model
+        self._pyannote_pipeline = pyannote_pipeline
         self.hugging_face_token = hugging_face_token
         self.utterance_metadata = None
         self._number_of_steps = number_of_steps
@@ -140,9 +207,8 @@ class Dubber:
         self.device = device
         self.cpu_threads = cpu_threads
         self.debug = debug
-
-        if cpu_threads > 0:
-            torch.set_num_threads(cpu_threads)
+        self.intermediate_format = intermediate_format
+        self.precision = precision or quantization.get_default_precision(device)
 
     @functools.cached_property
     def input_file(self):
@@ -158,6 +224,10 @@ class Dubber:
             )
         return renamed_input_file
 
+    @functools.cached_property
+    def _process(self) -> psutil.Process:
+        return psutil.Process()
+
     def log_maxrss_memory(self):
         if sys.platform == "win32" or sys.platform == "win64":
             return
@@ -171,8 +241,7 @@ class Dubber:
         logging.info(f"Maximum memory used: {max_rss_self:.0f} MB")
 
     def log_debug_task_and_getime(self, text, start_time):
-        process = psutil.Process(os.getpid())
-        current_rss = process.memory_info().rss / 1024**2
+        current_rss = self._process.memory_info().rss / _MB
         _time = time.time() - start_time
         logging.info(
             f"Task '{text}': current_rss {current_rss:.2f} MB, time {_time:.2f}s"
@@ -181,15 +250,34 @@ class Dubber:
 
     @functools.cached_property
     def pyannote_pipeline(self) -> Pipeline:
-        """Loads the PyAnnote diarization pipeline."""
-        return Pipeline.from_pretrained(
-            self.pyannote_model, use_auth_token=self.hugging_face_token
+        """Loads the PyAnnote diarization pipeline unless one was provided."""
+        if self._pyannote_pipeline:
+            return self._pyannote_pipeline
+
+        return load_pyannote_pipeline(
+            hugging_face_token=self.hugging_face_token,
+            pyannote_model=self.pyannote_model,
+            device=self.device,
+            precision=self.precision,
         )
 
+    @functools.cached_property
+    def _demucs(self) -> Demucs:
+        return Demucs(device=self.device, precision=self.precision)
+
     def _verify_api_access(self) -> None:
-        """Verifies access to all the required APIs."""
+        """Verifies access to all the required APIs.
+
+        The Demucs model is loaded at the same time as the PyAnnote pipeline,
+        both loads spend most of their time in I/O and torch native code.
+        """
         logging.debug("Verifying access to PyAnnote from HuggingFace.")
-        if not self.pyannote_pipeline:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            demucs_future = executor.submit(self._demucs.load_model)
+            pyannote_pipeline = self.pyannote_pipeline
+            demucs_future.result()
+
+        if not pyannote_pipeline:
             raise PyAnnoteAccessError(
                 "No access to HuggingFace. Make sure you passed the correct API token"
                 " either as 'hugging_face_token' or through the"
@@ -206,33 +294,44 @@ class Dubber:
         video_file, audio_file = VideoProcessing.split_audio_video(
             video_file=self.input_file, output_directory=self.output_directory
         )
-        demucs = Demucs()
-        demucs_command = demucs.build_demucs_command(
-            audio_file=audio_file,
-            output_directory=self.output_directory,
-            device=self.device,
-        )
-        demucs.execute_demucs_command(command=demucs_command)
-        audio_vocals_file, audio_background_file = (
-            demucs.assemble_split_audio_file_paths(command=demucs_command)
-        )
+        # Demucs and PyAnnote both work on the original audio and spend most
+        # of their time in torch native code, which releases the GIL
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            demucs_future = executor.submit(
+                self._demucs.separate, audio_file=audio_file
+            )
+            utterance_metadata = audio_processing.create_pyannote_timestamps(
+                audio_file=audio_file,
+                pipeline=self.pyannote_pipeline,
+                device=self.device,
+                precision=self.precision,
+            )
+            utterance_metadata = audio_processing.run_cut_and_save_audio(
+                utterance_metadata=utterance_metadata,
+                audio_file=audio_file,
+                output_directory=self.output_directory,
+                output_format=self.intermediate_format,
+            )
+            audio_vocals, audio_background = demucs_future.result()
+
+        # The separated tracks are kept in memory, the files are only useful
+        # to inspect the separation
+        audio_vocals_file = audio_background_file = None
+        if self.debug:
+            audio_vocals_file, audio_background_file = self._demucs.save(
+                audio_file=audio_file,
+                output_directory=self.output_directory,
+                vocals=audio_vocals,
+                background=audio_background,
+            )
 
-        utterance_metadata = audio_processing.create_pyannote_timestamps(
-            audio_file=audio_file,
-            pipeline=self.pyannote_pipeline,
-            device=self.device,
-        )
-        utterance_metadata = audio_processing.run_cut_and_save_audio(
-            utterance_metadata=utterance_metadata,
-            audio_file=audio_file,
-            output_directory=self.output_directory,
-        )
         self.utterance_metadata = utterance_metadata
         self.preprocesing_output = PreprocessingArtifacts(
             video_file=video_file,
             audio_file=audio_file,
             audio_vocals_file=audio_vocals_file,
             audio_background_file=audio_background_file,
+            audio_background=audio_background,
         )
         logging.info("Completed preprocessing.")
 
@@ -248,16 +347,21 @@ class Dubber:
             if self.preprocesing_output.video_file
             else self.preprocesing_output.audio_file
         )
-        utterance_metadata = self.stt.transcribe_audio_chunks(
-            utterance_metadata=self.utterance_metadata,
-            source_language=self.source_language,
-            no_dubbing_phrases=[],
-        )
-        speaker_info = self.stt.diarize_speakers(
-            file=media_file,
-            utterance_metadata=utterance_metadata,
-            number_of_speakers=1,
-        )
+        # The gender of the speakers only depends on the audio chunks, it is
+        # classified while Whisper transcribes them
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            speaker_info_future = executor.submit(
+                self.stt.diarize_speakers,
+                file=media_file,
+                utterance_metadata=self.utterance_metadata,
+                number_of_speakers=1,
+            )
+            utterance_metadata = self.stt.transcribe_audio_chunks(
+                utterance_metadata=self.utterance_metadata,
+                source_language=self.source_language,
+                no_dubbing_phrases=[],
+            )
+            speaker_info = speaker_info_future.result()
         self.utterance_metadata = self.stt.add_speaker_info(
             utterance_metadata=utterance_metadata, speaker_info=speaker_info
         )
@@ -305,22 +409,24 @@ class Dubber:
         if self.debug:
             return
 
-        output_directory = None
+        # Non dubbed utterances use the original chunk as dubbed file, a set
+        # removes every file once. Unlinking without checking first saves a
+        # stat call per file.
+        paths = set()
         for chunk in self.utterance_metadata:
-            for path in [chunk["path"], chunk["dubbed_path"]]:
-                if os.path.exists(path):
-                    os.remove(path)
-                if not output_directory:
-                    output_directory = os.path.dirname(path)
-
-        if output_directory:
-            for path in [
-                f"dubbed_audio_{self.target_language}.mp3",
-                "dubbed_vocals.mp3",
-            ]:
-                full_path = os.path.join(output_directory, path)
-                if os.path.exists(full_path):
-                    os.remove(full_path)
+            paths.update([chunk["path"], chunk["dubbed_path"]])
+
+        if paths:
+            output_directory = os.path.dirname(self.utterance_metadata[0]["path"])
+            paths.add(
+                os.path.join(
+                    output_directory, f"dubbed_audio_{self.target_language}.mp3"
+                )
+            )
+
+        for path in paths:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
 
     def run_postprocessing(self) -> None:
         """Merges dubbed audio with the original background audio and video (if applicable).
@@ -329,22 +435,19 @@ class Dubber:
             Path to the final dubbed output file (audio or video).
         """
 
-        dubbed_audio_vocals_file = audio_processing.insert_audio_at_timestamps(
+        background_audio = self.preprocesing_output.audio_background
+        if background_audio is None:
+            background_audio = AudioSegment.from_file(
+                self.preprocesing_output.audio_file
+            )
+        dubbed_vocals_audio = audio_processing.insert_audio_at_timestamps(
             utterance_metadata=self.utterance_metadata,
-            background_audio_file=(
-                self.preprocesing_output.audio_background_file
-                if self.preprocesing_output.audio_background_file
-                else self.preprocesing_output.audio_file
-            ),
-            output_directory=self.output_directory,
+            background_audio=background_audio,
+            output_directory=self.output_directory if self.debug else None,
         )
         dubbed_audio_file = audio_processing.merge_background_and_vocals(
-            background_audio_file=(
-                self.preprocesing_output.audio_background_file
-                if self.preprocesing_output.audio_background_file
-                else self.preprocesing_output.audio_file
-            ),
-            dubbed_vocals_audio_file=dubbed_audio_vocals_file,
+            background_audio=background_audio,
+            dubbed_vocals_audio=dubbed_vocals_audio,
             output_directory=self.output_directory,
             target_language=self.target_language,
             vocals_volume_adjustment=5.0,
@@ -378,18 +481,17 @@ class Dubber:
             _UTTERNACE_METADATA_FILE_NAME + target_language_suffix + ".json",
         )
         try:
-            json_data = json.dumps(
-                self.utterance_metadata, ensure_ascii=False, indent=4
-            )
+            json_data = _dump_json(self.utterance_metadata)
+            # Created in the destination directory so it can be renamed
+            # atomically instead of copied
             with tempfile.NamedTemporaryFile(
-                mode="w", delete=False, encoding="utf-8"
+                mode="wb", delete=False, dir=self.output_directory
             ) as temporary_file:
 
                 temporary_file.write(json_data)
                 temporary_file.flush()
                 os.fsync(temporary_file.fileno())
-            shutil.copy(temporary_file.name, utterance_metadata_file)
-            os.remove(temporary_file.name)
+            os.replace(temporary_file.name, utterance_metadata_file)
             logging.debug(
                 "Utterance metadata saved successfully to"
                 f" '{utterance_metadata_file}'"
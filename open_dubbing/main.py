@@ -12,25 +12,26 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import argparse
+import atexit
+import functools
 import logging
+import logging.handlers
 import os
+import queue
+import subprocess
 import sys
 
+from concurrent.futures import ThreadPoolExecutor
+
 from iso639 import Lang
 
+from open_dubbing import daemon, threading_init
 from open_dubbing.command_line import CommandLine
-from open_dubbing.coqui import Coqui
-from open_dubbing.dubbing import Dubber
-from open_dubbing.speech_to_text_faster_whisper import SpeechToTextFasterWhisper
-from open_dubbing.speech_to_text_whisper_transformers import (
-    SpeechToTextWhisperTransfomers,
-)
-from open_dubbing.text_to_speech_coqui import TextToSpeechCoqui
-from open_dubbing.text_to_speech_edge import TextToSpeechEdge
-from open_dubbing.text_to_speech_mms import TextToSpeechMMS
-from open_dubbing.translation_apertium import TranslationApertium
-from open_dubbing.translation_nllb import TranslationNLLB
-from open_dubbing.video_processing import VideoProcessing
+
+# The engines are imported when they are selected, most of them import torch,
+# transformers or TTS which take seconds to import. Sending a file to a
+# running daemon does not import them at all.
 
 
 def _init_logging():
@@ -53,47 +54,107 @@ def _init_logging():
     file_handler.setFormatter(formatter)
     console_handler.setFormatter(formatter)
 
+    # The file is written by a background thread, logging a debug record
+    # only puts it in a queue
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(
+        log_queue, file_handler, respect_handler_level=True
+    )
+    listener.start()
+    atexit.register(listener.stop)
+
     # Add handlers to the logger
-    logger.addHandler(file_handler)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
     logger.addHandler(console_handler)
 
     logging.getLogger("pydub.converter").setLevel(logging.ERROR)
 
 
+@functools.lru_cache(maxsize=None)
+def _get_languages(engine):
+    """Returns the languages of a speech to text or text to speech engine.
+
+    They do not change once the engine is created, so they are only listed
+    once for each engine, even when several files are dubbed.
+    """
+    return frozenset(engine.get_languages())
+
+
+@functools.lru_cache(maxsize=None)
+def _get_language_pairs(translation):
+    return frozenset(map(tuple, translation.get_language_pairs()))
+
+
 def check_languages(source_language, target_language, _tts, translation, _sst):
-    spt = _sst.get_languages()
-    translation_languages = translation.get_language_pairs()
+    """Checks that the engines support the languages.
+
+    The source language can be None when it has not been detected yet, then
+    only the target language is checked.
+    """
+    spt = _get_languages(_sst)
+    translation_languages = _get_language_pairs(translation)
     logging.debug(f"check_languages. Pairs {len(translation_languages)}")
 
-    tts = _tts.get_languages()
+    tts = _get_languages(_tts)
 
-    if source_language not in spt:
+    if source_language and source_language not in spt:
         raise ValueError(
-            f"source language '{source_language}' is not supported by the speech recognition system. Supported languages: '{spt}"
+            f"source language '{source_language}' is not supported by the speech recognition system. Supported languages: '{sorted(spt)}"
         )
 
-    pair = (source_language, target_language)
-    if pair not in translation_languages:
+    if source_language:
+        pair = (source_language, target_language)
+        if pair not in translation_languages:
+            raise ValueError(
+                f"language pair '{pair}' is not supported by the translation system."
+            )
+    elif target_language not in {target for _, target in translation_languages}:
         raise ValueError(
-            f"language pair '{pair}' is not supported by the translation system."
+            f"target language '{target_language}' is not supported by the translation system."
         )
 
     if target_language not in tts:
         raise ValueError(
-            f"target language '{target_language}' is not supported by the text to speech system. Supported languages: '{tts}"
+            f"target language '{target_language}' is not supported by the text to speech system. Supported languages: '{sorted(tts)}"
         )
 
 
-_ACCEPTED_VIDEO_FORMATS = ["mp4"]
+_ACCEPTED_VIDEO_FORMATS = frozenset({"mp4", "mkv", "mov", "webm", "m4v"})
+
+
+def _has_audio_stream(input_file: str) -> bool:
+    """Checks with ffprobe that the file has an audio stream.
+
+    Returns True if ffprobe is not available, it is reported later.
+    """
+    command = [
+        "ffprobe",
+        "-v",
+        "error",
+        "-select_streams",
+        "a",
+        "-show_entries",
+        "stream=index",
+        "-of",
+        "csv=p=0",
+        input_file,
+    ]
+    try:
+        result = subprocess.run(command, capture_output=True, text=True)
+    except FileNotFoundError:
+        return True
+
+    return result.returncode == 0 and bool(result.stdout.strip())
 
 
 def check_is_a_video(input_file: str):
-    _, file_extension = os.path.splitext(input_file)
-    file_extension = file_extension.lower().lstrip(".")
+    file_extension = input_file.rpartition(".")[2].lower()
 
-    if file_extension in _ACCEPTED_VIDEO_FORMATS:
-        return
-    raise ValueError(f"Unsupported file format: {file_extension}")
+    if file_extension not in _ACCEPTED_VIDEO_FORMATS:
+        raise ValueError(f"Unsupported file format: {file_extension}")
+
+    if not _has_audio_stream(input_file):
+        raise ValueError(f"The file '{input_file}' has no audio to dub")
 
 
 HUGGING_FACE_VARNAME = "HF_TOKEN"
@@ -109,15 +170,18 @@ def get_token(provided_token: str) -> str:
     return token
 
 
+@functools.lru_cache(maxsize=None)
+def _get_language_name(language_iso_639_3):
+    return Lang(language_iso_639_3).name
+
+
 def _get_language_names(languages_iso_639_3):
-    names = []
-    for language in languages_iso_639_3:
-        o = Lang(language)
-        names.append(o.name)
-    return sorted(names)
+    return sorted(_get_language_name(language) for language in languages_iso_639_3)
 
 
 def list_supported_languages(_tts, translation, device):  # TODO: Not used
+    from open_dubbing.speech_to_text_faster_whisper import SpeechToTextFasterWhisper
+
     s = SpeechToTextFasterWhisper(device=device)
     s.load_model()
     spt = s.get_languages()
@@ -131,23 +195,22 @@ def list_supported_languages(_tts, translation, device):  # TODO: Not used
     print(f"Supported target languages: {target}")
 
 
-def main():
-    _init_logging()
-    args = CommandLine.read_parameters()
-
-    check_is_a_video(args.input_file)
-
-    hugging_face_token = get_token(args.hugging_face_token)
-
-    if not VideoProcessing.is_ffmpeg_installed():
-        raise ValueError("You need to have ffmpeg (which includes ffprobe) installed.")
-
+def _create_tts(args):
     if args.tts == "mms":
-        tts = TextToSpeechMMS(args.device)
+        from open_dubbing.text_to_speech_mms import TextToSpeechMMS
+
+        tts = TextToSpeechMMS(args.tts_device, max_workers=args.tts_workers)
     elif args.tts == "edge":
-        tts = TextToSpeechEdge(args.device)
+        from open_dubbing.text_to_speech_edge import TextToSpeechEdge
+
+        tts = TextToSpeechEdge(args.tts_device, max_workers=args.tts_workers)
     elif args.tts == "coqui":
-        tts = TextToSpeechCoqui(args.device)
+        from open_dubbing.coqui import Coqui
+        from open_dubbing.text_to_speech_coqui import TextToSpeechCoqui
+
+        tts = TextToSpeechCoqui(
+            args.tts_device, compile=args.tts_compile, max_workers=args.tts_workers
+        )
         if not Coqui.is_espeak_ng_installed():
             raise ValueError(
                 "To use Coqui-tts you have to have espeak or espeak-ng installed"
@@ -155,44 +218,98 @@ def main():
     else:
         raise ValueError(f"Invalid tts value {args.tts}")
 
-    if sys.platform == "darwin":
-        os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    return tts
+
 
-    if args.stt == "auto":
+def _create_stt(args):
+    from open_dubbing.speech_to_text_whispercpp import SpeechToTextWhisperCpp
+
+    if args.stt == "whisper-cpp" and not SpeechToTextWhisperCpp.is_available():
+        raise ValueError(
+            "To use whisper.cpp you have to install pywhispercpp: pip install open_dubbing[whisper-cpp]"
+        )
+
+    if args.stt == "whisper-cpp":
+        stt = SpeechToTextWhisperCpp(
+            model_name=args.whisper_model,
+            device=args.stt_device,
+            cpu_threads=args.cpu_threads,
+            quant=args.whisper_quant,
+        )
+        if stt.model_name.startswith("distil-"):
+            raise ValueError(
+                f"whisper.cpp does not provide Distil-Whisper models, use --stt faster-whisper or --stt transformers with --whisper_model {args.whisper_model}"
+            )
+        if not stt.is_model_available():
+            raise ValueError(
+                f"whisper.cpp does not provide the model '{args.whisper_model}' with the quantization '{args.whisper_quant}', choose another --whisper_model or --whisper_quant"
+            )
+    elif args.stt == "auto":
         if sys.platform == "darwin":
+            from open_dubbing.speech_to_text_whisper_transformers import (
+                SpeechToTextWhisperTransfomers,
+            )
+
             stt = SpeechToTextWhisperTransfomers(
                 model_name=args.whisper_model,
-                device=args.device,
+                device=args.stt_device,
                 cpu_threads=args.cpu_threads,
+                compile=args.compile,
+                precision=args.precision,
             )
         else:
+            from open_dubbing.speech_to_text_faster_whisper import (
+                SpeechToTextFasterWhisper,
+            )
+
             stt = SpeechToTextFasterWhisper(
                 model_name=args.whisper_model,
-                device=args.device,
+                device=args.stt_device,
                 cpu_threads=args.cpu_threads,
+                batch_size=args.whisper_batch_size,
+                compute_type=args.whisper_compute_type,
             )
     elif args.stt == "faster-whisper":
+        from open_dubbing.speech_to_text_faster_whisper import SpeechToTextFasterWhisper
+
         stt = SpeechToTextFasterWhisper(
             model_name=args.whisper_model,
-            device=args.device,
+            device=args.stt_device,
             cpu_threads=args.cpu_threads,
+            batch_size=args.whisper_batch_size,
+            compute_type=args.whisper_compute_type,
         )
     else:
+        from open_dubbing.speech_to_text_whisper_transformers import (
+            SpeechToTextWhisperTransfomers,
+        )
+
         stt = SpeechToTextWhisperTransfomers(
             model_name=args.whisper_model,
-            device=args.device,
+            device=args.stt_device,
             cpu_threads=args.cpu_threads,
+            compile=args.compile,
+            precision=args.precision,
         )
 
-    stt.load_model()
-    source_language = args.source_language
-    if not source_language:
-        source_language = stt.detect_language(args.input_file)
-        logging.info(f"Detected language '{source_language}'")
+    return stt
+
 
+def _create_translation(args):
     if args.translator == "nllb":
-        translation = TranslationNLLB(args.device)
-        translation.load_model(args.nllb_model)
+        from open_dubbing.translation_nllb import TranslationNLLB
+
+        translation = TranslationNLLB(
+            args.translation_device,
+            precision=args.translation_precision,
+            compile=args.compile,
+        )
+    elif args.translator == "nllb-ct2":
+        from open_dubbing.translation_nllb_ct2 import TranslationNLLBCT2
+
+        translation = TranslationNLLBCT2(
+            args.translation_device, precision=args.translation_precision
+        )
     elif args.translator == "apertium":
         server = args.apertium_server
         if len(server) == 0:
@@ -200,11 +317,77 @@ def main():
                 "When using Apertium's API, you need to specify with --apertium-server the URL of the server"
             )
 
-        translation = TranslationApertium(args.device)
+        from open_dubbing.translation_apertium import TranslationApertium
+
+        translation = TranslationApertium(args.translation_device)
         translation.set_server(server)
     else:
         raise ValueError(f"Invalid translator value {args.translator}")
 
+    return translation
+
+
+def load_models(args):
+    """Loads the text to speech, speech to text and translation models."""
+    from open_dubbing.video_processing import VideoProcessing
+
+    threading_init.init(args.cpu_threads)
+    if not VideoProcessing.is_ffmpeg_installed():
+        raise ValueError("You need to have ffmpeg (which includes ffprobe) installed.")
+
+    tts = _create_tts(args)
+
+    if sys.platform == "darwin":
+        os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+    stt = _create_stt(args)
+    translation = _create_translation(args)
+    # Fails before spending minutes downloading and loading the models. The
+    # daemon does not know the languages until it gets a request.
+    if args.target_language:
+        check_languages(
+            args.source_language, args.target_language, tts, translation, stt
+        )
+
+    loads = [stt.load_model]
+    if args.translator in ["nllb", "nllb-ct2"]:
+        loads.append(functools.partial(translation.load_model, args.nllb_model))
+
+    if args.stt_device != "cpu" and args.stt_device == args.translation_device:
+        # Avoids the loads contending for the memory of the same GPU
+        for load in loads:
+            load()
+    else:
+        # Loading is mostly disk I/O and native code, the models load
+        # at the same time
+        with ThreadPoolExecutor(max_workers=len(loads)) as executor:
+            for future in [executor.submit(load) for load in loads]:
+                future.result()
+
+    return tts, stt, translation
+
+
+def dub(
+    args,
+    *,
+    tts,
+    stt,
+    translation,
+    hugging_face_token,
+    pyannote_pipeline=None,
+):
+    """Dubs the input file using already loaded models.
+
+    The input file has already been checked with check_is_a_video by the
+    caller, or by the client that sent the request to the daemon.
+    """
+    from open_dubbing.dubbing import Dubber
+
+    source_language = args.source_language
+    if not source_language:
+        source_language = stt.detect_language(args.input_file)
+        logging.info(f"Detected language '{source_language}'")
+
     check_languages(source_language, args.target_language, tts, translation, stt)
 
     if not os.path.exists(args.output_directory):
@@ -223,6 +406,9 @@ def main():
         device=args.device,
         cpu_threads=args.cpu_threads,
         debug=args.debug,
+        intermediate_format=args.intermediate_format,
+        precision=args.precision,
+        pyannote_pipeline=pyannote_pipeline,
     )
     logging.info(
         f"Processing '{args.input_file}' file with tts '{args.tts}', sst {args.stt} and device '{args.device}'"
@@ -230,5 +416,107 @@ def main():
     dubber.dub()
 
 
+def _serve(args, hugging_face_token):
+    from open_dubbing.dubbing import load_pyannote_pipeline
+
+    tts, stt, translation = load_models(args)
+    pyannote_pipeline = load_pyannote_pipeline(
+        hugging_face_token=hugging_face_token,
+        device=args.device,
+        precision=args.precision,
+    )
+    daemon.serve(
+        address=args.server_socket,
+        args=args,
+        dub=functools.partial(
+            dub,
+            tts=tts,
+            stt=stt,
+            translation=translation,
+            hugging_face_token=hugging_face_token,
+            pyannote_pipeline=pyannote_pipeline,
+        ),
+    )
+
+
+def _read_input_file_list(path: str):
+    """Yields the video files of the list, one per line, while reading it."""
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            input_file = line.strip()
+            if input_file:
+                yield input_file
+
+
+def _dub_input_file_list(args, hugging_face_token):
+    models = None
+    failed = []
+    for input_file in _read_input_file_list(args.input_file_list):
+        file_args = argparse.Namespace(**vars(args))
+        file_args.input_file = input_file
+        # Each video has its own directory since the files have the same names
+        name = os.path.splitext(os.path.basename(input_file))[0]
+        file_args.output_directory = os.path.join(args.output_directory, name)
+        try:
+            check_is_a_video(input_file)
+            if args.use_daemon and daemon.dispatch(
+                address=args.server_socket, args=file_args
+            ):
+                continue
+
+            # The models are loaded once and reused for all the videos
+            if not models:
+                models = load_models(args)
+
+            tts, stt, translation = models
+            dub(
+                file_args,
+                tts=tts,
+                stt=stt,
+                translation=translation,
+                hugging_face_token=hugging_face_token,
+            )
+        except Exception as e:
+            logging.error(f"main._dub_input_file_list. Cannot dub '{input_file}': {e}")
+            failed.append(input_file)
+
+    if failed:
+        raise ValueError(f"Cannot dub the files: {', '.join(failed)}")
+
+
+def run(args):
+    """Dubs the file, or starts the daemon, described by the parsed arguments."""
+    if not args.server_socket and (args.serve or args.use_daemon):
+        args.server_socket = daemon.get_default_address()
+
+    hugging_face_token = get_token(args.hugging_face_token)
+
+    if args.serve:
+        _serve(args, hugging_face_token)
+        return
+
+    if args.input_file_list:
+        _dub_input_file_list(args, hugging_face_token)
+        return
+
+    check_is_a_video(args.input_file)
+    if args.use_daemon and daemon.dispatch(address=args.server_socket, args=args):
+        return
+
+    tts, stt, translation = load_models(args)
+    dub(
+        args,
+        tts=tts,
+        stt=stt,
+        translation=translation,
+        hugging_face_token=hugging_face_token,
+    )
+
+
+def main(argv=None):
+    _init_logging()
+    run(CommandLine.read_parameters(argv))
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,70 @@
+# Copyright 2024 Jordi Mas i Hernàndez <jmas@softcatala.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import functools
+import platform
+
+import torch
+
+# CPU flags of the x86 instructions that compute with bfloat16 natively
+_CPU_BF16_FLAGS = ("avx512_bf16", "amx_bf16")
+
+
+def get_default_precision(device: str) -> str:
+    """Returns the precision used for the models when none is specified.
+
+    FP16 on CUDA, where autocast uses the Tensor Cores, and INT8 on CPU.
+    """
+    return "fp16" if device.startswith("cuda") else "int8"
+
+
+@functools.lru_cache(maxsize=1)
+def is_cpu_bf16_supported() -> bool:
+    """Returns whether the CPU computes bfloat16 natively.
+
+    Without native support bfloat16 is emulated and slower than FP32. Only
+    detected on Linux, where the CPU flags are listed in /proc/cpuinfo.
+    """
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    flags = line.split(":", 1)[1].split()
+                    return any(flag in flags for flag in _CPU_BF16_FLAGS)
+    except OSError:
+        pass
+    return False
+
+
+def select_engine() -> str:
+    """Selects the quantized engine that matches the CPU architecture.
+
+    FBGEMM (the default engine) is used on x86 and QNNPACK on ARM.
+    """
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        torch.backends.quantized.engine = "qnnpack"
+    return torch.backends.quantized.engine
+
+
+def quantize_dynamic(
+    model: torch.nn.Module, layers: set[type[torch.nn.Module]]
+) -> torch.nn.Module:
+    """Quantizes the weights of the given layer types to INT8, in place.
+
+    Dynamic quantization is only supported on CPU.
+    """
+    select_engine()
+    return torch.ao.quantization.quantize_dynamic(
+        model, layers, dtype=torch.qint8, inplace=True
+    )
@@ -13,21 +13,38 @@
 # limitations under the License.
 
 import array
+import functools
 import logging
+import subprocess
 
 from abc import ABC, abstractmethod
 from typing import Mapping, Sequence
 
+import numpy as np
+
 from iso639 import Lang
 from pydub import AudioSegment
 
 from open_dubbing.voice_gender_classifier import VoiceGenderClassifier
 
+# Peak level under which the audio used to detect the language is silent
+_SILENCE_DBFS = -50.0
+
+# Short names for the faster models. 'turbo' has an accuracy close to
+# large-v3, 'distil' is English only and not available for whisper.cpp
+_MODEL_ALIASES = {
+    "turbo": "large-v3-turbo",
+    "distil": "distil-large-v3",
+}
+
+# Distil-Whisper was only trained to transcribe English
+_ENGLISH_ONLY_MODEL_NAMES = ["distil-large-v3"]
+
 
 class SpeechToText(ABC):
 
     def __init__(self, *, model_name="medium", device="cpu", cpu_threads=0):
-        self.model_name = model_name
+        self.model_name = _MODEL_ALIASES.get(model_name, model_name)
         self.model = None
         self.device = device
         self.cpu_threads = cpu_threads
@@ -49,12 +66,21 @@ class SpeechToText(ABC):
     def get_languages(self):
         pass
 
-    def _get_iso_639_1(self, iso_639_3: str):
+    def is_english_only(self) -> bool:
+        return self.model_name in _ENGLISH_ONLY_MODEL_NAMES
+
+    # The codes are converted for every language of the models, the
+    # conversions are cached for the process
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _get_iso_639_1(iso_639_3: str):
         o = Lang(iso_639_3)
         iso_639_1 = o.pt1
         return iso_639_1
 
-    def _get_iso_639_3(self, iso_639_1: str):
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _get_iso_639_3(iso_639_1: str):
         if iso_639_1 == "jw":
             iso_639_1 = "jv"
 
@@ -71,6 +97,54 @@ class SpeechToText(ABC):
     ) -> str:
         pass
 
+    def _transcribe_one_by_one(
+        self, *, vocals_filepaths: Sequence[str], source_language_iso_639_1: str
+    ) -> Sequence[str]:
+        transcriptions = []
+        for vocals_filepath in vocals_filepaths:
+            try:
+                transcribed_text = self._transcribe(
+                    vocals_filepath=vocals_filepath,
+                    source_language_iso_639_1=source_language_iso_639_1,
+                )
+            except Exception as e:
+                logging.error(
+                    f"speech_to_text.transcribe_audio_chunks. file '{vocals_filepath}', error: '{e}'"
+                )
+                transcribed_text = ""
+            transcriptions.append(transcribed_text)
+        return transcriptions
+
+    def _transcribe_batch(
+        self,
+        *,
+        vocals_filepaths: Sequence[str],
+        source_language_iso_639_1: str,
+    ) -> Sequence[str]:
+        """Transcribes several files, implementations can override it to run them as a batch."""
+        return self._transcribe_one_by_one(
+            vocals_filepaths=vocals_filepaths,
+            source_language_iso_639_1=source_language_iso_639_1,
+        )
+
+    def _transcribe_files(
+        self, *, vocals_filepaths: Sequence[str], source_language_iso_639_1: str
+    ) -> Sequence[str]:
+        try:
+            return self._transcribe_batch(
+                vocals_filepaths=vocals_filepaths,
+                source_language_iso_639_1=source_language_iso_639_1,
+            )
+        except Exception as e:
+            logging.warning(
+                f"speech_to_text._transcribe_files. Cannot transcribe the files as a batch, transcribing them one by one. Error: '{e}'"
+            )
+
+        return self._transcribe_one_by_one(
+            vocals_filepaths=vocals_filepaths,
+            source_language_iso_639_1=source_language_iso_639_1,
+        )
+
     def transcribe_audio_chunks(
         self,
         *,
@@ -82,36 +156,48 @@ class SpeechToText(ABC):
         logging.debug(f"transcribe_audio_chunks: {source_language}")
         iso_639_1 = self._get_iso_639_1(source_language)
 
-        updated_utterance_metadata = []
-        for item in utterance_metadata:
-            new_item = item.copy()
-            path = ""
-            try:
-                path = item["path"]
-                duration = item["end"] - item["start"]
-                if self._is_short_audio(duration=duration):
-                    transcribed_text = ""
-                    logging.warn(
-                        f"speech_to_text._is_short_audio. Audio is less than {self.MIN_SECS} second, skipping transcription of '{path}'."
-                    )
-                else:
-                    transcribed_text = self._transcribe(
-                        vocals_filepath=path,
-                        source_language_iso_639_1=iso_639_1,
-                    )
-            except Exception as e:
+        # All the files are transcribed together to allow batching them
+        transcriptions = [""] * len(utterance_metadata)
+        indexes = []
+        for index, item in enumerate(utterance_metadata):
+            path = item.get("path", "")
+            duration = item["end"] - item["start"]
+            if not path:
                 logging.error(
-                    f"speech_to_text.transcribe_audio_chunks. file '{path}', error: '{e}'"
+                    f"speech_to_text.transcribe_audio_chunks. No file for utterance at {item['start']}"
                 )
-                transcribed_text = ""
-
+            elif self._is_short_audio(duration=duration):
+                logging.warn(
+                    f"speech_to_text._is_short_audio. Audio is less than {self.MIN_SECS} second, skipping transcription of '{path}'."
+                )
+            else:
+                indexes.append(index)
+
+        vocals_filepaths = [utterance_metadata[index]["path"] for index in indexes]
+        if vocals_filepaths:
+            for index, transcribed_text in zip(
+                indexes,
+                self._transcribe_files(
+                    vocals_filepaths=vocals_filepaths,
+                    source_language_iso_639_1=iso_639_1,
+                ),
+            ):
+                transcriptions[index] = transcribed_text
+
+        updated_utterance_metadata = [None] * len(utterance_metadata)
+        for index, (item, transcribed_text) in enumerate(
+            zip(utterance_metadata, transcriptions)
+        ):
             dubbing = len(transcribed_text) > 0
             logging.debug(
                 f"transcribe_audio_chunks. text: '{transcribed_text}' - dubbing: {dubbing}"
             )
-            new_item["text"] = transcribed_text
-            new_item["for_dubbing"] = dubbing
-            updated_utterance_metadata.append(new_item)
+            # A single copy of the item with the new keys
+            updated_utterance_metadata[index] = {
+                **item,
+                "text": transcribed_text,
+                "for_dubbing": dubbing,
+            }
         return updated_utterance_metadata
 
     #  Returns a list of unique speakers with the largest audio sample for the speaker
@@ -120,22 +206,11 @@ class SpeechToText(ABC):
         for chunk in utterance_metadata:
             speaker = chunk["speaker_id"]
             length = chunk["end"] - chunk["start"]
-            dubbed_path = chunk["path"]
+            largest = speakers.get(speaker)
+            if largest is None or length > largest[0]:
+                speakers[speaker] = (length, chunk["path"])
 
-            speaker_data = speakers.get(speaker, {})
-            save = False
-            if len(speaker_data) == 0:
-                save = True
-            else:
-                if length > speaker_data["length"]:
-                    save = True
-
-            if save:
-                speaker_data["length"] = length
-                speaker_data["path"] = dubbed_path
-                speakers[speaker] = speaker_data
-
-        speaker_tuple = [(speaker, data["path"]) for speaker, data in speakers.items()]
+        speaker_tuple = [(speaker, path) for speaker, (_, path) in speakers.items()]
         logging.debug(
             f"text_to_speech._get_unique_speakers_largest_audio: {speaker_tuple}"
         )
@@ -149,19 +224,19 @@ class SpeechToText(ABC):
         number_of_speakers: int,
     ) -> Sequence[tuple[str, str]]:
 
-        speaker_gender = {}
         classifier = VoiceGenderClassifier()
         speakers = self._get_unique_speakers_largest_audio(utterance_metadata)
-        for speaker, path in speakers:
-            gender = classifier.get_gender_for_file(path)
-            speaker_gender[speaker] = gender
+        speaker_gender = dict(
+            zip(
+                [speaker for speaker, _ in speakers],
+                classifier.get_genders_for_files([path for _, path in speakers]),
+            )
+        )
 
-        r = []
-        for chunk in utterance_metadata:
-            speaker = chunk["speaker_id"]
-            gender = speaker_gender[speaker]
-            _tuple = (speaker, gender)
-            r.append(_tuple)
+        r = [
+            (chunk["speaker_id"], speaker_gender[chunk["speaker_id"]])
+            for chunk in utterance_metadata
+        ]
 
         logging.debug(f"text_to_speech.diarize_speakers. Returns: {r}")
         return r
@@ -176,27 +251,75 @@ class SpeechToText(ABC):
                 "The length of 'utterance_metadata' and 'speaker_info' must be the"
                 " same."
             )
-        updated_utterance_metadata = []
-        for utterance, (speaker_id, ssml_gender) in zip(
-            utterance_metadata, speaker_info
-        ):
-            new_utterance = utterance.copy()
-            new_utterance["speaker_id"] = speaker_id
-            new_utterance["ssml_gender"] = ssml_gender
-            updated_utterance_metadata.append(new_utterance)
-        return updated_utterance_metadata
+        return [
+            {**utterance, "speaker_id": speaker_id, "ssml_gender": ssml_gender}
+            for utterance, (speaker_id, ssml_gender) in zip(
+                utterance_metadata, speaker_info
+            )
+        ]
+
+    @staticmethod
+    def _pcm16_to_float32(audio: AudioSegment | array.array) -> np.ndarray:
+        """Converts 16 bits samples to float32 in [-1, 1) with a single copy."""
+        data = audio.raw_data if isinstance(audio, AudioSegment) else audio
+        samples = np.frombuffer(data, dtype=np.int16)
+        # The ufunc casts and scales in the same pass into the output array
+        return np.multiply(samples, np.float32(1.0 / 32768.0), dtype=np.float32)
+
+    def _load_audio(self, vocals_filepath: str) -> np.ndarray:
+        """Decodes the file to mono 16 kHz float32 samples, as Whisper expects.
+
+        WAV files, the default intermediate format, are read by pydub
+        without starting ffmpeg.
+        """
+        audio = AudioSegment.from_file(vocals_filepath)
+        audio = audio.set_channels(1)
+        audio = audio.set_frame_rate(16000)
+        audio = audio.set_sample_width(2)
+        return self._pcm16_to_float32(audio)
 
     @abstractmethod
-    def _get_audio_language(self, audio: array.array) -> str:
+    def _get_audio_language(self, audio: np.ndarray) -> str:
         pass
 
+    def _decode_first_seconds(self, filename: str, *, seconds: int) -> np.ndarray:
+        """Decodes the first seconds of the file to mono 16 kHz float32 samples.
+
+        ffmpeg decodes, downmixes and resamples the audio in a single
+        process, only the first seconds are decoded.
+        """
+        command = [
+            "ffmpeg",
+            "-nostdin",
+            "-loglevel",
+            "error",
+            "-i",
+            filename,
+            "-t",
+            str(seconds),
+            "-vn",
+            "-ac",
+            "1",
+            "-ar",
+            "16000",
+            "-f",
+            "f32le",
+            "-",
+        ]
+        output = subprocess.run(command, capture_output=True, check=True).stdout
+        return np.frombuffer(output, dtype=np.float32)
+
     def detect_language(self, filename: str) -> str:
         DURATION_SECS = 30
-        audio = AudioSegment.from_file(filename)
-        audio = audio.set_channels(1)
-        audio = audio.set_frame_rate(16000)
+        first_seconds = self._decode_first_seconds(filename, seconds=DURATION_SECS)
+
+        # Whisper returns any language for silence, running it is useless
+        peak = np.abs(first_seconds).max() if first_seconds.size else 0.0
+        if peak < 10 ** (_SILENCE_DBFS / 20):
+            raise ValueError(
+                f"The first {DURATION_SECS} seconds of '{filename}' are silent and the language cannot be detected, use --source_language to specify it"
+            )
 
-        first_seconds = audio[: DURATION_SECS * 1000].get_array_of_samples()
         return self._get_audio_language(first_seconds)
 
     # To prevent Whisper hallucinations with very short audios
@@ -12,34 +12,151 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import array
+import bisect
+import functools
 import logging
 
+from concurrent.futures import ThreadPoolExecutor
+from typing import Sequence
+
 import numpy as np
+import torch
 
-from faster_whisper import WhisperModel
+from faster_whisper import BatchedInferencePipeline, WhisperModel, decode_audio
+from faster_whisper.tokenizer import _LANGUAGE_CODES
 
 from open_dubbing.speech_to_text import SpeechToText
 
+_DISTILLED_MODEL_NAMES = ["large-v3-turbo", "distil-large-v3"]
+# First compute capability with int8 tensor cores (Turing)
+_INT8_TENSOR_CORES_CAPABILITY = (7, 5)
+# CTranslate2 Flash Attention needs Ampere or newer GPUs
+_FLASH_ATTENTION_CAPABILITY = (8, 0)
+# CPU threads used by each CTranslate2 worker when there are several workers
+_THREADS_PER_WORKER = 4
+_CUDA_BATCH_SIZE = 8
+_SAMPLING_RATE = 16000
+# Whisper decodes windows of up to 30 seconds
+_MAX_CHUNK_SAMPLES = 30 * _SAMPLING_RATE
+
+
+@functools.lru_cache(maxsize=None)
+def _load_model(
+    model_name: str,
+    device: str,
+    device_index: int,
+    cpu_threads: int,
+    num_workers: int,
+    compute_type: str,
+    flash_attention: bool,
+) -> WhisperModel:
+    """Loads the model once per process, instances with the same configuration share it."""
+    return WhisperModel(
+        model_size_or_path=model_name,
+        device=device,
+        device_index=device_index,
+        cpu_threads=cpu_threads,
+        num_workers=num_workers,
+        compute_type=compute_type,
+        flash_attention=flash_attention,
+    )
+
 
 class SpeechToTextFasterWhisper(SpeechToText):
 
-    def __init__(self, *, model_name="medium", device="cpu", cpu_threads=0):
+    def __init__(
+        self,
+        *,
+        model_name="medium",
+        device="cpu",
+        cpu_threads=0,
+        batch_size=None,
+        compute_type=None,
+    ):
         super().__init__(device=device, model_name=model_name, cpu_threads=cpu_threads)
+        self.batch_size = batch_size or self._get_default_batch_size()
+        self.compute_type = compute_type
+        self._batched_model = None
 
         logging.getLogger("faster_whisper").setLevel(logging.ERROR)
 
+    def _get_default_batch_size(self) -> int:
+        # Batching pads the segments to the same length, it pays off on GPU.
+        # On CPU the files are transcribed in parallel by several workers.
+        if self.device.startswith("cuda"):
+            return _CUDA_BATCH_SIZE
+
+        return 1
+
+    def _get_compute_type(self):
+        if self.compute_type:
+            return self.compute_type
+
+        if not self.device.startswith("cuda"):
+            return "int8"
+
+        # Distilled models have few decoder layers and run well with int8
+        # weights. On GPUs with int8 tensor cores int8 weights are faster and
+        # use less memory for all the models.
+        if (
+            self.model_name in _DISTILLED_MODEL_NAMES
+            or torch.cuda.get_device_capability(self.device)
+            >= _INT8_TENSOR_CORES_CAPABILITY
+        ):
+            return "int8_float16"
+
+        return "float16"
+
+    def _get_cpu_threads(self) -> int:
+        # 0 uses the threads selected by threading_init for torch
+        return self.cpu_threads if self.cpu_threads > 0 else torch.get_num_threads()
+
+    def _get_num_workers(self) -> int:
+        # On CPU several workers, each one with its own threads, transcribe
+        # files in parallel. The utterances are short and a single one does
+        # not keep all the cores busy.
+        if self.device.startswith("cuda"):
+            return 1
+
+        return max(1, self._get_cpu_threads() // _THREADS_PER_WORKER)
+
+    def _use_flash_attention(self, compute_type: str) -> bool:
+        # Only with half precision activations
+        return (
+            self.device.startswith("cuda")
+            and compute_type.endswith("16")
+            and torch.cuda.get_device_capability(self.device)
+            >= _FLASH_ATTENTION_CAPABILITY
+        )
+
     def load_model(self):
-        self._model = WhisperModel(
-            model_size_or_path=self.model_name,
-            device=self.device,
-            cpu_threads=self.cpu_threads,
-            compute_type="float16" if self.device == "cuda" else "int8",
+        # CTranslate2 expects a device like 'cuda:1' as device and index
+        device, _, device_index = self.device.partition(":")
+        num_workers = self._get_num_workers()
+        compute_type = self._get_compute_type()
+        self._model = _load_model(
+            self.model_name,
+            device,
+            int(device_index or 0),
+            self._get_cpu_threads() // num_workers,
+            num_workers,
+            compute_type,
+            self._use_flash_attention(compute_type),
         )
+        # Batched inference decodes several VAD segments of the audio at once.
+        # It does not produce word timestamps, that we do not use.
+        if self.batch_size > 1:
+            self._batched_model = BatchedInferencePipeline(model=self._model)
 
     def get_languages(self):
+        if self.is_english_only():
+            return ["eng"]
+
+        # The languages are known before loading the model, the rest of the
+        # supported models are multilingual
+        languages = self.model.supported_languages if self.model else _LANGUAGE_CODES
         iso_639_3 = []
-        for language in self.model.supported_languages:
+        for language in languages:
             pt3 = self._get_iso_639_3(language)
             iso_639_3.append(pt3)
         return iso_639_3
@@ -50,14 +167,116 @@ class SpeechToTextFasterWhisper(SpeechToText):
         vocals_filepath: str,
         source_language_iso_639_1: str,
     ) -> str:
-        segments, _ = self.model.transcribe(
-            vocals_filepath,
+        if self._batched_model:
+            segments, _ = self._batched_model.transcribe(
+                vocals_filepath,
+                source_language_iso_639_1,
+                batch_size=self.batch_size,
+                vad_filter=True,
+            )
+        else:
+            # The chunks are single utterances, the text of previous windows
+            # and the timestamps are not needed
+            segments, _ = self.model.transcribe(
+                vocals_filepath,
+                source_language_iso_639_1,
+                condition_on_previous_text=False,
+                without_timestamps=True,
+            )
+        return " ".join(segment.text for segment in segments)
+
+    def _get_clips(
+        self, audios: Sequence[np.ndarray]
+    ) -> tuple[np.ndarray, list[dict], list[int]]:
+        """Concatenates the audios and gives each one its own clips.
+
+        Every audio is decoded alone, in one clip or, if it is longer than 30
+        seconds, in several, so the context of an utterance is never shared
+        with the others.
+
+        Returns:
+            The concatenated audio, the clip timestamps for the batched
+            pipeline and the index of the audio of each clip.
+        """
+        clip_timestamps = []
+        clip_audios = []
+        position = 0
+        for index, audio in enumerate(audios):
+            for start in range(0, len(audio), _MAX_CHUNK_SAMPLES):
+                end = min(start + _MAX_CHUNK_SAMPLES, len(audio))
+                clip_timestamps.append(
+                    {"start": position + start, "end": position + end}
+                )
+                clip_audios.append(index)
+            position += len(audio)
+
+        return np.concatenate(audios), clip_timestamps, clip_audios
+
+    def _transcribe_files_batched(
+        self,
+        *,
+        vocals_filepaths: Sequence[str],
+        source_language_iso_639_1: str,
+    ) -> Sequence[str]:
+        """Transcribes all the files in the same batches.
+
+        The files are concatenated and each one is given as its own clips to
+        the batched pipeline. Without timestamps, the pipeline returns one
+        segment per clip that spans the whole clip, it is assigned to the
+        file of the clip.
+        """
+        audios = [
+            decode_audio(path, sampling_rate=_SAMPLING_RATE)
+            for path in vocals_filepaths
+        ]
+        audio, clip_timestamps, clip_audios = self._get_clips(audios)
+        segments, _ = self._batched_model.transcribe(
+            audio,
             source_language_iso_639_1,
+            batch_size=self.batch_size,
+            clip_timestamps=clip_timestamps,
+            without_timestamps=True,
         )
-        return " ".join(segment.text for segment in segments)
 
-    def _get_audio_language(self, audio: array.array) -> str:
-        _, info = self.model.transcribe(np.array(audio))
+        clip_starts = [clip["start"] / _SAMPLING_RATE for clip in clip_timestamps]
+        texts = [[] for _ in vocals_filepaths]
+        for segment in segments:
+            middle = (segment.start + segment.end) / 2
+            clip = max(0, bisect.bisect_right(clip_starts, middle) - 1)
+            texts[clip_audios[clip]].append(segment.text)
+
+        return ["".join(text).strip() for text in texts]
+
+    def _transcribe_batch(
+        self,
+        *,
+        vocals_filepaths: Sequence[str],
+        source_language_iso_639_1: str,
+    ) -> Sequence[str]:
+        if self._batched_model:
+            return self._transcribe_files_batched(
+                vocals_filepaths=vocals_filepaths,
+                source_language_iso_639_1=source_language_iso_639_1,
+            )
+
+        num_workers = self._get_num_workers()
+        if num_workers == 1:
+            return super()._transcribe_batch(
+                vocals_filepaths=vocals_filepaths,
+                source_language_iso_639_1=source_language_iso_639_1,
+            )
+
+        def _transcribe_file(vocals_filepath: str) -> str:
+            return self._transcribe_one_by_one(
+                vocals_filepaths=[vocals_filepath],
+                source_language_iso_639_1=source_language_iso_639_1,
+            )[0]
+
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            return list(executor.map(_transcribe_file, vocals_filepaths))
+
+    def _get_audio_language(self, audio: np.ndarray) -> str:
+        _, info = self.model.transcribe(audio)
         detected_language = self._get_iso_639_3(info.language)
         logging.debug(
             f"speech_to_text_faster_whisper._get_audio_language. Detected language: {detected_language}"
@@ -12,28 +12,218 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import array
 import logging
+import re
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Final, Sequence
 
 import numpy as np
 import torch
 
-from pydub import AudioSegment
 from transformers import WhisperForConditionalGeneration, WhisperProcessor
 
+from open_dubbing import quantization
 from open_dubbing.speech_to_text import SpeechToText
 
+_MODEL_NAMES = {
+    "distil-large-v3": "distil-whisper/distil-large-v3",
+}
+
+# Whisper pads every input to 30 seconds, so batching files of different
+# lengths does not waste computation
+_BATCH_SIZE = 8
+_SAMPLING_RATE = 16000
+# The decoder has 448 positions, 4 of them are used by the prompt tokens
+_MAX_NEW_TOKENS = 444
+# Bound of the tokens per second of speech, generous to not truncate fast
+# speakers. It stops repetition loops on short clips before the decoder
+# walks all its positions.
+_TOKENS_PER_SECOND = 12
+_MIN_NEW_TOKENS = 16
+
+# Languages supported by the multilingual Whisper models
+_LANGUAGES: Final[tuple[str, ...]] = (
+    "af",
+    "am",
+    "ar",
+    "as",
+    "az",
+    "ba",
+    "be",
+    "bg",
+    "bn",
+    "bo",
+    "br",
+    "bs",
+    "ca",
+    "cs",
+    "cy",
+    "da",
+    "de",
+    "el",
+    "en",
+    "es",
+    "et",
+    "eu",
+    "fa",
+    "fi",
+    "fo",
+    "fr",
+    "gl",
+    "gu",
+    "ha",
+    "haw",
+    "he",
+    "hi",
+    "hr",
+    "ht",
+    "hu",
+    "hy",
+    "id",
+    "is",
+    "it",
+    "ja",
+    "jw",
+    "ka",
+    "kk",
+    "km",
+    "kn",
+    "ko",
+    "la",
+    "lb",
+    "ln",
+    "lo",
+    "lt",
+    "lv",
+    "mg",
+    "mi",
+    "mk",
+    "ml",
+    "mn",
+    "mr",
+    "ms",
+    "mt",
+    "my",
+    "ne",
+    "nl",
+    "nn",
+    "no",
+    "oc",
+    "pa",
+    "pl",
+    "ps",
+    "pt",
+    "ro",
+    "ru",
+    "sa",
+    "sd",
+    "si",
+    "sk",
+    "sl",
+    "sn",
+    "so",
+    "sq",
+    "sr",
+    "su",
+    "sv",
+    "sw",
+    "ta",
+    "te",
+    "tg",
+    "th",
+    "tk",
+    "tl",
+    "tr",
+    "tt",
+    "uk",
+    "ur",
+    "uz",
+    "vi",
+    "yi",
+    "yo",
+    "zh",
+    "yue",
+)
+_LANGUAGES_SET: Final[frozenset[str]] = frozenset(_LANGUAGES)
+_LANGUAGE_TOKEN_PATTERN: Final[re.Pattern] = re.compile(r"<\|([a-z]{2,3})\|>")
+_LANGUAGES_ISO_639_3: Final[tuple[str, ...]] = tuple(
+    SpeechToText._get_iso_639_3(language) for language in _LANGUAGES
+)
+
 
 class SpeechToTextWhisperTransfomers(SpeechToText):
 
-    def __init__(self, *, model_name="medium", device="cpu", cpu_threads=0):
+    def __init__(
+        self,
+        *,
+        model_name="medium",
+        device="cpu",
+        cpu_threads=0,
+        compile=False,
+        precision=None,
+    ):
         super().__init__(device=device, model_name=model_name, cpu_threads=cpu_threads)
+        self.compile = compile and device.startswith("cuda")
+        self.precision = precision or quantization.get_default_precision(device)
         self._processor = None
 
     def load_model(self):
-        full_model_name = f"openai/whisper-{self.model_name}"
+        full_model_name = _MODEL_NAMES.get(
+            self.model_name, f"openai/whisper-{self.model_name}"
+        )
         self._processor = WhisperProcessor.from_pretrained(full_model_name)
-        self._model = WhisperForConditionalGeneration.from_pretrained(full_model_name)
+        # The fused scaled dot product attention of torch replaces the eager
+        # attention
+        on_cuda = self.device.startswith("cuda")
+        self._model = WhisperForConditionalGeneration.from_pretrained(
+            full_model_name,
+            torch_dtype=self._get_torch_dtype(),
+            attn_implementation="sdpa",
+            # Loads the weights directly, without initializing the model first
+            low_cpu_mem_usage=True,
+        ).to(self.device)
+        if not on_cuda and self.precision == "int8":
+            self._model = quantization.quantize_dynamic(self._model, {torch.nn.Linear})
+        if self.compile:
+            self._compile()
+
+    def _get_torch_dtype(self) -> torch.dtype:
+        # The weights and the activations use half precision end to end: FP16
+        # on GPU and bfloat16 on CPUs that compute it natively. INT8 is only
+        # used on CPU, on top of FP32.
+        if self.precision != "fp16":
+            return torch.float32
+        if self.device.startswith("cuda"):
+            return torch.float16
+        if quantization.is_cpu_bf16_supported():
+            return torch.bfloat16
+        return torch.float32
+
+    def _compile(self):
+        self._model.forward = torch.compile(self._model.forward, dynamic=True)
+
+        # Pay the compilation cost once when the model is loaded
+        input_features = self._get_input_features(
+            np.zeros(_SAMPLING_RATE, dtype=np.float32)
+        )
+        with torch.inference_mode():
+            self._model.generate(input_features, language="en", max_new_tokens=4)
+
+    def _get_input_features(self, audio) -> torch.Tensor:
+        # The log-mel spectrograms of the batch are computed with torch on
+        # the model's device
+        return self._processor(
+            audio,
+            sampling_rate=_SAMPLING_RATE,
+            return_tensors="pt",
+            device=self.device,
+        ).input_features.to(self.device, dtype=self._model.dtype)
+
+    @staticmethod
+    def _get_max_new_tokens(num_samples: int) -> int:
+        seconds = num_samples / _SAMPLING_RATE
+        return min(_MAX_NEW_TOKENS, _MIN_NEW_TOKENS + int(seconds * _TOKENS_PER_SECOND))
 
     def _transcribe(
         self,
@@ -41,41 +231,58 @@ class SpeechToTextWhisperTransfomers(SpeechToText):
         vocals_filepath: str,
         source_language_iso_639_1: str,
     ) -> str:
-
-        audio = AudioSegment.from_file(vocals_filepath)
-        audio = audio.set_channels(1)  # Convert to mono
-        audio = audio.set_frame_rate(16000)  # Set the frame rate to 16kHz
-        # Convert the audio to a numpy array
-        audio_input = (
-            np.array(audio.get_array_of_samples()).astype(np.float32) / 32768.0
-        )  # Normalize
-
-        # Preprocess the audio input
-        input_features = self._processor(
-            audio_input, sampling_rate=16000, return_tensors="pt"
-        ).input_features
-
-        with torch.no_grad():
-            generated_ids = self._model.generate(
-                input_features, language=source_language_iso_639_1
-            )
-        transcription = self._processor.batch_decode(
-            generated_ids, skip_special_tokens=True
+        return self._transcribe_batch(
+            vocals_filepaths=[vocals_filepath],
+            source_language_iso_639_1=source_language_iso_639_1,
         )[0]
-        logging.debug(
-            f"speech_to_text_whisper_transfomers._transcribe. transcription: {transcription}, file {vocals_filepath}"
-        )
-        return transcription
 
-    def _get_audio_language(self, audio: array.array) -> str:
-        audio_input = np.array(audio).astype(np.float32) / 32768.0
+    def _transcribe_batch(
+        self,
+        *,
+        vocals_filepaths: Sequence[str],
+        source_language_iso_639_1: str,
+    ) -> Sequence[str]:
+        if not vocals_filepaths:
+            return []
 
-        # Preprocess the audio input
-        input_features = self._processor(
-            audio_input, sampling_rate=16000, return_tensors="pt"
-        ).input_features
+        transcriptions = []
+        batches = [
+            vocals_filepaths[i : i + _BATCH_SIZE]
+            for i in range(0, len(vocals_filepaths), _BATCH_SIZE)
+        ]
+        # Decoding the files runs ffmpeg, the next batch is decoded while
+        # the model transcribes the current one
+        with ThreadPoolExecutor(max_workers=_BATCH_SIZE) as executor:
+            next_audio_inputs = executor.map(self._load_audio, batches[0])
+            for index, batch_filepaths in enumerate(batches):
+                audio_inputs = list(next_audio_inputs)
+                if index + 1 < len(batches):
+                    next_audio_inputs = executor.map(
+                        self._load_audio, batches[index + 1]
+                    )
 
-        with torch.no_grad():
+                input_features = self._get_input_features(audio_inputs)
+                with torch.inference_mode():
+                    generated_ids = self._model.generate(
+                        input_features,
+                        language=source_language_iso_639_1,
+                        max_new_tokens=self._get_max_new_tokens(
+                            max(len(audio) for audio in audio_inputs)
+                        ),
+                    )
+                batch_transcriptions = self._processor.batch_decode(
+                    generated_ids, skip_special_tokens=True
+                )
+                for transcription, path in zip(batch_transcriptions, batch_filepaths):
+                    logging.debug(
+                        f"speech_to_text_whisper_transfomers._transcribe_batch. transcription: {transcription}, file {path}"
+                    )
+                transcriptions.extend(batch_transcriptions)
+        return transcriptions
+
+    def _get_audio_language(self, audio: np.ndarray) -> str:
+        input_features = self._get_input_features(audio)
+        with torch.inference_mode():
             generated_ids = self._model.generate(input_features)
 
         # Decode the transcription including special tokens to capture the language token
@@ -83,12 +290,12 @@ class SpeechToTextWhisperTransfomers(SpeechToText):
             generated_ids, skip_special_tokens=False
         )[0]
 
+        # The first special token with a language code, like '<|en|>'
         detected_language = None
-        if "|" in transcription_with_tokens:
-            for token in transcription_with_tokens.split("|"):
-                if (len(token) == 2 or len(token) == 3) and token.isalpha():
-                    detected_language = self._get_iso_639_3(token)
-                    break
+        for match in _LANGUAGE_TOKEN_PATTERN.finditer(transcription_with_tokens):
+            if match.group(1) in _LANGUAGES_SET:
+                detected_language = self._get_iso_639_3(match.group(1))
+                break
         logging.debug(
             f"speech_to_text_whisper_transfomers._get_audio_language. Detected language: {detected_language}"
         )
@@ -96,111 +303,7 @@ class SpeechToTextWhisperTransfomers(SpeechToText):
         return detected_language
 
     def get_languages(self):
-        languages = [
-            "af",
-            "am",
-            "ar",
-            "as",
-            "az",
-            "ba",
-            "be",
-            "bg",
-            "bn",
-            "bo",
-            "br",
-            "bs",
-            "ca",
-            "cs",
-            "cy",
-            "da",
-            "de",
-            "el",
-            "en",
-            "es",
-            "et",
-            "eu",
-            "fa",
-            "fi",
-            "fo",
-            "fr",
-            "gl",
-            "gu",
-            "ha",
-            "haw",
-            "he",
-            "hi",
-            "hr",
-            "ht",
-            "hu",
-            "hy",
-            "id",
-            "is",
-            "it",
-            "ja",
-            "jw",
-            "ka",
-            "kk",
-            "km",
-            "kn",
-            "ko",
-            "la",
-            "lb",
-            "ln",
-            "lo",
-            "lt",
-            "lv",
-            "mg",
-            "mi",
-            "mk",
-            "ml",
-            "mn",
-            "mr",
-            "ms",
-            "mt",
-            "my",
-            "ne",
-            "nl",
-            "nn",
-            "no",
-            "oc",
-            "pa",
-            "pl",
-            "ps",
-            "pt",
-            "ro",
-            "ru",
-            "sa",
-            "sd",
-            "si",
-            "sk",
-            "sl",
-            "sn",
-            "so",
-            "sq",
-            "sr",
-            "su",
-            "sv",
-            "sw",
-            "ta",
-            "te",
-            "tg",
-            "th",
-            "tk",
-            "tl",
-            "tr",
-            "tt",
-            "uk",
-            "ur",
-            "uz",
-            "vi",
-            "yi",
-            "yo",
-            "zh",
-            "yue",
-        ]
+        if self.is_english_only():
+            return ["eng"]
 
-        iso_639_3 = []
-        for language in languages:
-            pt3 = self._get_iso_639_3(language)
-            iso_639_3.append(pt3)
-        return iso_639_3
+        return list(_LANGUAGES_ISO_639_3)
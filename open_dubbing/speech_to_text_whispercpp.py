@@ -0,0 +1,91 @@
+# Copyright 2024 Jordi Mas i Hernàndez <jmas@softcatala.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+
+import numpy as np
+
+try:
+    from pywhispercpp.constants import AVAILABLE_MODELS
+    from pywhispercpp.model import Model
+except ImportError:
+    AVAILABLE_MODELS = []
+    Model = None
+
+from open_dubbing.speech_to_text import SpeechToText
+
+
+class SpeechToTextWhisperCpp(SpeechToText):
+    """OpenAI Whisper running on whisper.cpp, only for CPU.
+
+    pywhispercpp is an optional dependency, see is_available.
+    """
+
+    def __init__(
+        self, *, model_name="medium", device="cpu", cpu_threads=0, quant="q8_0"
+    ):
+        super().__init__(device=device, model_name=model_name, cpu_threads=cpu_threads)
+        self.quant = quant
+
+    @staticmethod
+    def is_available() -> bool:
+        return Model is not None
+
+    def _get_ggml_model_name(self) -> str:
+        # The quantized GGML files are named like 'medium-q5_0'
+        if self.quant == "f16":
+            return self.model_name
+
+        return f"{self.model_name}-{self.quant}"
+
+    def is_model_available(self) -> bool:
+        # whisper.cpp does not publish every quantization of every model
+        return self._get_ggml_model_name() in AVAILABLE_MODELS
+
+    def _get_params(self) -> dict:
+        params = {"print_progress": False, "print_realtime": False}
+        if self.cpu_threads > 0:
+            params["n_threads"] = self.cpu_threads
+        return params
+
+    def load_model(self):
+        self._model = Model(self._get_ggml_model_name(), **self._get_params())
+
+    def get_languages(self):
+        iso_639_3 = []
+        for language in Model.available_languages():
+            pt3 = self._get_iso_639_3(language)
+            iso_639_3.append(pt3)
+        return iso_639_3
+
+    def _transcribe(
+        self,
+        *,
+        vocals_filepath: str,
+        source_language_iso_639_1: str,
+    ) -> str:
+        # pywhispercpp decodes files with pydub and several extra copies of
+        # the samples
+        segments = self.model.transcribe(
+            self._load_audio(vocals_filepath), language=source_language_iso_639_1
+        )
+        return " ".join(segment.text for segment in segments)
+
+    def _get_audio_language(self, audio: np.ndarray) -> str:
+        (language, _), _ = self.model.auto_detect_language(audio)
+        detected_language = self._get_iso_639_3(language)
+        logging.debug(
+            f"speech_to_text_whispercpp._get_audio_language. Detected language: {detected_language}"
+        )
+        return detected_language
@@ -12,19 +12,27 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import bisect
 import logging
 import os
-import platform
-import shutil
-import tempfile
+import subprocess
 
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from typing import Final, List, Mapping, NamedTuple, Sequence
 
+import soundfile
+
 from pydub import AudioSegment
-from pydub.effects import speedup
 
-_DEFAULT_CHUNK_SIZE: Final[int] = 150
+# Largest tempo change of a single ffmpeg atempo filter in all its versions
+_MAX_ATEMPO: Final[float] = 2.0
+# Speed-ups smaller than this are not noticeable and do not pay for
+# synthesizing or encoding the audio again
+_MIN_SPEED_CHANGE: Final[float] = 0.02
+# The utterances are dubbed by threads that mostly wait for the TTS engines,
+# ffmpeg or the network
+_MAX_WORKERS: Final[int] = 8
 
 
 class Voice(NamedTuple):
@@ -35,12 +43,16 @@ class Voice(NamedTuple):
 
 class TextToSpeech(ABC):
 
-    def __init__(self):
+    def __init__(self, max_workers: int | None = None):
+        self.max_workers = max_workers or self._get_default_max_workers()
         self._SSML_MALE: Final[str] = "Male"
         self._SSML_FEMALE: Final[str] = "Female"
         self._DEFAULT_SPEED: Final[float] = 1.0
         self._DEFAULT_VOLUME_GAIN_DB: Final[float] = 16.0
 
+    def _get_default_max_workers(self) -> int:
+        return min(_MAX_WORKERS, os.cpu_count() or 1)
+
     @abstractmethod
     def get_available_voices(self, language_code: str) -> List[Voice]:
         pass
@@ -77,25 +89,53 @@ class TextToSpeech(ABC):
         if len(voices) == 0:
             voice_assignment["speaker_01"] = "ona"
         else:
+            # The first voice of each gender, in order of preference
+            voice_by_gender = {}
+            for voice in voices:
+                voice_by_gender.setdefault(voice.gender, voice.name)
+
             for chunk in utterance_metadata:
                 speaker_id = chunk["speaker_id"]
                 if speaker_id in voice_assignment:
                     continue
 
-                gender = chunk["ssml_gender"]
-                for voice in voices:
-                    if voice.gender == gender:
-                        voice_assignment[speaker_id] = voice.name
-                        break
+                voice_name = voice_by_gender.get(chunk["ssml_gender"])
+                if voice_name is not None:
+                    voice_assignment[speaker_id] = voice_name
 
         logging.debug(f"text_to_speech.assign_voices. Returns: {voice_assignment}")
         return voice_assignment
 
+    def _run_ffmpeg(self, arguments):
+        # An argument list runs ffmpeg without a shell, file names with spaces
+        # or quotes do not need escaping. Several utterances are dubbed in
+        # parallel, ffmpeg must not read the terminal.
+        command = ["ffmpeg", "-y", "-nostdin"] + arguments
+        logging.debug(" ".join(command))
+        subprocess.run(
+            command,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        )
+
+    @staticmethod
+    def _get_duration(path: str) -> float:
+        """Returns the duration in seconds of an audio file.
+
+        When libsndfile can read the format only the headers are read,
+        otherwise the file is decoded.
+        """
+        try:
+            return soundfile.info(path).duration
+        except RuntimeError as e:
+            # MP3 needs libsndfile 1.1 or newer
+            logging.debug(f"text_to_speech._get_duration. Decoding '{path}': {e}")
+            return AudioSegment.from_file(path).duration_seconds
+
     def _convert_to_mp3(self, input_file, output_mp3):
-        null_device = "NUL" if platform.system().lower() == "windows" else "/dev/null"
-        cmd = f"ffmpeg -y -i {input_file} {output_mp3} > {null_device} 2>&1"
-        logging.debug(cmd)
-        os.system(cmd)
+        self._run_ffmpeg(["-i", input_file, output_mp3])
         os.remove(input_file)
 
     def _add_text_to_speech_properties(
@@ -160,28 +200,31 @@ class TextToSpeech(ABC):
             volume_gain_db=volume_gain_db,
         )
 
-        dubbed_audio = AudioSegment.from_file(dubbed_file)
-        pre_duration = len(dubbed_audio)
+        debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+        if debug:
+            pre_duration = self._get_duration(dubbed_file)
+
+        # ffmpeg cannot write over its input, the output is written next to
+        # it and moved over the original file
+        base, extension = os.path.splitext(dubbed_file)
+        trimmed_file = f"{base}_trimmed{extension}"
+        self._run_ffmpeg(
+            [
+                "-i",
+                dubbed_file,
+                "-af",
+                "silenceremove=stop_periods=-1:stop_duration=0.1:stop_threshold=-50dB",
+                trimmed_file,
+            ]
+        )
+        os.replace(trimmed_file, dubbed_file)
 
-        filename = ""
-        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-            shutil.copyfile(dubbed_file, temp_file.name)
-            null_device = (
-                "NUL" if platform.system().lower() == "windows" else "/dev/null"
-            )
-            cmd = f"ffmpeg -y -i {temp_file.name} -af silenceremove=stop_periods=-1:stop_duration=0.1:stop_threshold=-50dB {dubbed_file} > {null_device} 2>&1"
-            os.system(cmd)
-            filename = temp_file.name
-
-        if os.path.exists(filename):
-            os.remove(filename)
-
-        dubbed_audio = AudioSegment.from_file(dubbed_file)
-        post_duration = len(dubbed_audio)
-        if pre_duration != post_duration:
-            logging.debug(
-                f"text_to_speech._convert_text_to_speech_without_end_silence. File {dubbed_file} shorten from {pre_duration} to {post_duration}"
-            )
+        if debug:
+            post_duration = self._get_duration(dubbed_file)
+            if pre_duration != post_duration:
+                logging.debug(
+                    f"text_to_speech._convert_text_to_speech_without_end_silence. File {dubbed_file} shorten from {pre_duration} to {post_duration}"
+                )
 
         return dubbed_file
 
@@ -207,8 +250,7 @@ class TextToSpeech(ABC):
     ) -> float:
         """Returns the ratio between the reference and target duration."""
 
-        dubbed_audio = AudioSegment.from_file(dubbed_file)
-        dubbed_duration = dubbed_audio.duration_seconds
+        dubbed_duration = self._get_duration(dubbed_file)
         r = dubbed_duration / reference_length
         logging.debug(f"text_to_speech._calculate_target_utterance_speed: {r}")
         return r
@@ -225,19 +267,27 @@ class TextToSpeech(ABC):
 
         speaker_to_paths_mapping = {}
         for utterance in utterance_metadata:
-            speaker_id = utterance["speaker_id"]
-            if speaker_id not in speaker_to_paths_mapping:
-                speaker_to_paths_mapping[speaker_id] = []
-            speaker_to_paths_mapping[speaker_id].append(utterance["vocals_path"])
+            speaker_to_paths_mapping.setdefault(utterance["speaker_id"], []).append(
+                utterance["vocals_path"]
+            )
         return speaker_to_paths_mapping
 
+    @staticmethod
+    def _get_atempo_filter(speed: float) -> str:
+        """Returns the ffmpeg atempo filter, chained for speeds over 2x."""
+        filters = []
+        while speed > _MAX_ATEMPO:
+            filters.append(f"atempo={_MAX_ATEMPO}")
+            speed /= _MAX_ATEMPO
+        filters.append(f"atempo={speed:.4f}")
+        return ",".join(filters)
+
     def _adjust_audio_speed(
         self,
         *,
         reference_length: float,
         dubbed_file: str,
         speed: float,
-        chunk_size: int = _DEFAULT_CHUNK_SIZE,
     ) -> None:
         """Adjusts the speed of an MP3 file to match the reference file duration.
 
@@ -245,20 +295,20 @@ class TextToSpeech(ABC):
         is the same or shorter than the duration of the reference file.
         """
 
-        dubbed_audio = AudioSegment.from_file(dubbed_file)
         logging.info(
             "Adjusting audio speed will prevent overlaps of utterances. However,"
             " it might change the voice sligthly."
         )
-        crossfade = max(1, chunk_size // 2)
-
+        atempo = self._get_atempo_filter(speed)
         logging.debug(
-            f"text_to_speech.adjust_audio_speed: dubbed_audio: {dubbed_file}, speed: {speed}, chunk_size: {chunk_size}, crossfade: {crossfade}"
-        )
-        output_audio = speedup(
-            dubbed_audio, speed, chunk_size=chunk_size, crossfade=crossfade
+            f"text_to_speech.adjust_audio_speed: dubbed_audio: {dubbed_file}, speed: {speed}, filter: {atempo}"
         )
-        output_audio.export(dubbed_file, format="mp3")
+        # ffmpeg changes the tempo in a single pass, the file is replaced
+        # once it has been written
+        base, extension = os.path.splitext(dubbed_file)
+        output_file = f"{base}_atempo{extension}"
+        self._run_ffmpeg(["-i", dubbed_file, "-filter:a", atempo, output_file])
+        os.replace(output_file, dubbed_file)
 
     def _does_voice_supports_speeds(self):
         return False
@@ -290,16 +340,12 @@ class TextToSpeech(ABC):
     def _do_need_to_increase_speed(
         self,
         *,
-        utterance_metadata: Sequence[Mapping[str, str | float]],
+        next_start: float | None,
         dubbed_path: str,
         start: float,
     ) -> bool:
 
-        next_start = self.get_start_time_of_next_speech_utterance(
-            utterance_metadata=utterance_metadata, from_time=start
-        )
-        dubbed_audio = AudioSegment.from_file(dubbed_path)
-        dubbed_duration = dubbed_audio.duration_seconds
+        dubbed_duration = self._get_duration(dubbed_path)
         end = dubbed_duration + start
         logging.debug(
             f"_do_need_to_increase_speed. start: {start}, next_start: {next_start} < end: {end}, duration: {dubbed_duration}"
@@ -317,106 +363,143 @@ class TextToSpeech(ABC):
         target_language: str,
         adjust_speed: bool = True,
     ) -> Sequence[Mapping[str, str | float]]:
-        """Processes a list of utterance metadata, generating dubbed audio files."""
+        """Processes a list of utterance metadata, generating dubbed audio files.
 
-        logging.debug(f"TextToSpeech.dub_utterances: adjust_speed: {adjust_speed}")
-        updated_utterance_metadata = []
-        for utterance in utterance_metadata:
-            utterance_copy = utterance.copy()
-            if not utterance_copy["for_dubbing"]:
-                try:
-                    dubbed_path = utterance_copy["path"]
-                except KeyError:
-                    dubbed_path = f"chunk_{utterance['start']}_{utterance['end']}.mp3"
-            else:
-                assigned_voice = utterance_copy["assigned_voice"]
-                reference_length = utterance_copy["end"] - utterance_copy["start"]
-                text = utterance_copy["translated_text"]
-                try:
-                    path = utterance_copy["path"]
-                    base_filename = os.path.splitext(os.path.basename(path))[0]
-                    output_filename = os.path.join(
-                        output_directory, f"dubbed_{base_filename}.mp3"
-                    )
-                except KeyError:
-                    output_filename = os.path.join(
-                        output_directory,
-                        f"dubbed_chunk_{utterance['start']}_{utterance['end']}.mp3",
-                    )
+        The utterances are independent, they are dubbed in parallel by up to
+        max_workers threads and returned in the same order.
+        """
+
+        logging.debug(
+            f"TextToSpeech.dub_utterances: adjust_speed: {adjust_speed}, max_workers: {self.max_workers}"
+        )
+
+        # The start of the next utterance to dub is found with a binary search,
+        # instead of scanning all the utterances for each one
+        speech_starts = sorted(
+            utterance["start"]
+            for utterance in utterance_metadata
+            if utterance["for_dubbing"]
+        )
+
+        def dub_utterance(utterance):
+            index = bisect.bisect_right(speech_starts, utterance["start"])
+            return self._dub_utterance(
+                utterance=utterance,
+                next_start=(
+                    speech_starts[index] if index < len(speech_starts) else None
+                ),
+                output_directory=output_directory,
+                target_language=target_language,
+            )
 
-                speed = utterance_copy["speed"]
-                dubbed_path = self._convert_text_to_speech_without_end_silence(
-                    assigned_voice=assigned_voice,
-                    target_language=target_language,
-                    output_filename=output_filename,
-                    text=text,
-                    pitch=utterance_copy["pitch"],
-                    speed=speed,
-                    volume_gain_db=utterance_copy["volume_gain_db"],
+        if self.max_workers <= 1:
+            return [dub_utterance(utterance) for utterance in utterance_metadata]
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(dub_utterance, utterance_metadata))
+
+    def _dub_utterance(
+        self,
+        *,
+        utterance: Mapping[str, str | float],
+        next_start: float | None,
+        output_directory: str,
+        target_language: str,
+    ) -> Mapping[str, str | float]:
+        """Generates the dubbed audio file of an utterance.
+
+        next_start is the start of the next utterance to dub, None if it is
+        the last one.
+        """
+        utterance_copy = utterance.copy()
+        start = utterance_copy["start"]
+        end = utterance_copy["end"]
+        path = utterance_copy.get("path")
+        if not utterance_copy["for_dubbing"]:
+            dubbed_path = path if path is not None else f"chunk_{start}_{end}.mp3"
+        else:
+            assigned_voice = utterance_copy["assigned_voice"]
+            reference_length = end - start
+            text = utterance_copy["translated_text"]
+            pitch = utterance_copy["pitch"]
+            volume_gain_db = utterance_copy["volume_gain_db"]
+            if path is not None:
+                base_filename = os.path.splitext(os.path.basename(path))[0]
+                output_filename = os.path.join(
+                    output_directory, f"dubbed_{base_filename}.mp3"
                 )
-                assigned_voice = utterance_copy.get("assigned_voice", None)
-                assigned_voice = assigned_voice if assigned_voice else ""
-                support_speeds = self._does_voice_supports_speeds()
-                speed = self._calculate_target_utterance_speed(
-                    reference_length=reference_length, dubbed_file=dubbed_path
+            else:
+                output_filename = os.path.join(
+                    output_directory, f"dubbed_chunk_{start}_{end}.mp3"
                 )
-                logging.debug(f"support_speeds: {support_speeds}, speed: {speed}")
 
-                if speed > 1.0:
-                    increase_speed = self._do_need_to_increase_speed(
-                        utterance_metadata=utterance_metadata,
-                        dubbed_path=dubbed_path,
-                        start=utterance_copy["start"],
-                    )
-                    translated_text = utterance_copy["translated_text"]
-                    if not increase_speed:
-                        logging.debug(
-                            f"text_to_speech.dub_utterances. No need to increase speed for '{translated_text}'"
-                        )
-                    else:
-                        logging.debug(
-                            f"text_to_speech.dub_utterances. Need to increase speed for '{translated_text}'"
-                        )
+            dubbed_path = self._convert_text_to_speech_without_end_silence(
+                assigned_voice=assigned_voice,
+                target_language=target_language,
+                output_filename=output_filename,
+                text=text,
+                pitch=pitch,
+                speed=utterance_copy["speed"],
+                volume_gain_db=volume_gain_db,
+            )
+            assigned_voice = assigned_voice if assigned_voice else ""
+            support_speeds = self._does_voice_supports_speeds()
+            speed = self._calculate_target_utterance_speed(
+                reference_length=reference_length, dubbed_file=dubbed_path
+            )
+            logging.debug(f"support_speeds: {support_speeds}, speed: {speed}")
 
+            if speed > 1.0 + _MIN_SPEED_CHANGE:
+                increase_speed = self._do_need_to_increase_speed(
+                    next_start=next_start,
+                    dubbed_path=dubbed_path,
+                    start=start,
+                )
+                if not increase_speed:
+                    logging.debug(
+                        f"text_to_speech.dub_utterances. No need to increase speed for '{text}'"
+                    )
                 else:
-                    increase_speed = False
+                    logging.debug(
+                        f"text_to_speech.dub_utterances. Need to increase speed for '{text}'"
+                    )
 
-                if increase_speed and speed > 1.0:
-                    MAX_SPEED = 1.3
-                    if speed > MAX_SPEED:
-                        logging.debug(
-                            f"text_to_speech.dub_utterances: Reduced speed from {speed} to {MAX_SPEED}"
-                        )
-                        speed = MAX_SPEED
+            else:
+                if speed > 1.0:
+                    logging.debug(
+                        f"text_to_speech.dub_utterances. Speed {speed} close to 1.0, not adjusted for '{text}'"
+                    )
+                increase_speed = False
 
-                    translated_text = utterance_copy["translated_text"]
+            if increase_speed and speed > 1.0:
+                MAX_SPEED = 1.3
+                if speed > MAX_SPEED:
                     logging.debug(
-                        f"text_to_speech.dub_utterances: Adjusting speed to {speed} for '{translated_text}'"
+                        f"text_to_speech.dub_utterances: Reduced speed from {speed} to {MAX_SPEED}"
                     )
+                    speed = MAX_SPEED
 
-                    utterance_copy["speed"] = speed
-                    if support_speeds:
-                        dubbed_path = self._convert_text_to_speech_without_end_silence(
-                            assigned_voice=assigned_voice,
-                            target_language=target_language,
-                            output_filename=output_filename,
-                            text=text,
-                            pitch=utterance_copy["pitch"],
-                            speed=speed,
-                            volume_gain_db=utterance_copy["volume_gain_db"],
-                        )
-                    else:
-                        chunk_size = utterance_copy.get(
-                            "chunk_size", _DEFAULT_CHUNK_SIZE
-                        )
-                        self._adjust_audio_speed(
-                            reference_length=reference_length,
-                            dubbed_file=dubbed_path,
-                            speed=speed,
-                            chunk_size=chunk_size,
-                        )
-                        utterance_copy["chunk_size"] = chunk_size
-
-            utterance_copy["dubbed_path"] = dubbed_path
-            updated_utterance_metadata.append(utterance_copy)
-        return updated_utterance_metadata
+                logging.debug(
+                    f"text_to_speech.dub_utterances: Adjusting speed to {speed} for '{text}'"
+                )
+
+                utterance_copy["speed"] = speed
+                if support_speeds:
+                    dubbed_path = self._convert_text_to_speech_without_end_silence(
+                        assigned_voice=assigned_voice,
+                        target_language=target_language,
+                        output_filename=output_filename,
+                        text=text,
+                        pitch=pitch,
+                        speed=speed,
+                        volume_gain_db=volume_gain_db,
+                    )
+                else:
+                    self._adjust_audio_speed(
+                        reference_length=reference_length,
+                        dubbed_file=dubbed_path,
+                        speed=speed,
+                    )
+
+        utterance_copy["dubbed_path"] = dubbed_path
+        return utterance_copy
@@ -24,9 +24,13 @@ from open_dubbing.text_to_speech import TextToSpeech, Voice
 
 class TextToSpeechCoqui(TextToSpeech):
 
-    def __init__(self, device="cpu"):
-        super().__init__()
-        self.coqui = Coqui(device)
+    def __init__(self, device="cpu", compile=False, max_workers=None):
+        super().__init__(max_workers=max_workers)
+        self.coqui = Coqui(device, compile=compile)
+
+    def _get_default_max_workers(self) -> int:
+        # The model already uses all the cores or the GPU
+        return 1
 
     def get_languages(self):
         languages = []
@@ -16,7 +16,7 @@ import asyncio
 import logging
 import re
 
-from typing import List
+from typing import Final, List
 
 import edge_tts
 
@@ -25,6 +25,10 @@ from iso639 import Lang
 
 from open_dubbing.text_to_speech import TextToSpeech, Voice
 
+# Requests to the service in flight at the same time, each dubbing thread
+# waits for its own request
+_MAX_CONCURRENT_REQUESTS: Final[int] = 16
+
 
 class TextToSpeechEdge(TextToSpeech):
 
@@ -32,11 +36,25 @@ class TextToSpeechEdge(TextToSpeech):
         voice_manager = await VoicesManager.create()
         return voice_manager
 
-    def __init__(self, device="cpu"):
-        super().__init__()
+    def __init__(self, device="cpu", max_workers=None):
+        super().__init__(max_workers=max_workers)
         self.device = device
+        self._voices_cache = {}
+
+    def _get_default_max_workers(self) -> int:
+        # The threads mostly wait for the network, their number does not
+        # depend on the cores
+        return _MAX_CONCURRENT_REQUESTS
 
     def get_available_voices(self, language_code: str) -> List[Voice]:
+        # Listing the voices is a request to the service
+        if language_code not in self._voices_cache:
+            self._voices_cache[language_code] = self._get_available_voices(
+                language_code
+            )
+        return self._voices_cache[language_code]
+
+    def _get_available_voices(self, language_code: str) -> List[Voice]:
         voices = []
         iso_639_1 = self._get_iso_639_1(language_code)
 
@@ -27,11 +27,15 @@ from open_dubbing.text_to_speech import TextToSpeech, Voice
 
 class TextToSpeechMMS(TextToSpeech):
 
-    def __init__(self, device="cpu"):
-        super().__init__()
+    def __init__(self, device="cpu", max_workers=None):
+        super().__init__(max_workers=max_workers)
         self.device = device
         logging.getLogger("transformers").setLevel(logging.ERROR)
 
+    def _get_default_max_workers(self) -> int:
+        # The model already uses all the cores or the GPU
+        return 1
+
     def get_available_voices(self, language_code: str) -> List[Voice]:
         return []
 
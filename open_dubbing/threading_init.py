@@ -0,0 +1,64 @@
+# Copyright 2024 Jordi Mas i Hernàndez <jmas@softcatala.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import os
+
+
+def _get_default_threads() -> int:
+    # os.cpu_count returns logical cores, half of them is a good estimation
+    # of the physical cores when hyper-threading is enabled
+    return max(1, (os.cpu_count() or 1) // 2)
+
+
+def init(cpu_threads: int = 0) -> int:
+    """Sets the number of threads used by torch and the OpenMP / MKL runtimes.
+
+    Must be called before loading any model. Environment variables already
+    defined by the user are respected. It also selects the quantized engine
+    for the CPU and allows TF32 matrix multiplications and convolutions on
+    the GPUs that support them.
+
+    Args:
+        cpu_threads: The number of threads to use, 0 to select the number of
+          physical cores.
+
+    Returns:
+        The number of threads used.
+    """
+    threads = cpu_threads if cpu_threads > 0 else _get_default_threads()
+    os.environ.setdefault("OMP_NUM_THREADS", str(threads))
+    os.environ.setdefault("MKL_NUM_THREADS", str(threads))
+    os.environ.setdefault("OPENBLAS_NUM_THREADS", str(threads))
+
+    # Imported after setting the environment variables, that the OpenMP and
+    # MKL runtimes read when torch loads them
+    import torch
+
+    from open_dubbing import quantization
+
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(max(1, threads // 2))
+    except RuntimeError as e:
+        # Can only be set once and before any inter-op parallel work has started
+        logging.debug(f"threading_init.init. Cannot set interop threads: {e}")
+
+    engine = quantization.select_engine()
+    torch.set_float32_matmul_precision("high")
+    torch.backends.cudnn.allow_tf32 = True
+    logging.debug(
+        f"threading_init.init. Using {threads} threads and '{engine}' quantized engine"
+    )
+    return threads
@@ -52,6 +52,19 @@ class Translation(ABC):
     ) -> str:
         pass
 
+    def _translate_texts(
+        self, *, source_language: str, target_language: str, texts: Sequence[str]
+    ) -> Sequence[str]:
+        """Translates several texts, implementations can override it to translate them as a batch."""
+        return [
+            self._translate_text(
+                source_language=source_language,
+                target_language=target_language,
+                text=text,
+            )
+            for text in texts
+        ]
+
     def translate_utterances(
         self,
         *,
@@ -94,18 +107,15 @@ class Translation(ABC):
         # Split the input string by the <BREAK> delimiter
         parts = script.split(_BREAK_MARKER)
 
-        translated_parts = []
-        for text in parts:
-            if len(text.strip()) == 0:
-                translation = ""
-            else:
-                translation = self._translate_text(
-                    source_language=source_language,
-                    target_language=target_language,
-                    text=text,
-                )
-
-            translated_parts.append(translation)
+        indexes = [i for i, text in enumerate(parts) if len(text.strip()) > 0]
+        translations = self._translate_texts(
+            source_language=source_language,
+            target_language=target_language,
+            texts=[parts[i] for i in indexes],
+        )
+        translated_parts = [""] * len(parts)
+        for i, translation in zip(indexes, translations):
+            translated_parts[i] = translation
 
         translation = _BREAK_MARKER.join(translated_parts)
         logging.debug(f"translation.translate_script. Translation: {translation}")
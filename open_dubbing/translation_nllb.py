@@ -14,19 +14,35 @@
 
 import logging
 
+import torch
+
 from transformers import AutoModelForSeq2SeqLM, AutoTokenizer, pipeline
 
+from open_dubbing import quantization
 from open_dubbing.translation import Translation
 
+_DEFAULT_MODEL = "nllb-200-1.3B"
+_TORCH_DTYPES = {
+    "fp32": torch.float32,
+    "fp16": torch.float16,
+    "bf16": torch.bfloat16,
+}
+
 
 class TranslationNLLB(Translation):
 
-    def __init__(self, device="cpu"):
+    def __init__(self, device="cpu", precision=None, compile=False):
         super().__init__(device)
+        self.precision = precision or quantization.get_default_precision(device)
+        self.compile = compile and device.startswith("cuda")
+        # All the NLLB-200 models share the tokenizer, the supported languages
+        # can be listed before loading the model
+        self.model_name = f"facebook/{_DEFAULT_MODEL}"
         self.translator = None
         self.translator_languages = ""
+        self._model = None
 
-    def load_model(self, name="nllb-200-1.3B"):
+    def load_model(self, name=_DEFAULT_MODEL):
         self.model_name = f"facebook/{name}"
         self.tokenizer = self._get_tokenizer_nllb()
 
@@ -35,10 +51,13 @@ class TranslationNLLB(Translation):
     ) -> str:
         languages = f"{source_language}{target_language}"
         if not self.translator or self.translator_languages != languages:
-            model = self._get_model_nllb()
+            # The model is loaded once, changing the languages only needs
+            # a new pipeline
+            if self._model is None:
+                self._model = self._get_model_nllb()
             self.translator = pipeline(
                 "translation",
-                model=model,
+                model=self._model,
                 tokenizer=self.tokenizer,
                 src_lang=self._get_nllb_language(source_language),
                 tgt_lang=self._get_nllb_language(target_language),
@@ -52,17 +71,42 @@ class TranslationNLLB(Translation):
     def _get_tokenizer_nllb(self):
         return AutoTokenizer.from_pretrained(self.model_name)
 
+    def _load_model_nllb(self, device):
+        # INT8 is only supported on CPU and half precision only on GPU
+        on_cpu = device == "cpu"
+        if self.precision == "int8" or (on_cpu and self.precision != "fp32"):
+            torch_dtype = torch.float32
+        else:
+            torch_dtype = _TORCH_DTYPES[self.precision]
+
+        model = AutoModelForSeq2SeqLM.from_pretrained(
+            self.model_name, torch_dtype=torch_dtype
+        )
+        if on_cpu and self.precision == "int8":
+            return quantization.quantize_dynamic(model, {torch.nn.Linear})
+
+        model = model.to(device)
+        if self.compile and device.startswith("cuda"):
+            self._compile(model, device)
+        return model
+
+    def _compile(self, model, device):
+        model.forward = torch.compile(model.forward, dynamic=True)
+
+        # Pay the compilation cost once when the model is loaded
+        inputs = self.tokenizer("Warmup.", return_tensors="pt").to(device)
+        with torch.no_grad():
+            model.generate(**inputs, max_new_tokens=4)
+
     def _get_model_nllb(self):
         try:
-            return AutoModelForSeq2SeqLM.from_pretrained(self.model_name).to(
-                self.device
-            )
+            return self._load_model_nllb(self.device)
         except RuntimeError as e:
-            if self.device == "cuda":
-                return AutoModelForSeq2SeqLM.from_pretrained(self.model_name).to("cpu")
+            if self.device.startswith("cuda"):
                 logging.warning(
                     f"Loading translation model {self.model_name} in CPU since cannot be load in GPU"
                 )
+                return self._load_model_nllb("cpu")
             else:
                 raise e
 
@@ -0,0 +1,113 @@
+# Copyright 2024 Jordi Mas i Hernàndez <jmas@softcatala.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import os
+import shutil
+
+from typing import Final, Sequence
+
+import ctranslate2
+
+from open_dubbing.translation_nllb import _DEFAULT_MODEL, TranslationNLLB
+
+_MODELS_DIRECTORY: Final[str] = os.path.join(
+    os.path.expanduser("~"), ".cache", "open_dubbing", "ctranslate2"
+)
+_MAX_BATCH_SIZE: Final[int] = 16
+
+
+class TranslationNLLBCT2(TranslationNLLB):
+    """Meta's NLLB running on CTranslate2.
+
+    The Hugging Face model is converted to the CTranslate2 format the first
+    time it is used.
+    """
+
+    def __init__(self, device="cpu", precision=None):
+        super().__init__(device, precision=precision)
+        self._translator = None
+
+    def _get_compute_type(self) -> str:
+        on_cuda = self.device.startswith("cuda")
+        if self.precision == "int8":
+            return "int8_float16" if on_cuda else "int8"
+
+        if not on_cuda:
+            return "float32"
+
+        return {"fp16": "float16", "bf16": "bfloat16"}.get(self.precision, "float32")
+
+    def _get_converted_model(self) -> str:
+        model_path = os.path.join(_MODELS_DIRECTORY, self.model_name)
+        if os.path.exists(model_path):
+            return model_path
+
+        logging.info(
+            f"Converting translation model {self.model_name} to CTranslate2 format"
+        )
+        # Converted in a temporary directory, an interrupted conversion does
+        # not leave an incomplete model behind
+        temporary_path = model_path + ".tmp"
+        shutil.rmtree(temporary_path, ignore_errors=True)
+        converter = ctranslate2.converters.TransformersConverter(self.model_name)
+        converter.convert(temporary_path, quantization="float16")
+        os.replace(temporary_path, model_path)
+        return model_path
+
+    def load_model(self, name=_DEFAULT_MODEL):
+        super().load_model(name)
+        device, _, device_index = self.device.partition(":")
+        self._translator = ctranslate2.Translator(
+            self._get_converted_model(),
+            device=device,
+            device_index=int(device_index or 0),
+            compute_type=self._get_compute_type(),
+        )
+
+    def _translate_texts(
+        self, *, source_language: str, target_language: str, texts: Sequence[str]
+    ) -> Sequence[str]:
+        self.tokenizer.src_lang = self._get_nllb_language(source_language)
+        target_prefix = [self._get_nllb_language(target_language)]
+        sources = [
+            self.tokenizer.convert_ids_to_tokens(self.tokenizer.encode(text))
+            for text in texts
+        ]
+        results = self._translator.translate_batch(
+            sources,
+            target_prefix=[target_prefix] * len(sources),
+            max_batch_size=_MAX_BATCH_SIZE,
+            max_decoding_length=1024,
+        )
+        translations = []
+        for result in results:
+            # The first token is the target language
+            tokens = result.hypotheses[0][1:]
+            translations.append(
+                self.tokenizer.decode(
+                    self.tokenizer.convert_tokens_to_ids(tokens),
+                    skip_special_tokens=True,
+                )
+            )
+        return translations
+
+    def _translate_text(
+        self, source_language: str, target_language: str, text: str
+    ) -> str:
+        return self._translate_texts(
+            source_language=source_language,
+            target_language=target_language,
+            texts=[text],
+        )[0]
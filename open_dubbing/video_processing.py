@@ -12,7 +12,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
+import logging
 import os
+import shutil
 import subprocess
 
 from typing import Final
@@ -27,22 +30,74 @@ _DEFAULT_OUTPUT_FORMAT: Final[str] = ".mp4"
 class VideoProcessing:
 
     @staticmethod
-    def split_audio_video(*, video_file: str, output_directory: str) -> tuple[str, str]:
-        """Splits an audio/video file into separate audio and video files."""
+    def _split_audio_video_with_ffmpeg(
+        *, video_file: str, audio_output_file: str, video_output_file: str
+    ) -> None:
+        # The video stream is copied without re-encoding, it is encoded once
+        # when the dubbed audio is added
+        command = [
+            "ffmpeg",
+            "-y",
+            "-loglevel",
+            "error",
+            "-i",
+            video_file,
+            "-map",
+            "0:a:0",
+            "-ar",
+            "44100",
+            "-c:a",
+            "libmp3lame",
+            audio_output_file,
+            "-map",
+            "0:v:0",
+            "-c:v",
+            "copy",
+            video_output_file,
+        ]
+        subprocess.run(command, capture_output=True, check=True)
 
-        base_filename = os.path.basename(video_file)
-        filename, _ = os.path.splitext(base_filename)
+    @staticmethod
+    def _split_audio_video_with_moviepy(
+        *, video_file: str, audio_output_file: str, video_output_file: str
+    ) -> None:
         with VideoFileClip(video_file) as video_clip:
             audio_clip = video_clip.audio
-            audio_output_file = os.path.join(output_directory, filename + "_audio.mp3")
             audio_clip.write_audiofile(audio_output_file, verbose=False, logger=None)
             video_clip_without_audio = video_clip.set_audio(None)
             fps = video_clip.fps or _DEFAULT_FPS
-
-            video_output_file = os.path.join(output_directory, filename + "_video.mp4")
             video_clip_without_audio.write_videofile(
                 video_output_file, codec="libx264", fps=fps, verbose=False, logger=None
             )
+
+    @staticmethod
+    def split_audio_video(*, video_file: str, output_directory: str) -> tuple[str, str]:
+        """Splits an audio/video file into separate audio and video files.
+
+        The video file keeps the container of the input file.
+        """
+
+        base_filename = os.path.basename(video_file)
+        filename, extension = os.path.splitext(base_filename)
+        audio_output_file = os.path.join(output_directory, filename + "_audio.mp3")
+        video_output_file = os.path.join(
+            output_directory, filename + "_video" + extension.lower()
+        )
+        try:
+            VideoProcessing._split_audio_video_with_ffmpeg(
+                video_file=video_file,
+                audio_output_file=audio_output_file,
+                video_output_file=video_output_file,
+            )
+        except (subprocess.CalledProcessError, FileNotFoundError) as e:
+            logging.warning(
+                f"video_processing.split_audio_video. Cannot split with ffmpeg, using moviepy: {e}"
+            )
+            VideoProcessing._split_audio_video_with_moviepy(
+                video_file=video_file,
+                audio_output_file=audio_output_file,
+                video_output_file=video_output_file,
+            )
         return video_output_file, audio_output_file
 
     @staticmethod
@@ -89,7 +144,12 @@ class VideoProcessing:
         return dubbed_video_file
 
     @staticmethod
+    @functools.lru_cache(maxsize=1)
     def is_ffmpeg_installed():
+        # Looking up the PATH does not start a process
+        if shutil.which("ffmpeg") and shutil.which("ffprobe"):
+            return True
+
         cmd = ["ffprobe", "-version"]
         try:
             if (
@@ -27,6 +27,9 @@ from transformers.models.wav2vec2.modeling_wav2vec2 import (
     Wav2Vec2PreTrainedModel,
 )
 
+# Each audio is up to 10 seconds
+_BATCH_SIZE = 8
+
 
 class ModelHead(nn.Module):
 
@@ -66,11 +69,19 @@ class AgeGenderModel(Wav2Vec2PreTrainedModel):
     def forward(
         self,
         input_values,
+        attention_mask=None,
     ):
 
-        outputs = self.wav2vec2(input_values)
+        outputs = self.wav2vec2(input_values, attention_mask=attention_mask)
         hidden_states = outputs[0]
-        hidden_states = torch.mean(hidden_states, dim=1)
+        if attention_mask is None:
+            hidden_states = torch.mean(hidden_states, dim=1)
+        else:
+            # The padding of the shorter audios in a batch is not averaged
+            mask = self._get_feature_vector_attention_mask(
+                hidden_states.shape[1], attention_mask
+            ).unsqueeze(-1)
+            hidden_states = (hidden_states * mask).sum(dim=1) / mask.sum(dim=1)
         logits_age = self.age(hidden_states)
         logits_gender = torch.softmax(self.gender(hidden_states), dim=1)
 
@@ -87,12 +98,12 @@ class VoiceGenderClassifier:
         self.processor = Wav2Vec2Processor.from_pretrained(model_name)
         self.model = AgeGenderModel.from_pretrained(model_name)
 
-    # Function to load and process the MP3 file using pydub
+    # Function to load and process the audio file using pydub
     def load_audio_file(self, file_path, target_sampling_rate=16000):
         max_duration = 10  # Max duration in seconds
 
-        # Load the audio file using pydub
-        audio = AudioSegment.from_file(file_path, format="mp3")
+        # Load the audio file using pydub, chunks can be WAV or MP3
+        audio = AudioSegment.from_file(file_path)
 
         # If audio is longer than max_duration, trim it
         if len(audio) > max_duration * 1000:  # Convert seconds to milliseconds
@@ -156,6 +167,35 @@ class VoiceGenderClassifier:
 
         return gender_labels[predicted_gender_idx]
 
+    def get_genders_for_files(self, file_paths):
+        """Predicts the gender of several files, running them as a batch."""
+        gender_labels = ["Female", "Male"]
+        genders = []
+        for i in range(0, len(file_paths), _BATCH_SIZE):
+            batch_paths = file_paths[i : i + _BATCH_SIZE]
+            signals = [self.load_audio_file(path)[0][0] for path in batch_paths]
+            inputs = self.processor(
+                signals,
+                sampling_rate=16000,
+                padding=True,
+                return_attention_mask=True,
+                return_tensors="pt",
+            )
+            with torch.no_grad():
+                _, _, logits_gender = self.model(
+                    inputs["input_values"].to(self.device),
+                    attention_mask=inputs["attention_mask"].to(self.device),
+                )
+
+            # Only male and female, the first two logits, ignoring "child"
+            indexes = torch.argmax(logits_gender[:, :2], dim=1).tolist()
+            for path, index in zip(batch_paths, indexes):
+                logging.debug(
+                    f"The audio from {os.path.basename(path)} is predicted {gender_labels[index]}"
+                )
+                genders.append(gender_labels[index])
+        return genders
+
     def get_gender_for_file(self, file_path):
         signal, sampling_rate = self.load_audio_file(file_path)
 
@@ -41,6 +41,8 @@ setup(
     ],
     extras_require={
         "dev": ["flake8==7.*", "black==24.*", "pytest==8.*", "isort==5.13"],
+        "fast": ["orjson==3.*"],
+        "whisper-cpp": ["pywhispercpp==1.*"],
     },
     entry_points={
         "console_scripts": [
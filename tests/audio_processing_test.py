@@ -17,7 +17,7 @@
 import os
 import tempfile
 
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
 import numpy as np
 
@@ -46,7 +46,15 @@ class TestCreatePyannoteTimestamps:
                 audio_file=temporary_file.name,
                 pipeline=mock_pipeline,
             )
-            assert timestamps == [{"start": 0.0, "end": 10, "speaker_id": "SPEAKER_00"}]
+            assert timestamps == [
+                {
+                    "start": 0.0,
+                    "end": 10,
+                    "start_ms": 0,
+                    "end_ms": 10000,
+                    "speaker_id": "SPEAKER_00",
+                }
+            ]
 
 
 class TestCutAndSaveAudio:
@@ -63,9 +71,10 @@ class TestCutAndSaveAudio:
                 audio = AudioSegment.from_file(temporary_file.name)
                 audio_processing._cut_and_save_audio(
                     audio=audio,
-                    utterance=dict(start=0.1, end=0.2),
+                    utterance=dict(start=0.1, end=0.2, start_ms=100, end_ms=200),
                     prefix="chunk",
                     output_directory=output_directory,
+                    output_format="mp3",
                 )
                 expected_file = os.path.join(output_directory, "chunk_0.1_0.2.mp3")
                 assert os.path.exists(expected_file)
@@ -81,7 +90,9 @@ class TestRunCutAndSaveAudio:
                 fps=44100,
             )
             silence.write_audiofile(temporary_file.name)
-            utterance_metadata = [{"start": 0.0, "end": 5.0}]
+            utterance_metadata = [
+                {"start": 0.0, "end": 5.0, "start_ms": 0, "end_ms": 5000}
+            ]
             with tempfile.TemporaryDirectory() as output_directory:
                 # TODO: Add asert on results on this method
                 _ = audio_processing.run_cut_and_save_audio(
@@ -89,26 +100,47 @@ class TestRunCutAndSaveAudio:
                     audio_file=temporary_file.name,
                     output_directory=output_directory,
                 )
-                expected_file = os.path.join(output_directory, "chunk_0.0_5.0.mp3")
+                expected_file = os.path.join(output_directory, "chunk_0.0_5.0.wav")
                 _ = {
-                    "path": os.path.join(output_directory, "chunk_0.0_5.0.mp3"),
+                    "path": os.path.join(output_directory, "chunk_0.0_5.0.wav"),
                     "start": 0.0,
                     "end": 5.0,
                 }
                 assert os.path.exists(expected_file)
 
-
-class TestInsertAudioAtTimestamps:
-
-    def test_insert_audio_at_timestamps(self):
-        with tempfile.TemporaryDirectory() as temporary_directory:
-            background_audio_file = f"{temporary_directory}/test_background.mp3"
+    def test_run_cut_and_save_audio_without_ffmpeg(self):
+        with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as temporary_file:
             silence_duration = 10
             silence = AudioArrayClip(
                 np.zeros((int(44100 * silence_duration), 2), dtype=np.int16),
                 fps=44100,
             )
-            silence.write_audiofile(background_audio_file)
+            silence.write_audiofile(temporary_file.name)
+            utterance_metadata = [
+                {"start": 0.0, "end": 5.0, "start_ms": 0, "end_ms": 5000},
+                {"start": 5.0, "end": 7.5, "start_ms": 5000, "end_ms": 7500},
+            ]
+            with tempfile.TemporaryDirectory() as output_directory, patch(
+                "open_dubbing.audio_processing._cut_and_save_audio_with_ffmpeg",
+                side_effect=FileNotFoundError("ffmpeg"),
+            ):
+                result = audio_processing.run_cut_and_save_audio(
+                    utterance_metadata=utterance_metadata,
+                    audio_file=temporary_file.name,
+                    output_directory=output_directory,
+                )
+                assert [item["path"] for item in result] == [
+                    f"{output_directory}/chunk_0.0_5.0.wav",
+                    f"{output_directory}/chunk_5.0_7.5.wav",
+                ]
+                assert all(os.path.exists(item["path"]) for item in result)
+
+
+class TestInsertAudioAtTimestamps:
+
+    def test_insert_audio_at_timestamps(self):
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            background_audio = AudioSegment.silent(duration=10000, frame_rate=44100)
             audio_chunk_path = f"{temporary_directory}/test_chunk.mp3"
             chunk_duration = 2
             chunk = AudioArrayClip(
@@ -120,38 +152,31 @@ class TestInsertAudioAtTimestamps:
                 {
                     "start": 3.0,
                     "end": 5.0,
+                    "start_ms": 3000,
+                    "end_ms": 5000,
                     "dubbed_path": audio_chunk_path,
                 }
             ]
-            output_path = audio_processing.insert_audio_at_timestamps(
+            output_audio = audio_processing.insert_audio_at_timestamps(
                 utterance_metadata=utterance_metadata,
-                background_audio_file=background_audio_file,
+                background_audio=background_audio,
                 output_directory=temporary_directory,
             )
-            assert os.path.exists(output_path)
+            assert len(output_audio) == len(background_audio)
+            assert os.path.exists(f"{temporary_directory}/dubbed_vocals.mp3")
 
 
 class TestMixMusicAndVocals:
 
     def test_mix_music_and_vocals(self):
         with tempfile.TemporaryDirectory() as temporary_directory:
-            background_audio_path = f"{temporary_directory}/test_background.mp3"
-            vocals_audio_path = f"{temporary_directory}/test_vocals.mp3"
-            silence_duration = 10
-            silence_background = AudioArrayClip(
-                np.zeros((int(44100 * silence_duration), 2), dtype=np.int16),
-                fps=44100,
-            )
-            silence_background.write_audiofile(background_audio_path)
-            silence_duration = 5
-            silence_vocals = AudioArrayClip(
-                np.zeros((int(44100 * silence_duration), 2), dtype=np.int16),
-                fps=44100,
-            )
-            silence_vocals.write_audiofile(vocals_audio_path)
+            background_audio = AudioSegment.silent(
+                duration=10000, frame_rate=44100
+            ).set_channels(2)
+            vocals_audio = AudioSegment.silent(duration=5000, frame_rate=44100)
             output_audio_path = audio_processing.merge_background_and_vocals(
-                background_audio_file=background_audio_path,
-                dubbed_vocals_audio_file=vocals_audio_path,
+                background_audio=background_audio,
+                dubbed_vocals_audio=vocals_audio,
                 output_directory=temporary_directory,
                 target_language="en-US",
             )
@@ -53,3 +53,47 @@ class TestCommandLine:
         ), pytest.raises(SystemExit):
             CommandLine.read_parameters()
             assert False  # shoult not arrive here
+
+    def test_component_devices(self):
+        args = CommandLine.read_parameters(
+            [
+                "--input_file",
+                "video.mp4",
+                "--target_language",
+                "fra",
+                "--device",
+                "cuda",
+                "--tts_device",
+                "cuda:1",
+            ]
+        )
+
+        assert args.stt_device == "cuda"
+        assert args.translation_device == "cuda"
+        assert args.tts_device == "cuda:1"
+
+    def test_invalid_component_device(self):
+        with pytest.raises(SystemExit):
+            CommandLine.read_parameters(
+                [
+                    "--input_file",
+                    "video.mp4",
+                    "--target_language",
+                    "fra",
+                    "--stt_device",
+                    "gpu1",
+                ]
+            )
+
+    def test_input_file_list(self):
+        args = CommandLine.read_parameters(
+            [
+                "--input_file_list",
+                "videos.txt",
+                "--target_language",
+                "fra",
+            ]
+        )
+
+        assert args.input_file_list == "videos.txt"
+        assert args.input_file is None
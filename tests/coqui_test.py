@@ -0,0 +1,81 @@
+# Copyright 2024 Jordi Mas i Hernàndez <jmas@softcatala.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import tempfile
+
+from unittest.mock import patch
+
+from open_dubbing.coqui import Coqui, _read_speakers_from_config
+
+
+class TestCoqui:
+
+    def test_select_model_per_language(self):
+        language_models = {
+            "ca": ["tts_models/ca/custom/vits"],
+            "en": [
+                "tts_models/en/ljspeech/tacotron2-DDC",
+                "tts_models/en/ljspeech/glow-tts",
+                "tts_models/en/ljspeech/vits",
+            ],
+            "de": [
+                "tts_models/de/thorsten/tacotron2-DCA",
+                "tts_models/de/thorsten/glow-tts",
+            ],
+            "fr": [
+                "tts_models/fr/mai/tacotron2-DDC",
+                "tts_models/fr/css10/other",
+            ],
+        }
+        with patch.object(Coqui, "_build_list_language_model", return_value={}):
+            coqui = Coqui()
+
+        result = coqui._select_model_per_language(language_models)
+        assert result == {
+            "ca": "tts_models/ca/custom/vits",
+            "en": "tts_models/en/ljspeech/vits",
+            "de": "tts_models/de/thorsten/glow-tts",
+            "fr": "tts_models/fr/mai/tacotron2-DDC",
+        }
+
+    def _write_config(self, directory, config):
+        config_path = os.path.join(directory, "config.json")
+        with open(config_path, "w") as f:
+            json.dump(config, f)
+        return config_path
+
+    def test_read_speakers_from_config(self):
+        with tempfile.TemporaryDirectory() as directory:
+            speakers_file = os.path.join(directory, "speaker_ids.json")
+            with open(speakers_file, "w") as f:
+                json.dump({"pau": 0, "ona": 1}, f)
+            config_path = self._write_config(
+                directory,
+                {
+                    "model_args": {
+                        "use_speaker_embedding": True,
+                        "speakers_file": speakers_file,
+                    }
+                },
+            )
+
+            assert _read_speakers_from_config(config_path) == ["pau", "ona"]
+
+    def test_read_speakers_from_config_single_speaker(self):
+        with tempfile.TemporaryDirectory() as directory:
+            config_path = self._write_config(directory, {"model_args": {}})
+
+            assert _read_speakers_from_config(config_path) is None
@@ -0,0 +1,98 @@
+# Copyright 2024 Jordi Mas i Hernàndez <jmas@softcatala.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import os
+import stat
+import sys
+import threading
+import time
+
+import pytest
+
+from open_dubbing import daemon
+
+
+@pytest.fixture
+def runtime_directory(tmp_path, monkeypatch):
+    monkeypatch.delenv("XDG_RUNTIME_DIR", raising=False)
+    monkeypatch.setattr(daemon.tempfile, "gettempdir", lambda: str(tmp_path))
+    return tmp_path
+
+
+unix_only = pytest.mark.skipif(
+    sys.platform == "win32", reason="Uses Unix sockets and permissions"
+)
+
+
+def _args(**kwargs):
+    return argparse.Namespace(
+        input_file="video.mp4",
+        output_directory="output",
+        target_language="cat",
+        tts="mms",
+        **kwargs,
+    )
+
+
+class TestDaemon:
+
+    @unix_only
+    def test_runtime_directory_is_private(self, runtime_directory):
+        directory = daemon._get_runtime_directory()
+
+        assert os.path.dirname(directory) == str(runtime_directory)
+        assert stat.S_IMODE(os.stat(directory).st_mode) == 0o700
+
+    @unix_only
+    def test_runtime_directory_not_private(self, runtime_directory):
+        directory = runtime_directory / f"open-dubbing-{os.getuid()}"
+        directory.mkdir(mode=0o777)
+        os.chmod(directory, 0o777)
+
+        with pytest.raises(PermissionError):
+            daemon._get_runtime_directory()
+
+    def test_dispatch_without_daemon(self, runtime_directory):
+        address = daemon.get_default_address()
+        assert not daemon.dispatch(address=address, args=_args())
+
+    @unix_only
+    def test_serve_and_dispatch(self, runtime_directory):
+        address = daemon.get_default_address()
+        dubbed = []
+        threading.Thread(
+            target=daemon.serve,
+            kwargs={
+                "address": address,
+                "args": _args(),
+                "dub": lambda args: dubbed.append(args.input_file),
+            },
+            daemon=True,
+        ).start()
+        # The socket is listening shortly after it is created
+        deadline = time.monotonic() + 10
+        while not os.path.exists(address):
+            assert time.monotonic() < deadline, "The daemon did not start"
+            time.sleep(0.01)
+        time.sleep(0.1)
+
+        assert stat.S_IMODE(os.stat(address).st_mode) == 0o600
+        assert daemon.dispatch(address=address, args=_args())
+        assert dubbed == [os.path.abspath("video.mp4")]
+
+        # A client without the key is rejected
+        with open(daemon._get_authkey_path(address), "wb") as file:
+            file.write(b"wrong key")
+        assert not daemon.dispatch(address=address, args=_args())
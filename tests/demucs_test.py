@@ -12,228 +12,101 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import subprocess
-import unittest.mock as mock
+import os
+import tempfile
 
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
-import pytest
+import numpy as np
+import torch
 
-from open_dubbing.demucs import Demucs
+from pydub import AudioSegment
 
+from open_dubbing.demucs import Demucs
 
-class TestBuildDemucsCommand:
-
-    @pytest.mark.parametrize(
-        "test_name, kwargs, expected_command",
-        [
-            (
-                "basic",
-                {},
-                (
-                    'python -m demucs.separate -o "test" --device cpu --shifts 1'
-                    " --overlap 0.25 -j 0 --two-stems vocals --mp3"
-                    ' --mp3-bitrate 320 --mp3-preset 2 "audio.mp3"'
-                ),
-            ),
-            (
-                "flac",
-                {"flac": True, "mp3": False},
-                (
-                    'python -m demucs.separate -o "test" --device cpu --shifts 1'
-                    " --overlap 0.25 -j 0 --two-stems vocals --flac"
-                    ' "audio.mp3"'
-                ),
-            ),
-            (
-                "int24",
-                {"int24": True, "mp3": False},
-                (
-                    'python -m demucs.separate -o "test" --device cpu --shifts 1'
-                    " --overlap 0.25 -j 0 --two-stems vocals --int24"
-                    ' "audio.mp3"'
-                ),
-            ),
-            (
-                "float32",
-                {"float32": True, "mp3": False},
-                (
-                    'python -m demucs.separate -o "test" --device cpu --shifts 1'
-                    " --overlap 0.25 -j 0 --two-stems vocals --float32"
-                    ' "audio.mp3"'
-                ),
-            ),
-            (
-                "segment",
-                {"segment": 60},
-                (
-                    'python -m demucs.separate -o "test" --device cpu --shifts 1'
-                    " --overlap 0.25 -j 0 --two-stems vocals --segment"
-                    ' 60 --mp3 --mp3-bitrate 320 --mp3-preset 2 "audio.mp3"'
-                ),
-            ),
-            (
-                "no_split",
-                {"split": False},
-                (
-                    'python -m demucs.separate -o "test" --device cpu --shifts 1'
-                    " --overlap 0.25 -j 0 --two-stems vocals --no-split"
-                    ' --mp3 --mp3-bitrate 320 --mp3-preset 2 "audio.mp3"'
-                ),
-            ),
-        ],
-    )
-    def test_build_demucs_command(self, test_name, kwargs, expected_command):
-        assert (
-            Demucs().build_demucs_command(
-                audio_file="audio.mp3",
-                output_directory="test",
-                device="cpu",
-                **kwargs,
-            )
-            == expected_command
-        )
 
-    def test_raise_error_int24_float32(self):
-        with pytest.raises(
-            ValueError, match="Cannot set both int24 and float32 to True."
+class TestSeparate:
+
+    def _get_model(self):
+        model = MagicMock()
+        model.samplerate = 44100
+        model.audio_channels = 2
+        model.sources = ["drums", "bass", "other", "vocals"]
+        return model
+
+    def test_separate(self):
+        model = self._get_model()
+        wav = torch.rand(2, 100)
+        wav_copy = wav.clone()
+        sources = torch.rand(1, 4, 2, 100) / 4
+        with patch("open_dubbing.demucs._load_model", return_value=model), patch(
+            "open_dubbing.demucs.AudioFile"
+        ) as audio_file, patch(
+            "open_dubbing.demucs.apply_model", return_value=sources.clone()
         ):
-            Demucs().build_demucs_command(
-                audio_file="audio.mp3",
-                output_directory="test",
-                device="cpu",
-                int24=True,
-                float32=True,
+            audio_file.return_value.read.return_value = wav
+            vocals, background = Demucs().separate(audio_file="/tmp/audio.mp3")
+
+        ref = wav_copy.mean(0)
+        expected = sources[0] * ref.std() + ref.mean()
+        for audio, source in [(vocals, expected[3]), (background, expected[:3].sum(0))]:
+            assert audio.frame_rate == 44100
+            assert audio.channels == 2
+            samples = np.array(audio.get_array_of_samples()).reshape(-1, 2).T
+            # demucs rescales the tracks that clip
+            source = source / max(1, 1.01 * source.abs().max().item())
+            assert np.allclose(samples / (2**15 - 1), source.numpy(), atol=1e-4)
+
+    def test_save(self):
+        vocals = AudioSegment.silent(duration=100, frame_rate=44100)
+        background = AudioSegment.silent(duration=100, frame_rate=44100)
+        with tempfile.TemporaryDirectory() as output_directory:
+            vocals_file, background_file = Demucs().save(
+                audio_file="/tmp/audio.mp3",
+                output_directory=output_directory,
+                vocals=vocals,
+                background=background,
             )
 
-
-class TestExtractCommandInfo:
-
-    @pytest.mark.parametrize(
-        "test_name, command, expected_folder, expected_ext, expected_input",
-        [
-            (
-                "Standard MP3",
-                (
-                    "python3 -m demucs.separate -o 'out_folder' --mp3 --two-stems"
-                    ' "audio.mp3"'
-                ),
-                "out_folder",
-                ".mp3",
-                "audio",
-            ),
-            (
-                "FLAC Output",
-                (
-                    "python3 -m demucs.separate -o 'results' --flac --shifts 5"
-                    " 'audio.flac'"
-                ),
-                "results",
-                ".flac",
-                "audio",
-            ),
-            (
-                "WAV with Int24",
-                "python3 -m demucs.separate -o 'wav_output' --int24 'song.wav'",
-                "wav_output",
-                ".wav",
-                "song",
-            ),
-            (
-                "WAV with Float32",
-                "python3 -m demucs.separate -o 'float32_dir' --float32 'music.mp3'",
-                "float32_dir",
-                ".wav",
-                "music",
-            ),
-        ],
-    )
-    def test_valid_command(
-        self, test_name, command, expected_folder, expected_ext, expected_input
-    ):
-        result = Demucs()._extract_command_info(command)
-        assert result == (
-            expected_folder,
-            expected_ext,
-            expected_input,
-        ), f"Failed for command: {command}"
-
-
-class TestAssembleSplitAudioFilePaths:
-
-    @pytest.mark.parametrize(
-        "test_name, command, expected_vocals_path, expected_background_path",
-        [
-            (
-                "Standard MP3",
-                (
-                    'python3 -m demucs.separate -o "test" --device cpu --shifts 1'
-                    " --overlap 0.25 --clip_mode rescale -j 0 --two-stems --segment"
-                    ' 60 "audio.mp3"'
-                ),
-                "test/htdemucs/audio/vocals.wav",
-                "test/htdemucs/audio/no_vocals.wav",
-            ),
-            (
-                "FLAC Output",
-                "python3 -m demucs.separate -o 'out_flac' --flac \"audio.mp3\"",
-                "out_flac/htdemucs/audio/vocals.flac",
-                "out_flac/htdemucs/audio/no_vocals.flac",
-            ),
-            (
-                "WAV Output (int24)",
-                "python3 -m demucs.separate -o 'out_wav' --int24 \"audio.mp3\"",
-                "out_wav/htdemucs/audio/vocals.wav",
-                "out_wav/htdemucs/audio/no_vocals.wav",
-            ),
-            (
-                "WAV Output (float32)",
-                "python3 -m demucs.separate -o 'out_float32' --float32 \"audio.mp3\"",
-                "out_float32/htdemucs/audio/vocals.wav",
-                "out_float32/htdemucs/audio/no_vocals.wav",
-            ),
-        ],
-    )
-    def test_assemble_paths(
-        self, test_name, command, expected_vocals_path, expected_background_path
-    ):
-        """Tests assembling paths for various Demucs commands and formats."""
-        actual_vocals_path, actual_background_path = (
-            Demucs().assemble_split_audio_file_paths(command)
-        )
-        assert [actual_vocals_path, actual_background_path] == [
-            expected_vocals_path,
-            expected_background_path,
-        ], f"Failed for command: {command}"
-
-
-class TestExecuteDemucsCommand:
-
-    @patch("subprocess.run")
-    def test_execute_command_success(self, mock_run):
-        mock_run.return_value.stdout = "Command executed successfully"
-        mock_run.return_value.stderr = ""
-        mock_run.return_value.returncode = 0
-        Demucs().execute_demucs_command(command="echo 'Command executed successfully'")
-        mock_run.assert_called_once_with(
-            "echo 'Command executed successfully'",
-            shell=True,
-            capture_output=True,
-            text=True,
-            check=True,
-        )
-
-    @mock.patch("subprocess.run")
-    def test_execute_command_error(self, mock_run):
-        """Test if DemucsCommandError is raised when command fails."""
-        mock_run.side_effect = subprocess.CalledProcessError(
-            1, "demucs.separate", stderr="Some Demucs error message"
-        )
-
-        with pytest.raises(
-            Exception,
-            match=r"Error in final attempt to separate audio:.*\nSome Demucs error message",
+            assert vocals_file == f"{output_directory}/htdemucs/audio/vocals.mp3"
+            assert background_file == f"{output_directory}/htdemucs/audio/no_vocals.mp3"
+            assert os.path.exists(vocals_file)
+            assert os.path.exists(background_file)
+
+    def test_apply_model_with_shifts(self):
+        model = self._get_model()
+        wav = torch.rand(2, 100)
+
+        def _apply_model(model, batch, **kwargs):
+            # An identity model returns the input as every source
+            return batch[:, None].repeat(1, 4, 1, 1)
+
+        with patch("open_dubbing.demucs.apply_model", side_effect=_apply_model), patch(
+            "open_dubbing.demucs.psutil.virtual_memory"
+        ) as virtual_memory:
+            # Only room for two shifts per batch
+            virtual_memory.return_value.available = 2 * 2 * 4 * 4 * 2 * (100 + 22050)
+            sources = Demucs()._apply_model(model, wav, shifts=5, overlap=0.25)
+
+        assert sources.shape == (4, 2, 100)
+        assert torch.allclose(sources, wav[None].repeat(4, 1, 1))
+
+    def test_separate_sources_out_of_memory(self):
+        model = self._get_model()
+        model.segment = 8
+        wav = torch.rand(2, 100)
+        segments = []
+
+        def _apply_model(model, wav, **kwargs):
+            segments.append(kwargs["segment"])
+            if len(segments) < 3:
+                raise torch.cuda.OutOfMemoryError()
+            return wav.repeat(1, 4, 1, 1)
+
+        with patch("open_dubbing.demucs.apply_model", side_effect=_apply_model), patch(
+            "torch.cuda.empty_cache"
         ):
-            Demucs().execute_demucs_command(
-                "python3 -m demucs.separate -o out_folder --mp3 --two-stems audio.mp3"
-            )
+            sources = Demucs()._separate_sources(model, wav, shifts=1, overlap=0.25)
+
+        assert segments == [None, 4, 2]
+        assert sources.shape == (4, 2, 100)
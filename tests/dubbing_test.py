@@ -14,10 +14,14 @@
 
 """Tests for utility functions in dubbing.py."""
 
+import json
 import os
 import tempfile
 
+from unittest.mock import MagicMock, patch
+
 import pytest
+import torch
 
 from open_dubbing import dubbing
 
@@ -33,6 +37,8 @@ class TestRenameInputFile:
             ),
             ("Test-File-2024-with-Hyphens.mov", "testfile2024withhyphens.mov"),
             ("lowercasefilename.avi", "lowercasefilename.avi"),
+            ("2024.mp4", "2024.mp4"),
+            ("dir/Vídeo 1.mp4", "dir/vdeo1.mp4"),
         ],
     )
     def test_rename(self, original_file, expected_result):
@@ -63,3 +69,48 @@ class TestOverwriteInputFile:
 
             dubbing.overwrite_input_file(original_full_path, expected_full_path)
             assert os.path.exists(expected_full_path)
+
+
+class TestLoadPyannotePipeline:
+
+    def _load(self, device):
+        pipeline = MagicMock()
+        pipeline._segmentation.model = torch.nn.Sequential(torch.nn.Linear(4, 4))
+        pipeline._embedding.model_ = torch.nn.Sequential(torch.nn.Linear(4, 4))
+        with patch.object(dubbing.Pipeline, "from_pretrained", return_value=pipeline):
+            return dubbing.load_pyannote_pipeline(
+                hugging_face_token="token", device=device
+            )
+
+    def test_quantized_on_cpu(self):
+        pipeline = self._load("cpu")
+        for model in [pipeline._segmentation.model, pipeline._embedding.model_]:
+            assert not isinstance(model[0], torch.nn.Linear)
+
+    def test_not_quantized_on_cuda(self):
+        pipeline = self._load("cuda")
+        for model in [pipeline._segmentation.model, pipeline._embedding.model_]:
+            assert isinstance(model[0], torch.nn.Linear)
+
+
+class TestDumpJson:
+
+    @pytest.mark.parametrize("use_orjson", [True, False])
+    def test_dump_json(self, use_orjson):
+        if use_orjson:
+            pytest.importorskip("orjson")
+            orjson = dubbing.orjson
+        else:
+            orjson = None
+
+        data = {
+            "utterances": [
+                {"text": "Bon dia,\n  què tal?", "start": 0.5, "for_dubbing": True},
+                {"text": "", "speakers": [], "voice": {}, "end": None},
+            ]
+        }
+        with patch.object(dubbing, "orjson", orjson):
+            result = dubbing._dump_json(data)
+
+        # Same output with and without orjson
+        assert result == json.dumps(data, ensure_ascii=False, indent=4).encode("utf-8")
@@ -14,6 +14,11 @@
 
 import os
 
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+
 from open_dubbing.speech_to_text_faster_whisper import SpeechToTextFasterWhisper
 
 
@@ -41,3 +46,101 @@ class TestTextToSpeechFasterWhisper:
         languages = stt.get_languages()
         assert len(languages) == 100
         assert "eng" in languages
+
+    def test_get_languages_english_only(self):
+        stt = SpeechToTextFasterWhisper(model_name="distil")
+        assert stt.get_languages() == ["eng"]
+
+    def test_get_num_workers(self):
+        assert SpeechToTextFasterWhisper(cpu_threads=2)._get_num_workers() == 1
+        assert SpeechToTextFasterWhisper(cpu_threads=8)._get_num_workers() == 2
+        assert (
+            SpeechToTextFasterWhisper(device="cuda", cpu_threads=8)._get_num_workers()
+            == 1
+        )
+
+    def test_get_num_workers_default_threads(self):
+        with patch(
+            "open_dubbing.speech_to_text_faster_whisper.torch.get_num_threads",
+            return_value=8,
+        ):
+            stt = SpeechToTextFasterWhisper()
+            assert stt._get_cpu_threads() == 8
+            assert stt._get_num_workers() == 2
+
+    def test_default_batch_size(self):
+        assert SpeechToTextFasterWhisper().batch_size == 1
+        assert SpeechToTextFasterWhisper(device="cuda").batch_size == 8
+        assert SpeechToTextFasterWhisper(batch_size=4).batch_size == 4
+
+    def test_get_clips(self):
+        stt = SpeechToTextFasterWhisper(device="cuda")
+        # The third audio is longer than 30 seconds
+        audios = [
+            np.zeros(2 * 16000, dtype=np.float32),
+            np.zeros(10 * 16000, dtype=np.float32),
+            np.zeros(35 * 16000, dtype=np.float32),
+        ]
+
+        audio, clip_timestamps, clip_audios = stt._get_clips(audios)
+
+        assert len(audio) == 47 * 16000
+        assert clip_timestamps == [
+            {"start": 0, "end": 2 * 16000},
+            {"start": 2 * 16000, "end": 12 * 16000},
+            {"start": 12 * 16000, "end": 42 * 16000},
+            {"start": 42 * 16000, "end": 47 * 16000},
+        ]
+        assert clip_audios == [0, 1, 2, 2]
+
+    def test_transcribe_files_batched(self):
+        stt = SpeechToTextFasterWhisper(device="cuda")
+        stt._batched_model = MagicMock()
+        # Two adjacent utterances, the last word of the first one ends after
+        # the second one starts
+        words = [
+            SimpleNamespace(start=0.0, end=1.0, word=" One"),
+            SimpleNamespace(start=1.8, end=2.4, word=" two."),
+        ]
+        segments = [
+            SimpleNamespace(start=0.0, end=2.0, text=" One two.", words=words),
+            SimpleNamespace(start=1.9995, end=5.0, text=" Three.", words=None),
+        ]
+        stt._batched_model.transcribe.return_value = (iter(segments), None)
+        audios = [np.zeros(2 * 16000), np.zeros(3 * 16000)]
+        with patch(
+            "open_dubbing.speech_to_text_faster_whisper.decode_audio",
+            side_effect=audios,
+        ):
+            texts = stt._transcribe_batch(
+                vocals_filepaths=["1.wav", "2.wav"], source_language_iso_639_1="en"
+            )
+
+        assert texts == ["One two.", "Three."]
+        kwargs = stt._batched_model.transcribe.call_args.kwargs
+        assert kwargs["clip_timestamps"] == [
+            {"start": 0, "end": 32000},
+            {"start": 32000, "end": 80000},
+        ]
+        assert kwargs["without_timestamps"]
+
+    def test_get_compute_type(self):
+        assert SpeechToTextFasterWhisper()._get_compute_type() == "int8"
+        with patch("torch.cuda.get_device_capability", return_value=(8, 6)):
+            stt = SpeechToTextFasterWhisper(device="cuda:1")
+            assert stt._get_compute_type() == "int8_float16"
+        with patch("torch.cuda.get_device_capability", return_value=(7, 0)):
+            stt = SpeechToTextFasterWhisper(device="cuda")
+            assert stt._get_compute_type() == "float16"
+            stt = SpeechToTextFasterWhisper(device="cuda", compute_type="float32")
+            assert stt._get_compute_type() == "float32"
+
+    def test_use_flash_attention(self):
+        assert not SpeechToTextFasterWhisper()._use_flash_attention("int8")
+        with patch("torch.cuda.get_device_capability", return_value=(8, 6)):
+            stt = SpeechToTextFasterWhisper(device="cuda")
+            assert stt._use_flash_attention("int8_float16")
+            assert not stt._use_flash_attention("float32")
+        with patch("torch.cuda.get_device_capability", return_value=(7, 5)):
+            stt = SpeechToTextFasterWhisper(device="cuda")
+            assert not stt._use_flash_attention("float16")
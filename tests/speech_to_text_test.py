@@ -12,18 +12,21 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import array
 import os
 import tempfile
 
 from collections import namedtuple
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
 import numpy as np
 import pytest
 
 from faster_whisper import WhisperModel
 from moviepy.audio.AudioClip import AudioArrayClip
+from pydub import AudioSegment
 
+from open_dubbing.speech_to_text import SpeechToText
 from open_dubbing.speech_to_text_faster_whisper import SpeechToTextFasterWhisper
 
 
@@ -55,6 +58,24 @@ class TestTranscribe:
         )
         assert transcribed_text == "Test."
 
+    def test_transcribe_batched(self):
+        mock_model = MagicMock(spec=WhisperModel)
+        mock_batched_model = MagicMock()
+        Segment = namedtuple("Segment", ["text"])
+        mock_batched_model.transcribe.return_value = [Segment(text="Test.")], None
+        spt = SpeechToTextFasterWhisper(batch_size=4)
+        spt.model = mock_model
+        spt._batched_model = mock_batched_model
+        transcribed_text = spt._transcribe(
+            vocals_filepath=self.silence_audio,
+            source_language_iso_639_1="eng",
+        )
+        assert transcribed_text == "Test."
+        mock_batched_model.transcribe.assert_called_once_with(
+            self.silence_audio, "eng", batch_size=4, vad_filter=True
+        )
+        mock_model.transcribe.assert_not_called()
+
     @pytest.mark.parametrize(
         "no_dubbing_phrases, expected_for_dubbing",
         [
@@ -88,6 +109,37 @@ class TestTranscribe:
         ]
         assert transcribed_audio_chunks == expected_result
 
+    def test_transcribe_chunks_batch(self):
+        utterance_metadata = [
+            dict(path="chunk_0.0_5.0.wav", start=0.0, end=5.0),
+            dict(path="chunk_5.0_5.2.wav", start=5.0, end=5.2),
+            dict(path="chunk_6.0_8.0.wav", start=6.0, end=8.0),
+        ]
+        spt = SpeechToTextFasterWhisper()
+        with patch.object(
+            spt, "_transcribe_batch", return_value=["Hello.", "Goodbye."]
+        ) as transcribe_batch:
+            transcribed_audio_chunks = spt.transcribe_audio_chunks(
+                utterance_metadata=utterance_metadata,
+                source_language="eng",
+                no_dubbing_phrases=[],
+            )
+
+        transcribe_batch.assert_called_once_with(
+            vocals_filepaths=["chunk_0.0_5.0.wav", "chunk_6.0_8.0.wav"],
+            source_language_iso_639_1="en",
+        )
+        assert [chunk["text"] for chunk in transcribed_audio_chunks] == [
+            "Hello.",
+            "",
+            "Goodbye.",
+        ]
+        assert [chunk["for_dubbing"] for chunk in transcribed_audio_chunks] == [
+            True,
+            False,
+            True,
+        ]
+
     def test_transcribe_chunks_exception(self):
         no_dubbing_phrases = ["goodbye"]
         mock_model = MagicMock(spec=WhisperModel)
@@ -186,3 +238,44 @@ class TestAddSpeakerInfo:
         )
 
         assert [("SPEAKER_01", "chunk_114.mp3")] == result
+
+
+class TestDetectLanguage:
+
+    def test_detect_language_silence(self):
+        with tempfile.NamedTemporaryFile(suffix=".wav") as silence_file:
+            AudioSegment.silent(duration=5000).export(silence_file.name, format="wav")
+            stt = SpeechToTextFasterWhisper()
+            with patch.object(stt, "_get_audio_language") as get_audio_language:
+                with pytest.raises(ValueError):
+                    stt.detect_language(silence_file.name)
+                get_audio_language.assert_not_called()
+
+
+class TestPcm16ToFloat32:
+
+    def test_pcm16_to_float32(self):
+        samples = array.array("h", [0, 16384, -32768])
+        audio = AudioSegment(
+            data=samples.tobytes(), sample_width=2, frame_rate=16000, channels=1
+        )
+
+        for value in [samples, audio]:
+            converted = SpeechToText._pcm16_to_float32(value)
+            assert converted.dtype == np.float32
+            assert converted.tolist() == [0.0, 0.5, -1.0]
+
+
+class TestModelAliases:
+
+    @pytest.mark.parametrize(
+        "model_name, expected",
+        [
+            ("turbo", "large-v3-turbo"),
+            ("distil", "distil-large-v3"),
+            ("medium", "medium"),
+        ],
+    )
+    def test_model_aliases(self, model_name, expected):
+        stt = SpeechToTextFasterWhisper(model_name=model_name)
+        assert stt.model_name == expected
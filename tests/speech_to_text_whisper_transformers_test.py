@@ -14,6 +14,10 @@
 
 import os
 
+from unittest.mock import patch
+
+import torch
+
 from open_dubbing.speech_to_text_whisper_transformers import (
     SpeechToTextWhisperTransfomers,
 )
@@ -44,3 +48,45 @@ class TestSpeechToTextWhisperTransfomers:
         languages = stt.get_languages()
         assert len(languages) == 100
         assert "eng" in languages
+
+    def test_get_languages_english_only(self):
+        stt = SpeechToTextWhisperTransfomers(model_name="distil-large-v3")
+        assert stt.get_languages() == ["eng"]
+
+    def test_load_model_int8_on_cpu(self):
+        with patch(
+            "open_dubbing.speech_to_text_whisper_transformers.WhisperProcessor.from_pretrained"
+        ), patch(
+            "open_dubbing.speech_to_text_whisper_transformers.WhisperForConditionalGeneration.from_pretrained"
+        ) as from_pretrained, patch(
+            "open_dubbing.speech_to_text_whisper_transformers.quantization.quantize_dynamic"
+        ) as quantize_dynamic:
+            stt = SpeechToTextWhisperTransfomers()
+            stt.load_model()
+
+            assert from_pretrained.call_args.kwargs["torch_dtype"] == torch.float32
+            quantize_dynamic.assert_called_once_with(
+                from_pretrained.return_value.to.return_value, {torch.nn.Linear}
+            )
+            assert stt.model == quantize_dynamic.return_value
+
+    def test_load_model_fp16_on_cpu_with_bf16(self):
+        with patch(
+            "open_dubbing.speech_to_text_whisper_transformers.WhisperProcessor.from_pretrained"
+        ), patch(
+            "open_dubbing.speech_to_text_whisper_transformers.WhisperForConditionalGeneration.from_pretrained"
+        ) as from_pretrained, patch(
+            "open_dubbing.speech_to_text_whisper_transformers.quantization.is_cpu_bf16_supported",
+            return_value=True,
+        ):
+            stt = SpeechToTextWhisperTransfomers(precision="fp16")
+            stt.load_model()
+
+            assert from_pretrained.call_args.kwargs["torch_dtype"] == torch.bfloat16
+            assert stt.model == from_pretrained.return_value.to.return_value
+
+    def test_get_max_new_tokens(self):
+        get_max_new_tokens = SpeechToTextWhisperTransfomers._get_max_new_tokens
+        assert get_max_new_tokens(16000) == 28
+        assert get_max_new_tokens(30 * 16000) == 376
+        assert get_max_new_tokens(60 * 16000) == 444
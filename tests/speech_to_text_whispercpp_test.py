@@ -0,0 +1,51 @@
+# Copyright 2024 Jordi Mas i Hernàndez <jmas@softcatala.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from open_dubbing import speech_to_text_whispercpp
+from open_dubbing.speech_to_text_whispercpp import SpeechToTextWhisperCpp
+
+
+class TestSpeechToTextWhisperCpp:
+
+    def test_get_ggml_model_name(self):
+        stt = SpeechToTextWhisperCpp(model_name="large-v3-turbo", quant="q5_0")
+        assert stt._get_ggml_model_name() == "large-v3-turbo-q5_0"
+
+    def test_get_ggml_model_name_f16(self):
+        stt = SpeechToTextWhisperCpp(model_name="medium", quant="f16")
+        assert stt._get_ggml_model_name() == "medium"
+
+    def test_get_params(self):
+        assert SpeechToTextWhisperCpp(cpu_threads=4)._get_params()["n_threads"] == 4
+        assert "n_threads" not in SpeechToTextWhisperCpp()._get_params()
+
+    def test_is_model_available(self, monkeypatch):
+        monkeypatch.setattr(
+            speech_to_text_whispercpp,
+            "AVAILABLE_MODELS",
+            ["large-v3", "large-v3-q5_0", "medium-q8_0"],
+        )
+
+        assert SpeechToTextWhisperCpp(
+            model_name="large-v3", quant="q5_0"
+        ).is_model_available()
+        assert SpeechToTextWhisperCpp(
+            model_name="large-v3", quant="f16"
+        ).is_model_available()
+        assert not SpeechToTextWhisperCpp(
+            model_name="large-v3", quant="q8_0"
+        ).is_model_available()
+        assert not SpeechToTextWhisperCpp(
+            model_name="distil", quant="q8_0"
+        ).is_model_available()
@@ -73,6 +73,15 @@ class TestTextToSpeech:
             expected_result = 90000 / 60000
             assert result == expected_result
 
+    def test_get_duration_without_libsndfile_support(self):
+        with patch(
+            "open_dubbing.text_to_speech.soundfile.info",
+            side_effect=RuntimeError("Format not recognised"),
+        ), patch("open_dubbing.text_to_speech.AudioSegment.from_file") as from_file:
+            from_file.return_value.duration_seconds = 1.5
+
+            assert TextToSpeechUT._get_duration("dubbed.mp3") == 1.5
+
     @pytest.mark.parametrize(
         "input_data, expected_result",
         [
@@ -105,6 +114,7 @@ class TestTextToSpeech:
         "calculated_speed, expect_adjust_called, expected_final_speed",
         [
             (0.5, False, 1.0),  # Speed below 1.0 is 1.0
+            (1.01, False, 1.0),  # Speed close to 1.0 is not adjusted
             (1.2, True, 1.2),  # Speed at 1.2, should adjust speed
             (1.5, True, 1.3),  # Speed exceeds 1.2, clamped to max 1.2
         ],
@@ -161,6 +171,98 @@ class TestTextToSpeech:
 
             assert result[0]["speed"] == expected_final_speed
 
+    @pytest.mark.parametrize(
+        "speed, expected_filter",
+        [
+            (1.3, "atempo=1.3000"),
+            (3.0, "atempo=2.0,atempo=1.5000"),
+        ],
+    )
+    def test_get_atempo_filter(self, speed, expected_filter):
+        assert TextToSpeechUT._get_atempo_filter(speed) == expected_filter
+
+    def test_assign_voices(self):
+        tts = TextToSpeechUT()
+        voices = [
+            Voice(name="male_1", gender="Male"),
+            Voice(name="female_1", gender="Female"),
+            Voice(name="male_2", gender="Male"),
+        ]
+        utterance_metadata = [
+            {"speaker_id": "speaker_01", "ssml_gender": "Male"},
+            {"speaker_id": "speaker_02", "ssml_gender": "Female"},
+            {"speaker_id": "speaker_01", "ssml_gender": "Female"},
+        ]
+
+        with patch.object(tts, "get_available_voices", return_value=voices):
+            result = tts.assign_voices(
+                utterance_metadata=utterance_metadata,
+                target_language="cat",
+                target_language_region="",
+            )
+
+        assert result == {"speaker_01": "male_1", "speaker_02": "female_1"}
+
+    def test_dub_utterances_next_start(self):
+        tts = TextToSpeechUT(max_workers=1)
+        utterance_metadata = [
+            {"start": 1.0, "for_dubbing": True},
+            {"start": 2.0, "for_dubbing": False},
+            {"start": 2.0, "for_dubbing": True},
+            {"start": 2.0, "for_dubbing": True},
+            {"start": 3.0, "for_dubbing": True},
+        ]
+
+        with patch.object(tts, "_dub_utterance") as dub_utterance:
+            tts.dub_utterances(
+                utterance_metadata=utterance_metadata,
+                output_directory="/output",
+                target_language="en",
+            )
+
+        next_starts = [
+            call.kwargs["next_start"] for call in dub_utterance.call_args_list
+        ]
+        assert next_starts == [
+            tts.get_start_time_of_next_speech_utterance(
+                utterance_metadata=utterance_metadata, from_time=utterance["start"]
+            )
+            for utterance in utterance_metadata
+        ]
+        assert next_starts == [2.0, 3.0, 3.0, 3.0, None]
+
+    def test_run_ffmpeg(self):
+        with patch("open_dubbing.text_to_speech.subprocess.run") as run:
+            TextToSpeechUT()._run_ffmpeg(["-i", "in file.wav", "out file.mp3"])
+
+            command = run.call_args.args[0]
+            assert command == [
+                "ffmpeg",
+                "-y",
+                "-nostdin",
+                "-i",
+                "in file.wav",
+                "out file.mp3",
+            ]
+            assert run.call_args.kwargs["check"]
+
+    def test_dub_utterances_parallel_keeps_order(self):
+        tts = TextToSpeechUT(max_workers=4)
+        utterance_metadata = [
+            {"for_dubbing": False, "start": start, "end": start + 1}
+            for start in range(10)
+        ]
+
+        result = tts.dub_utterances(
+            utterance_metadata=utterance_metadata,
+            output_directory="/output",
+            target_language="en",
+        )
+
+        assert [utterance["dubbed_path"] for utterance in result] == [
+            f"chunk_{start}_{start + 1}.mp3" for start in range(10)
+        ]
+
     @pytest.mark.parametrize(
         "test_name, utterance_metadata, expected_result",
         [
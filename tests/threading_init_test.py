@@ -0,0 +1,44 @@
+# Copyright 2024 Jordi Mas i Hernàndez <jmas@softcatala.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+from unittest.mock import patch
+
+from open_dubbing import threading_init
+
+
+class TestThreadingInit:
+
+    def test_init(self):
+        with patch.dict(os.environ, {"MKL_NUM_THREADS": "2"}), patch(
+            "torch.set_num_threads"
+        ) as set_num_threads, patch(
+            "torch.set_num_interop_threads"
+        ) as set_num_interop_threads:
+            os.environ.pop("OMP_NUM_THREADS", None)
+            threads = threading_init.init(6)
+
+            assert threads == 6
+            assert os.environ["OMP_NUM_THREADS"] == "6"
+            assert os.environ["MKL_NUM_THREADS"] == "2"
+            assert os.environ["OPENBLAS_NUM_THREADS"] == "6"
+            set_num_threads.assert_called_once_with(6)
+            set_num_interop_threads.assert_called_once_with(3)
+
+    def test_init_default_threads(self):
+        with patch.dict(os.environ, {}), patch("os.cpu_count", return_value=8), patch(
+            "torch.set_num_threads"
+        ), patch("torch.set_num_interop_threads"):
+            assert threading_init.init(0) == 4
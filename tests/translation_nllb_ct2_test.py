@@ -0,0 +1,56 @@
+# Copyright 2024 Jordi Mas i Hernàndez <jmas@softcatala.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest.mock import MagicMock
+
+from open_dubbing.translation_nllb_ct2 import TranslationNLLBCT2
+
+
+class TestTranslationNLLBCT2:
+
+    def test_get_compute_type(self):
+        assert TranslationNLLBCT2()._get_compute_type() == "int8"
+        assert TranslationNLLBCT2(device="cuda")._get_compute_type() == "float16"
+        assert (
+            TranslationNLLBCT2(device="cuda", precision="int8")._get_compute_type()
+            == "int8_float16"
+        )
+        assert TranslationNLLBCT2(precision="fp16")._get_compute_type() == "float32"
+
+    def test_translate_texts(self):
+        translation = TranslationNLLBCT2()
+        translation.tokenizer = MagicMock()
+        translation.tokenizer.additional_special_tokens = ["cat_Latn", "eng_Latn"]
+        translation._get_tokenizer_nllb = lambda: translation.tokenizer
+        translation.tokenizer.convert_ids_to_tokens.side_effect = lambda ids: ids
+        translation.tokenizer.convert_tokens_to_ids.side_effect = lambda tokens: tokens
+        translation.tokenizer.encode.side_effect = lambda text: text.split()
+        translation.tokenizer.decode.side_effect = lambda tokens, **kwargs: " ".join(
+            tokens
+        )
+        translation._translator = MagicMock()
+        translation._translator.translate_batch.return_value = [
+            MagicMock(hypotheses=[["cat_Latn", "Hola"]]),
+            MagicMock(hypotheses=[["cat_Latn", "món"]]),
+        ]
+
+        translations = translation._translate_texts(
+            source_language="eng", target_language="cat", texts=["Hello", "world"]
+        )
+
+        assert translations == ["Hola", "món"]
+        args, kwargs = translation._translator.translate_batch.call_args
+        assert args[0] == [["Hello"], ["world"]]
+        assert kwargs["target_prefix"] == [["cat_Latn"], ["cat_Latn"]]
+        assert translation.tokenizer.src_lang == "eng_Latn"
@@ -14,6 +14,8 @@
 
 from unittest.mock import MagicMock, patch
 
+import torch
+
 from open_dubbing.translation_nllb import TranslationNLLB
 
 
@@ -66,3 +68,46 @@ class TestTranslationNLLB:
 
         assert len(pairs) == 6
         assert pairs == expected_pairs
+
+    def test_load_model_nllb_int8_on_cpu(self):
+        with patch(
+            "open_dubbing.translation_nllb.AutoModelForSeq2SeqLM.from_pretrained"
+        ) as from_pretrained, patch(
+            "open_dubbing.translation_nllb.quantization.quantize_dynamic"
+        ) as quantize_dynamic:
+            translation = TranslationNLLB()
+            translation.model_name = "facebook/nllb-200-1.3B"
+            model = translation._load_model_nllb("cpu")
+
+            assert from_pretrained.call_args.kwargs["torch_dtype"] == torch.float32
+            quantize_dynamic.assert_called_once_with(
+                from_pretrained.return_value, {torch.nn.Linear}
+            )
+            assert model == quantize_dynamic.return_value
+
+    def test_load_model_nllb_fp16_on_cuda(self):
+        with patch(
+            "open_dubbing.translation_nllb.AutoModelForSeq2SeqLM.from_pretrained"
+        ) as from_pretrained, patch(
+            "open_dubbing.translation_nllb.quantization.quantize_dynamic"
+        ) as quantize_dynamic:
+            translation = TranslationNLLB(device="cuda")
+            translation.model_name = "facebook/nllb-200-1.3B"
+            translation._load_model_nllb("cuda")
+
+            assert from_pretrained.call_args.kwargs["torch_dtype"] == torch.float16
+            quantize_dynamic.assert_not_called()
+            from_pretrained.return_value.to.assert_called_once_with("cuda")
+
+    def test_load_model_nllb_compile_on_cuda(self):
+        with patch(
+            "open_dubbing.translation_nllb.AutoModelForSeq2SeqLM.from_pretrained"
+        ) as from_pretrained, patch("torch.compile") as compile:
+            translation = TranslationNLLB(device="cuda", compile=True)
+            translation.model_name = "facebook/nllb-200-1.3B"
+            translation.tokenizer = MagicMock()
+            model = translation._load_model_nllb("cuda")
+
+            assert model == from_pretrained.return_value.to.return_value
+            compile.assert_called_once()
+            model.generate.assert_called_once()
@@ -17,6 +17,8 @@
 import os
 import tempfile
 
+from unittest.mock import patch
+
 import numpy as np
 
 from moviepy.audio.AudioClip import AudioArrayClip
@@ -99,3 +101,16 @@ class TestCombineAudioVideo:
                 target_language="en-US",
             )
             assert os.path.exists(output_path)
+
+
+class TestIsFfmpegInstalled:
+
+    def test_is_ffmpeg_installed_in_path(self):
+        VideoProcessing.is_ffmpeg_installed.cache_clear()
+        with patch("shutil.which", return_value="/usr/bin/ffmpeg"), patch(
+            "subprocess.run"
+        ) as run:
+            assert VideoProcessing.is_ffmpeg_installed()
+            assert VideoProcessing.is_ffmpeg_installed()
+            run.assert_not_called()
+        VideoProcessing.is_ffmpeg_installed.cache_clear()